@@ -0,0 +1,194 @@
+# Measure how update_registry scales with the number of nodes in the registry.
+#
+# For each registry size, a simulated node farm (see node_farm.py) is started in its own
+# process and update_registry is run against it in a fresh process so that the peak
+# memory usage of each run can be measured independently.
+#
+# Example:
+#
+#   python benchmarks/bench_update.py --sizes 10 100 1000 --hung 0.01 --malformed 0.05
+#
+# One json object is written per registry size with:
+#   - wall_seconds: wall time taken by update_registry
+#   - cpu_seconds: process CPU time taken by update_registry
+#   - peak_rss_kb: peak resident set size of the process
+#   - phases: CPU seconds spent in each phase (summed over all threads)
+#   - farm: how many simulated nodes had each behaviour
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import queue
+import resource
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+THIS_DIR = os.path.dirname(__file__)
+ROOT_DIR = os.path.dirname(THIS_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, "marble_node_registry"))
+sys.path.insert(0, THIS_DIR)
+
+from node_farm import FarmConfig, NodeFarm, generate_registry  # noqa: E402
+
+DEFAULT_SIZES = (10, 100, 1000, 10000)
+
+
+def _serve_farm(size: int, config: FarmConfig, ready: multiprocessing.Queue, stop: multiprocessing.Event) -> None:
+    farm = NodeFarm(size, config)
+    ready.put((farm.start(), farm.counts()))
+    stop.wait()
+    farm.stop()
+
+
+class PhaseTimer:
+    """
+    Accumulate the CPU time spent in functions of the updater by replacing them with timed wrappers.
+
+    thread_time is used so that time spent in worker threads is attributed to the right phase.
+    """
+
+    def __init__(self) -> None:
+        self.cpu = defaultdict(float)
+
+    def wrap(self, owner: object, attribute: str, phase: str, materialize: bool = False) -> None:
+        original = getattr(owner, attribute)
+
+        def timed(*args, **kwargs):
+            start = time.thread_time()
+            try:
+                result = original(*args, **kwargs)
+                return iter(list(result)) if materialize else result
+            finally:
+                self.cpu[phase] += time.thread_time() - start
+
+        setattr(owner, attribute, timed)
+
+
+def _run_update(size: int, port: int, options: dict, results: multiprocessing.Queue) -> None:
+    import fetch
+    import update
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        update.CURRENT_REGISTRY = os.path.join(tmp_dir, "node_registry.json")
+        update.DELTA_FILE = os.path.join(tmp_dir, "node_registry.delta.json")
+        update.HISTORY_DB = os.path.join(tmp_dir, "node_history.sqlite")
+        update.ARTIFACTS_DIR = os.path.join(tmp_dir, "artifacts")
+        update.CACHE_DIR = os.path.join(tmp_dir, "cache")
+        with open(update.CURRENT_REGISTRY, "w") as f:
+            json.dump(generate_registry(size, port), f)
+
+        timer = PhaseTimer()
+        timer.wrap(fetch, "get_json", "fetch")
+        timer.wrap(fetch.EndpointResponse, "json", "decode")
+        timer.wrap(update, "apply_migrations", "migrate")
+        timer.wrap(update.RegistryValidator, "validate_node", "validate")
+        timer.wrap(update.RegistryValidator, "iter_registry_errors", "validate", materialize=True)
+        for writer in ("_write_registry", "_write_artifacts", "_write_delta", "_remove_delta", "_write_history"):
+            timer.wrap(update, writer, "write")
+
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        # the updater reports on every node, keep the benchmark output readable
+        with open(os.devnull, "w") as devnull:
+            with contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+                update.update_registry(**options)
+        results.put(
+            {
+                "wall_seconds": time.perf_counter() - wall_start,
+                "cpu_seconds": time.process_time() - cpu_start,
+                "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                "phases": dict(timer.cpu),
+            }
+        )
+
+
+def benchmark(size: int, config: FarmConfig, options: dict) -> dict:
+    """
+    Run update_registry against a farm of size simulated nodes and return the measurements.
+    """
+    context = multiprocessing.get_context("spawn")
+    ready, stop = context.Queue(), context.Event()
+    farm = context.Process(target=_serve_farm, args=(size, config, ready, stop), daemon=True)
+    farm.start()
+    try:
+        port, counts = ready.get(timeout=60)
+        results = context.Queue()
+        runner = context.Process(target=_run_update, args=(size, port, options, results))
+        runner.start()
+        try:
+            result = _wait_for_result(runner, results)
+        finally:
+            if runner.is_alive():
+                runner.terminate()
+            runner.join()
+    finally:
+        stop.set()
+        farm.join(timeout=10)
+    return {"size": size, **result, "farm": counts}
+
+
+def _wait_for_result(runner: multiprocessing.Process, results: multiprocessing.Queue) -> dict:
+    """
+    Return the measurements put in results by runner, raise a RuntimeError if runner exits without putting them.
+    """
+    while True:
+        try:
+            return results.get(timeout=1)
+        except queue.Empty:
+            if runner.is_alive():
+                continue
+        # the measurements may have been put just before the runner exited
+        try:
+            return results.get(timeout=1)
+        except queue.Empty:
+            raise RuntimeError(f"update_registry did not complete (exit code {runner.exitcode})") from None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark update_registry against a simulated node farm.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="number of nodes per run")
+    parser.add_argument("--latency-median", type=float, default=0.05, help="median response latency in seconds")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="sigma of the lognormal latency")
+    for behaviour in ("hung", "slow_drip", "malformed"):
+        parser.add_argument(
+            f"--{behaviour.replace('_', '-')}", type=float, default=0.0, help=f"fraction of {behaviour} nodes"
+        )
+    parser.add_argument("--hang-seconds", type=float, default=60.0)
+    parser.add_argument("--drip-interval", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-connections", type=int, help="passed to update_registry")
+    parser.add_argument("--max-connections-per-host", type=int, help="passed to update_registry")
+    parser.add_argument("--output", help="append results to this file instead of printing them")
+    args = parser.parse_args()
+
+    config = FarmConfig(
+        latency_median=args.latency_median,
+        latency_sigma=args.latency_sigma,
+        behaviour_fractions={"hung": args.hung, "slow_drip": args.slow_drip, "malformed": args.malformed},
+        hang_seconds=args.hang_seconds,
+        drip_interval=args.drip_interval,
+        seed=args.seed,
+    )
+    options = {
+        key: value
+        for key, value in (
+            ("max_connections", args.max_connections),
+            ("max_connections_per_host", args.max_connections_per_host),
+        )
+        if value is not None
+    }
+    for size in args.sizes:
+        line = json.dumps(benchmark(size, config, options))
+        if args.output:
+            with open(args.output, "a") as f:
+                f.write(line + "\n")
+        else:
+            print(line, flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+# A local stand-in for a large number of Marble nodes.
+#
+# The farm is a single HTTP server that serves the /services and /version endpoints of
+# many simulated nodes at http://<host>:<port>/<node>/services and /<node>/version. Each
+# node is given its own loopback address (127.x.y.z) so that the updater sees every node
+# as a separate host, like it would in production.
+#
+# Every node is assigned a behaviour when the farm is created:
+#
+#   ok          respond after a latency drawn from the configured distribution
+#   hung        accept the connection but never respond (until hang_seconds have passed)
+#   slow_drip   send the body one byte at a time with drip_interval seconds between bytes
+#   malformed   respond with a body that is not valid json
+
+import json
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+THIS_DIR = os.path.dirname(__file__)
+ROOT_DIR = os.path.dirname(THIS_DIR)
+EXAMPLE_REGISTRY = os.path.join(ROOT_DIR, "doc", "node_registry.example.json")
+
+BEHAVIOURS = ("ok", "hung", "slow_drip", "malformed")
+
+
+@dataclass
+class FarmConfig:
+    """
+    How the simulated nodes behave.
+
+    Latencies (in seconds) are drawn from a lognormal distribution with the given median and sigma.
+    The fractions of nodes that are hung, slow_drip or malformed are given in behaviour_fractions, all other nodes
+    are ok.
+    """
+
+    latency_median: float = 0.05
+    latency_sigma: float = 0.5
+    behaviour_fractions: dict[str, float] = field(default_factory=dict)
+    hang_seconds: float = 60.0
+    drip_interval: float = 1.0
+    seed: int = 0
+
+
+def node_host(i: int) -> str:
+    """
+    Return a distinct loopback address for the ith node.
+    """
+    return f"127.{(i // 62500) % 256}.{(i // 250) % 250}.{i % 250 + 1}"
+
+
+def generate_registry(size: int, port: int) -> dict:
+    """
+    Return a registry of size nodes based on the example registry whose endpoints are served by the farm.
+    """
+    with open(EXAMPLE_REGISTRY) as f:
+        example = next(iter(json.load(f).values()))
+    for key in ("services", "last_updated", "version", "status"):
+        example.pop(key)
+    registry = {}
+    for i in range(size):
+        name = f"Node{i}"
+        base_url = f"http://{node_host(i)}:{port}/{name}"
+        links = [link for link in example["links"] if link["rel"] not in ("collection", "version")]
+        links.append({"rel": "collection", "type": "application/json", "href": f"{base_url}/services"})
+        links.append({"rel": "version", "type": "application/json", "href": f"{base_url}/version"})
+        registry[name] = {**example, "name": name, "links": links}
+    return registry
+
+
+def _example_services() -> bytes:
+    with open(EXAMPLE_REGISTRY) as f:
+        return json.dumps({"services": next(iter(json.load(f).values()))["services"]}).encode()
+
+
+class _FarmServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # the updater may open many connections at once
+    request_queue_size = 1024
+
+
+class NodeFarm:
+    """
+    Assign a behaviour and latency to each node and serve their endpoints.
+    """
+
+    def __init__(self, size: int, config: FarmConfig) -> None:
+        self.config = config
+        rng = random.Random(config.seed)
+        self.behaviours = {}
+        self.latencies = {}
+        for i in range(size):
+            name = f"Node{i}"
+            draw = rng.random()
+            self.behaviours[name] = "ok"
+            for behaviour, fraction in config.behaviour_fractions.items():
+                if draw < fraction:
+                    self.behaviours[name] = behaviour
+                    break
+                draw -= fraction
+            self.latencies[name] = rng.lognormvariate(0, config.latency_sigma) * config.latency_median
+        self.services = _example_services()
+        self.version = json.dumps({"version": "1.2.3"}).encode()
+        self.server: _FarmServer | None = None
+
+    def counts(self) -> dict[str, int]:
+        return {behaviour: list(self.behaviours.values()).count(behaviour) for behaviour in BEHAVIOURS}
+
+    def _handler(self) -> type[BaseHTTPRequestHandler]:
+        farm = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self) -> None:
+                name, _, endpoint = self.path.strip("/").partition("/")
+                behaviour = farm.behaviours.get(name)
+                if behaviour is None or endpoint not in ("services", "version"):
+                    self.send_error(404)
+                    return
+                body = farm.services if endpoint == "services" else farm.version
+                if behaviour == "hung":
+                    time.sleep(farm.config.hang_seconds)
+                    return
+                time.sleep(farm.latencies[name])
+                if behaviour == "malformed":
+                    body = body[: len(body) // 2]
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if behaviour == "slow_drip":
+                    for i in range(len(body)):
+                        self.wfile.write(body[i : i + 1])
+                        self.wfile.flush()
+                        time.sleep(farm.config.drip_interval)
+                else:
+                    self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+        return Handler
+
+    def start(self, port: int = 0) -> int:
+        """
+        Start serving on all loopback addresses in a background thread and return the port.
+        """
+        self.server = _FarmServer(("", port), self._handler())
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server.server_address[1]
+
+    def stop(self) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
@@ -0,0 +1,341 @@
+# A local mirror of the icons of each node.
+#
+# Every node links to an icon (a link with rel "icon") that portals would otherwise
+# load from the node itself on every page view, so a slow node makes every portal
+# slow. Icons are instead downloaded by the update script and stored under the sha256
+# hash of their content so that they can be served with a long cache lifetime and so
+# that identical icons are only stored once. The path of the mirrored icon (relative
+# to the artifacts directory, see outputs.write_artifacts) is added to the icon link
+# as "mirror_href".
+#
+# Icons are downloaded concurrently with the same per-host limits as node requests
+# (see fetch.ConnectionLimiter), their size is capped and requests are conditional on
+# the icon having changed since the previous run (see cache.ResponseCache). Like node
+# requests, each download has a hard deadline and all downloads have a time budget
+# (see fetch.Cancellation) so that a slow host cannot hold up the update.
+#
+# Icons are normalised before they are stored: the media type is detected from the
+# content rather than trusted from the node, content that is not a known image format
+# is rejected and SVG images are reduced to an allowlist of static drawing elements
+# and attributes since they are served from our own domain. Only links to fragments of
+# the image itself are kept. The sanitizer is a second line of defence: assets should
+# also be served with "Content-Security-Policy: script-src 'none'".
+
+import hashlib
+import os
+import re
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable
+
+import requests
+
+from cache import ResponseCache, atomic_write
+from fetch import (
+    MAX_CONNECTIONS,
+    MAX_CONNECTIONS_PER_HOST,
+    READ_DEADLINE,
+    REQUEST_TIMEOUT,
+    Cancellation,
+    ConnectionLimiter,
+    SweepDeadlineExceeded,
+    create_session,
+    read_body,
+)
+
+ICON_MAX_BYTES = 1024 * 1024
+# Maximum time to download an icon, counted from the moment its request is sent, and to download every icon
+ICON_DEADLINE = 30
+MIRROR_DEADLINE = 5 * 60
+# Prefix of the mirror_href of every icon, relative to the artifacts directory
+MIRROR_PREFIX = "assets/"
+
+# Signatures of the raster image formats that are accepted and the extension that they are stored with
+IMAGE_SIGNATURES = {
+    b"\x89PNG\r\n\x1a\n": ".png",
+    b"\xff\xd8\xff": ".jpg",
+    b"GIF87a": ".gif",
+    b"GIF89a": ".gif",
+    b"\x00\x00\x01\x00": ".ico",
+}
+SVG_NAMESPACE = "http://www.w3.org/2000/svg"
+XLINK_NAMESPACE = "http://www.w3.org/1999/xlink"
+XML_NAMESPACE = "http://www.w3.org/XML/1998/namespace"
+# SVG elements that are kept, anything else (scripts, animations, embedded html or images...) is removed with its content
+SVG_ELEMENTS = {
+    "svg", "g", "defs", "symbol", "use", "title", "desc", "a",
+    "path", "rect", "circle", "ellipse", "line", "polyline", "polygon",
+    "text", "tspan", "textPath",
+    "linearGradient", "radialGradient", "stop", "pattern", "clipPath", "mask", "marker",
+    "filter", "feBlend", "feColorMatrix", "feComponentTransfer", "feComposite", "feFlood", "feFuncA", "feFuncB",
+    "feFuncG", "feFuncR", "feGaussianBlur", "feMerge", "feMergeNode", "feMorphology", "feOffset",
+}
+# Attributes of the SVG elements that are kept (unprefixed), anything else (event handlers...) is removed
+SVG_ATTRIBUTES = {
+    "id", "class", "style", "version", "viewBox", "preserveAspectRatio", "width", "height", "transform",
+    "x", "y", "x1", "y1", "x2", "y2", "cx", "cy", "r", "rx", "ry", "fx", "fy", "fr", "d", "points", "pathLength",
+    "dx", "dy", "rotate", "textLength", "lengthAdjust", "startOffset", "text-anchor", "dominant-baseline",
+    "font-family", "font-size", "font-style", "font-weight", "letter-spacing", "word-spacing",
+    "fill", "fill-opacity", "fill-rule", "stroke", "stroke-dasharray", "stroke-dashoffset", "stroke-linecap",
+    "stroke-linejoin", "stroke-miterlimit", "stroke-opacity", "stroke-width", "opacity", "color", "display",
+    "visibility", "clip-path", "clip-rule", "mask", "filter", "marker-start", "marker-mid", "marker-end",
+    "offset", "stop-color", "stop-opacity", "gradientUnits", "gradientTransform", "spreadMethod",
+    "patternUnits", "patternContentUnits", "patternTransform", "clipPathUnits", "maskUnits", "maskContentUnits",
+    "markerUnits", "markerWidth", "markerHeight", "refX", "refY", "orient", "filterUnits", "primitiveUnits",
+    "in", "in2", "result", "mode", "operator", "k1", "k2", "k3", "k4", "type", "values", "tableValues",
+    "slope", "intercept", "amplitude", "exponent", "stdDeviation", "radius", "flood-color", "flood-opacity",
+    "href",
+}
+# Attributes in other namespaces that are kept
+SVG_NAMESPACED_ATTRIBUTES = {f"{{{XLINK_NAMESPACE}}}href", f"{{{XML_NAMESPACE}}}space"}
+# References to anything but a fragment of the image itself in attribute values (fill="url(...)") and styles, and CSS
+# escapes that could hide them
+EXTERNAL_REFERENCE_PATTERN = re.compile(r"url\s*\(\s*(?![\s'\"]*#)|@import|\\", re.IGNORECASE)
+
+
+class InvalidAsset(ValueError):
+    """
+    The content of an asset is not in a supported format.
+    """
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def _svg_element(tag: str) -> str | None:
+    """
+    Return the name of an element in the SVG namespace or None if it is in any other namespace.
+    """
+    namespace, _, name = tag[1:].partition("}")
+    return name if tag.startswith("{") and namespace == SVG_NAMESPACE else None
+
+
+def _sanitize_svg(content: bytes) -> bytes:
+    try:
+        root = ElementTree.fromstring(content)
+    except ElementTree.ParseError as e:
+        raise InvalidAsset(f"invalid svg: {e}") from e
+    if root.tag != f"{{{SVG_NAMESPACE}}}svg":
+        raise InvalidAsset("not an svg image")
+    for element in root.iter():
+        for child in list(element):
+            if _svg_element(child.tag) not in SVG_ELEMENTS:
+                element.remove(child)
+        for attribute, value in list(element.attrib.items()):
+            if (
+                attribute not in SVG_ATTRIBUTES and attribute not in SVG_NAMESPACED_ATTRIBUTES
+            ) or EXTERNAL_REFERENCE_PATTERN.search(value):
+                del element.attrib[attribute]
+            elif _local_name(attribute) == "href" and not value.startswith("#"):
+                # anything but a fragment (after any entity or character reference is resolved by the parser)
+                del element.attrib[attribute]
+    ElementTree.register_namespace("", SVG_NAMESPACE)
+    ElementTree.register_namespace("xlink", XLINK_NAMESPACE)
+    return ElementTree.tostring(root, encoding="utf-8", xml_declaration=True)
+
+
+def normalize(content: bytes) -> tuple[bytes, str]:
+    """
+    Return the normalised content of an image and the file extension that matches its format.
+
+    Raise InvalidAsset if the content is not a supported image.
+    """
+    for signature, extension in IMAGE_SIGNATURES.items():
+        if content.startswith(signature):
+            return content, extension
+    if content[:4] == b"RIFF" and content[8:12] == b"WEBP":
+        return content, ".webp"
+    if b"<svg" in content[:1024]:
+        return _sanitize_svg(content), ".svg"
+    raise InvalidAsset("unsupported image format")
+
+
+class AssetStore:
+    """
+    Store assets in directory under the sha256 hash of their content.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+
+    def path(self, filename: str) -> str:
+        return os.path.join(self.directory, filename)
+
+    def add(self, content: bytes, extension: str) -> str:
+        """
+        Store content (if it is not already stored) and return its file name.
+        """
+        filename = f"{hashlib.sha256(content).hexdigest()}{extension}"
+        if not os.path.isfile(self.path(filename)):
+            atomic_write(self.path(filename), content)
+        return filename
+
+    def __contains__(self, filename: str) -> bool:
+        return os.path.isfile(self.path(filename))
+
+
+def _is_icon(link: dict) -> bool:
+    return link.get("rel") == "icon" and bool(link.get("href"))
+
+
+def icon_links(data: dict) -> list[dict]:
+    """
+    Return the links of a node with rel "icon".
+    """
+    return [link for link in data.get("links", []) if _is_icon(link)]
+
+
+def _missing(link: dict, store: AssetStore) -> bool:
+    return "mirror_href" in link and link["mirror_href"].removeprefix(MIRROR_PREFIX) not in store
+
+
+def _without_mirror(link: dict) -> dict:
+    return {key: value for key, value in link.items() if key != "mirror_href"}
+
+
+def fetch_asset(
+    url: str,
+    limiter: ConnectionLimiter,
+    store: AssetStore,
+    cache: ResponseCache | None = None,
+    session: requests.Session | None = None,
+    timeout: float = REQUEST_TIMEOUT,
+    max_bytes: int = ICON_MAX_BYTES,
+    cancelled: Cancellation | None = None,
+) -> str:
+    """
+    Download the asset at url, normalise it, add it to store and return its file name.
+
+    If a cache is provided, the request is conditional on the asset having changed since it was last cached.
+    Raise a requests.exceptions.RequestException if the asset cannot be downloaded and InvalidAsset if it is not a
+    supported image.
+
+    If cancelled is given, its deadline starts when the request is sent and the download is aborted as soon as it is
+    set. The download then fails with the error that it was set with (see fetch.get_json).
+    """
+    if cancelled is None:
+        return _fetch_asset(url, limiter, store, cache, session, timeout, max_bytes, cancelled)
+    with cancelled.track():
+        try:
+            return _fetch_asset(url, limiter, store, cache, session, timeout, max_bytes, cancelled)
+        except (requests.exceptions.RequestException, OSError) as e:
+            # errors raised because the connection was shut down are reported as the reason it was shut down
+            if cancelled.error is not None and e is not cancelled.error:
+                raise cancelled.error from e
+            raise
+        finally:
+            cancelled.finish()
+
+
+def _fetch_asset(
+    url: str,
+    limiter: ConnectionLimiter,
+    store: AssetStore,
+    cache: ResponseCache | None,
+    session: requests.Session | None,
+    timeout: float,
+    max_bytes: int,
+    cancelled: Cancellation | None,
+) -> str:
+    http = session if session is not None else requests
+    with limiter.limit(url):
+        if cancelled is not None:
+            if cancelled.is_set():
+                raise cancelled.error or requests.exceptions.ConnectionError(f"download of {url} was cancelled")
+            cancelled.start()
+        conditional_headers = cache.conditional_headers(url) if cache is not None else {}
+        response = http.get(url, headers=conditional_headers, timeout=timeout, stream=True)
+        if response.status_code == 304 and conditional_headers:
+            response.close()
+            if (body := cache.get_body(url)) is not None:
+                return store.add(*normalize(body))
+            # the cached body is missing or corrupted so the asset has to be requested again
+            response = http.get(url, timeout=timeout, stream=True)
+        if response.status_code != 200:
+            response.close()
+            raise requests.exceptions.HTTPError(f"{url} returned status {response.status_code}", response=response)
+        content = read_body(response, max_bytes, time.monotonic() + READ_DEADLINE)
+    # a connection that is shut down while the body is read looks like the end of the body, which may be truncated
+    if cancelled is not None and cancelled.error is not None:
+        raise cancelled.error
+    filename = store.add(*normalize(content))
+    if cache is not None:
+        cache.store(url, response.headers, content)
+    return filename
+
+
+def mirror_icons(
+    registry: dict,
+    names: Iterable[str],
+    store: AssetStore,
+    cache: ResponseCache | None = None,
+    max_connections: int = MAX_CONNECTIONS,
+    max_per_host: int = MAX_CONNECTIONS_PER_HOST,
+    session: requests.Session | None = None,
+    timeout: float = REQUEST_TIMEOUT,
+    max_bytes: int = ICON_MAX_BYTES,
+    icon_deadline: float | None = ICON_DEADLINE,
+    deadline: float | None = MIRROR_DEADLINE,
+) -> dict[str, Exception]:
+    """
+    Mirror the icons of the named nodes in the registry and set the "mirror_href" of each icon link.
+
+    The "links" of a node whose icon links change are replaced by a new list in place, the links themselves are never
+    modified so that they can be shared with other copies of the registry.
+
+    If an icon cannot be mirrored, the icon mirrored during a previous run (if any) is kept as long as it is still in
+    the store. Icons of nodes that are not named are left unchanged unless their mirrored file is no longer in the
+    store, in which case their mirror_href is removed.
+
+    Each icon must be downloaded within icon_deadline seconds of sending its request (see fetch_asset) and all of them
+    within deadline seconds of calling this function, the icons that are not are not mirrored. Either deadline can be
+    disabled by setting it to None.
+
+    Return the error raised for each url that could not be mirrored.
+    """
+    for data in registry.values():
+        if any(_missing(link, store) for link in icon_links(data)):
+            data["links"] = [_without_mirror(link) if _missing(link, store) else link for link in data["links"]]
+    names = list(names)
+    urls = list(dict.fromkeys(link["href"] for name in names for link in icon_links(registry[name])))
+    if not urls:
+        return {}
+    session = create_session(max_connections) if session is None else session
+    limiter = ConnectionLimiter(max_connections, max_per_host)
+    expires = None if deadline is None else time.monotonic() + deadline
+    cancellations = {url: Cancellation(icon_deadline, expires) for url in urls}
+
+    def _mirror(url: str) -> str | Exception:
+        try:
+            return fetch_asset(url, limiter, store, cache, session, timeout, max_bytes, cancellations[url])
+        except (requests.exceptions.RequestException, InvalidAsset) as e:
+            return e
+
+    def _deadline_exceeded() -> None:
+        for cancellation in cancellations.values():
+            cancellation.set(SweepDeadlineExceeded(f"icons were not mirrored within {deadline} seconds"))
+
+    timer = None
+    if deadline is not None:
+        timer = threading.Timer(deadline, _deadline_exceeded)
+        timer.daemon = True
+        timer.start()
+    try:
+        with ThreadPoolExecutor(max_workers=max_connections) as executor:
+            futures = [limiter.submit(executor, url, _mirror, url) for url in urls]
+            results = {url: future.result() for url, future in zip(urls, futures)}
+    finally:
+        if timer is not None:
+            timer.cancel()
+    mirrored = {url: f"{MIRROR_PREFIX}{result}" for url, result in results.items() if isinstance(result, str)}
+    for name in names:
+        data = registry[name]
+        if any(link["href"] in mirrored for link in icon_links(data)):
+            data["links"] = [
+                {**link, "mirror_href": mirrored[link["href"]]} if _is_icon(link) and link["href"] in mirrored else link
+                for link in data["links"]
+            ]
+    return {url: result for url, result in results.items() if isinstance(result, Exception)}
@@ -0,0 +1,260 @@
+# Check archives of registries and node payloads against the current migrations and schema.
+#
+# Before the schema or the migrations change, every registry that was ever published
+# and every payload that nodes have returned should still be migrated and validated
+# successfully. This script streams such an archive through the same migration and
+# validation pipeline as the update script, on a pool of processes so that every core
+# is used, and reports which nodes and which declared schema versions would break.
+#
+# An archive is made of json files that are either:
+#
+#   - registries (a snapshot of 'node_registry.json'), every node of which is checked
+#   - payloads returned by the services endpoint of a node. The name of the node is
+#     taken to be the name of the directory that contains the file.
+#
+# or of the versions of a file in the history of a git repository.
+#
+# Run with:
+#
+#   python bulk.py path/to/archive --report report.json
+#   python bulk.py --git-history .. --git-path node_registry.json
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, NamedTuple
+
+from jsonschema.exceptions import RefResolutionError, ValidationError, best_match
+
+from migrations import MigrationError, apply_migrations, declared_schema_version
+from validation import RegistryValidator, json_pointer
+
+THIS_DIR = os.path.dirname(__file__)
+ROOT_DIR = os.path.dirname(THIS_DIR)
+SCHEMA_FILE = os.path.join(ROOT_DIR, "node_registry.schema.json")
+# Sources prefixed with this are versions of a file in a git repository ("git:<repository>:<revision>:<path>")
+GIT_PREFIX = "git:"
+# Number of failures reported as examples for each node
+MAX_EXAMPLES = 5
+UNDECLARED_VERSION = "undeclared"
+
+_validator: RegistryValidator | None = None
+
+
+class CheckResult(NamedTuple):
+    """
+    The outcome of migrating and validating a single node found in source.
+
+    status is one of "valid", "invalid" (the node does not match the schema after it was migrated),
+    "migration_failed" or "unreadable" (source is not valid json or is neither a registry nor a payload). pointer is the
+    JSON pointer to the invalid value, relative to the node.
+    """
+
+    source: str
+    node: str | None
+    version: str
+    status: str
+    pointer: str | None = None
+    message: str | None = None
+
+
+def iter_files(paths: Iterable[str]) -> Iterator[str]:
+    """
+    Yield every json file in paths (files or directories, searched recursively) in a deterministic order.
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for directory, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.endswith(".json"):
+                    yield os.path.join(directory, filename)
+
+
+def iter_git_history(repository: str, path: str) -> Iterator[str]:
+    """
+    Yield a source for every version of path in the history of the git repository, the most recent first.
+    """
+    revisions = subprocess.run(
+        ["git", "-C", repository, "log", "--format=%H", "--", path], check=True, capture_output=True, text=True
+    ).stdout.split()
+    for revision in revisions:
+        yield f"{GIT_PREFIX}{repository}:{revision}:{path}"
+
+
+def _read(source: str) -> bytes:
+    if source.startswith(GIT_PREFIX):
+        repository, revision, path = source[len(GIT_PREFIX):].rsplit(":", 2)
+        return subprocess.run(
+            ["git", "-C", repository, "show", f"{revision}:{path}"], check=True, capture_output=True
+        ).stdout
+    with open(source, "rb") as f:
+        return f.read()
+
+
+def _version_label(declared_version: tuple[int, ...] | None) -> str:
+    return UNDECLARED_VERSION if declared_version is None else ".".join(map(str, declared_version))
+
+
+def _is_registry(content: dict) -> bool:
+    return bool(content) and all(isinstance(node, dict) and "links" in node for node in content.values())
+
+
+def _check_services(source: str, payload: dict, validator: RegistryValidator) -> CheckResult:
+    node = os.path.basename(os.path.dirname(source)) if not source.startswith(GIT_PREFIX) else None
+    declared_version = declared_schema_version(payload)
+    version = _version_label(declared_version)
+    data = {"services": payload["services"]}
+    try:
+        apply_migrations(data, declared_version)
+    except MigrationError as e:
+        return CheckResult(source, node, version, "migration_failed", message=str(e))
+    try:
+        error = best_match(validator.iter_services_errors(data["services"]))
+    except RefResolutionError as e:
+        return CheckResult(source, node, version, "invalid", message=str(e))
+    if error is not None:
+        return CheckResult(source, node, version, "invalid", json_pointer(error.path), error.message)
+    return CheckResult(source, node, version, "valid")
+
+
+def _check_registry(source: str, registry: dict, validator: RegistryValidator) -> list[CheckResult]:
+    results = []
+    version = _version_label(None)
+    for name, data in registry.items():
+        try:
+            # nodes that were never updated successfully have no services to migrate
+            if "services" in data:
+                apply_migrations(data)
+        except MigrationError as e:
+            results.append(CheckResult(source, name, version, "migration_failed", message=str(e)))
+            continue
+        try:
+            validator.validate_node(name, data)
+        except ValidationError as e:
+            # the path of the error starts with the name of the node
+            results.append(CheckResult(source, name, version, "invalid", json_pointer(list(e.path)[1:]), e.message))
+        except RefResolutionError as e:
+            results.append(CheckResult(source, name, version, "invalid", message=str(e)))
+        else:
+            results.append(CheckResult(source, name, version, "valid"))
+    return results
+
+
+def check_source(source: str, validator: RegistryValidator | None = None) -> list[CheckResult]:
+    """
+    Migrate and validate every node found in source and return the outcome for each of them.
+    """
+    validator = _validator if validator is None else validator
+    try:
+        content = json.loads(_read(source))
+    except (OSError, subprocess.CalledProcessError, json.JSONDecodeError, UnicodeDecodeError) as e:
+        return [CheckResult(source, None, UNDECLARED_VERSION, "unreadable", message=str(e))]
+    if isinstance(content, dict) and isinstance(content.get("services"), list):
+        return [_check_services(source, content, validator)]
+    if isinstance(content, dict) and _is_registry(content):
+        return _check_registry(source, content, validator)
+    return [CheckResult(source, None, UNDECLARED_VERSION, "unreadable", message="neither a registry nor a payload")]
+
+
+def _init_worker(schema: dict, compiled_cache_dir: str | None) -> None:
+    global _validator
+    _validator = RegistryValidator(schema, compiled_cache_dir=compiled_cache_dir)
+
+
+def check_sources(
+    sources: Iterable[str],
+    schema: dict,
+    workers: int | None = None,
+    compiled_cache_dir: str | None = None,
+    chunksize: int = 16,
+) -> Iterator[CheckResult]:
+    """
+    Check every source on a pool of workers processes (one per core by default) and yield the outcome of every node.
+
+    Results are yielded in the order of the sources.
+    """
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(schema, compiled_cache_dir)
+    ) as executor:
+        for results in executor.map(check_source, sources, chunksize=chunksize):
+            yield from results
+
+
+def summarize(results: Iterable[CheckResult], max_examples: int = MAX_EXAMPLES) -> dict:
+    """
+    Aggregate results into the number of nodes with each status overall, for each declared schema version and for
+    each node, with up to max_examples failures for each node.
+    """
+    sources = set()
+    statuses = defaultdict(int)
+    versions = defaultdict(lambda: defaultdict(int))
+    nodes = defaultdict(lambda: {"statuses": defaultdict(int), "failures": []})
+    for result in results:
+        sources.add(result.source)
+        statuses[result.status] += 1
+        versions[result.version][result.status] += 1
+        node = nodes[result.node or ""]
+        node["statuses"][result.status] += 1
+        if result.status != "valid" and len(node["failures"]) < max_examples:
+            node["failures"].append(
+                {"source": result.source, "status": result.status, "pointer": result.pointer, "message": result.message}
+            )
+    return {
+        "sources": len(sources),
+        "statuses": dict(statuses),
+        "versions": {version: dict(counts) for version, counts in sorted(versions.items())},
+        "nodes": {
+            name: {"statuses": dict(node["statuses"]), "failures": node["failures"]}
+            for name, node in sorted(nodes.items())
+            if node["failures"]
+        },
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Check archived registries and node payloads against the current migrations and schema."
+    )
+    parser.add_argument("paths", nargs="*", help="json files or directories containing json files")
+    parser.add_argument("--git-history", metavar="REPOSITORY", help="check every version of a file in this repository")
+    parser.add_argument(
+        "--git-path", default="node_registry.json", help="path of the file in the repository (default: %(default)s)"
+    )
+    parser.add_argument("--schema", default=SCHEMA_FILE, help="schema to validate against (default: the current one)")
+    parser.add_argument("--workers", type=int, help="number of worker processes (default: one per core)")
+    parser.add_argument("--report", help="write the full report as json to this file")
+    parser.add_argument(
+        "--max-examples", type=int, default=MAX_EXAMPLES, help="number of failures reported for each node"
+    )
+    args = parser.parse_args(argv)
+    if not args.paths and not args.git_history:
+        parser.error("give at least one path or --git-history")
+
+    with open(args.schema) as f:
+        schema = json.load(f)
+    sources = list(iter_files(args.paths))
+    if args.git_history:
+        sources += iter_git_history(args.git_history, args.git_path)
+    report = summarize(check_sources(sources, schema, args.workers), args.max_examples)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps({key: report[key] for key in ("sources", "statuses", "versions")}, indent=2))
+    for name, node in report["nodes"].items():
+        for failure in node["failures"]:
+            sys.stderr.write(
+                f"{name or '<unknown node>'}: {failure['status']} in {failure['source']}"
+                f" at {failure['pointer'] or '/'}: {failure['message']}\n"
+            )
+    return 1 if set(report["statuses"]) - {"valid"} else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+# Persistent on-disk caches that are kept between runs of the update script.
+#
+# Every cache lives in its own subdirectory of a single cache directory so that the
+# whole cache can be saved and restored in one step (see the registry-update workflow).
+# Files are written atomically so that concurrent writers never leave a partially
+# written file behind.
+
+import hashlib
+import json
+import os
+import tempfile
+from typing import Any, Mapping
+
+
+def atomic_write(path: str, content: bytes) -> None:
+    """
+    Write content to path so that readers only ever see the old or the new content of the file.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _key(value: str) -> str:
+    return hashlib.sha256(value.encode()).hexdigest()
+
+
+class JsonStore:
+    """
+    Store json serializable values in individual files in a directory.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{_key(key)}.json")
+
+    def get(self, key: str) -> Any:
+        """
+        Return the value stored for key or None if there is none.
+        """
+        try:
+            with open(self._path(key)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Store value for key.
+        """
+        atomic_write(self._path(key), json.dumps(value).encode())
+
+
+class ResponseCache:
+    """
+    Cache the body and validators (ETag and Last-Modified headers) of responses by url.
+
+    These are used to send conditional requests so that a node only has to send the content of an endpoint again if
+    it has changed.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self._meta = JsonStore(directory)
+
+    def _body_path(self, url: str) -> str:
+        return os.path.join(self.directory, f"{_key(url)}.body")
+
+    def conditional_headers(self, url: str) -> dict[str, str]:
+        """
+        Return the headers that make a request to url conditional on the content having changed since it was cached.
+        """
+        meta = self._meta.get(url) or {}
+        headers = {}
+        if not os.path.isfile(self._body_path(url)):
+            return headers
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def get_body(self, url: str) -> bytes | None:
+        """
+        Return the cached body of the response from url or None if it is not cached.
+        """
+        meta = self._meta.get(url) or {}
+        try:
+            with open(self._body_path(url), "rb") as f:
+                body = f.read()
+        except FileNotFoundError:
+            return None
+        if hashlib.sha256(body).hexdigest() != meta.get("sha256"):
+            return None
+        return body
+
+    def store(self, url: str, headers: Mapping[str, str], body: bytes) -> None:
+        """
+        Cache the body of a response from url if the response can be used to make conditional requests later on.
+        """
+        etag = headers.get("ETag")
+        last_modified = headers.get("Last-Modified")
+        if etag or last_modified:
+            atomic_write(self._body_path(url), body)
+            self._meta.set(
+                url, {"etag": etag, "last_modified": last_modified, "sha256": hashlib.sha256(body).hexdigest()}
+            )
+
+
+class ServiceMemo:
+    """
+    Store services after they were migrated and validated, keyed by a hash of the service as returned by a node.
+
+    Many nodes advertise identical services so a service that was already migrated and validated (for any node, in
+    this run or a previous one) does not have to be migrated and validated again. fingerprint must change whenever
+    the result of migrating or validating a service could change (ex: a hash of the schema and of the migrations).
+    """
+
+    def __init__(self, directory: str, fingerprint: str) -> None:
+        self._store = JsonStore(directory)
+        self.fingerprint = fingerprint
+        self._loaded: dict[str, str] = {}
+
+    def key(self, service: Any, declared_version: tuple[int, ...] | None) -> str:
+        """
+        Return the key of a service returned by a node that declares that it complies with declared_version.
+        """
+        content = json.dumps([self.fingerprint, declared_version, service], sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def get(self, key: str) -> Any:
+        """
+        Return a copy of the service stored for key or None if there is none.
+        """
+        if key not in self._loaded:
+            value = self._store.get(key)
+            if value is None:
+                return None
+            self._loaded[key] = json.dumps(value)
+        return json.loads(self._loaded[key])
+
+    def set(self, key: str, service: Any) -> None:
+        self._loaded[key] = json.dumps(service)
+        self._store.set(key, service)
@@ -0,0 +1,176 @@
+# Keep the registry up to date continuously instead of once a day.
+#
+# The daemon keeps a priority queue of the time at which each node is next due to be
+# polled. Nodes that are due at about the same time are updated together as a batch
+# (see update.update_registry) and the registry is written once per batch.
+#
+# The interval between two polls of a node adapts to how the node behaves:
+#
+#   - when the status of a node changes (the node is flapping) its interval is halved
+#     so that it is watched more closely, down to MIN_INTERVAL
+#   - when the status stays the same (the node is stable, or has been dead for a while)
+#     its interval grows by INTERVAL_GROWTH, up to MAX_INTERVAL
+#
+# Every interval is randomly jittered so that nodes that were added at the same time do
+# not stay synchronized and the load on the network is spread out.
+#
+# Run with:
+#
+#   python daemon.py
+
+import argparse
+import datetime
+import heapq
+import random
+import signal
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+import update
+
+BASE_INTERVAL = 15 * 60
+MIN_INTERVAL = 5 * 60
+MAX_INTERVAL = 6 * 60 * 60
+INTERVAL_GROWTH = 1.5
+# Each interval is multiplied by a random factor between 1 - JITTER and 1 + JITTER
+JITTER = 0.1
+# Nodes that are due within this many seconds of each other are updated in the same batch
+BATCH_WINDOW = 30
+
+
+@dataclass
+class NodeSchedule:
+    """
+    When a node is next due and the interval and status used to decide when it is due after that.
+    """
+
+    due: float
+    interval: float
+    status: str | None
+
+
+class Scheduler:
+    """
+    A priority queue of the time (seconds since the epoch) at which each node is next due to be polled.
+    """
+
+    def __init__(self, rng: random.Random | None = None) -> None:
+        self.rng = random.Random() if rng is None else rng
+        self.nodes: dict[str, NodeSchedule] = {}
+        self._queue: list[tuple[float, str]] = []
+
+    def _jitter(self, interval: float) -> float:
+        return interval * self.rng.uniform(1 - JITTER, 1 + JITTER)
+
+    def _push(self, name: str, due: float) -> None:
+        self.nodes[name].due = due
+        heapq.heappush(self._queue, (due, name))
+
+    def sync(self, registry: dict, now: float) -> None:
+        """
+        Schedule the nodes that were added to the registry and forget those that were removed.
+
+        A new node is due BASE_INTERVAL after it was last updated or now if that time has already passed.
+        """
+        for name in self.nodes.keys() - registry.keys():
+            del self.nodes[name]
+        for name, data in registry.items():
+            if name in self.nodes:
+                continue
+            try:
+                last_updated = datetime.datetime.fromisoformat(data["last_updated"]).timestamp()
+            except (KeyError, TypeError, ValueError):
+                last_updated = 0.0
+            self.nodes[name] = NodeSchedule(0.0, BASE_INTERVAL, data.get("status"))
+            self._push(name, max(now, last_updated + self._jitter(BASE_INTERVAL)))
+
+    def next_due(self) -> float | None:
+        """
+        Return the time at which the next node is due or None if there are no nodes.
+        """
+        while self._queue:
+            due, name = self._queue[0]
+            if name in self.nodes and self.nodes[name].due == due:
+                return due
+            # the node was removed or rescheduled since this entry was pushed
+            heapq.heappop(self._queue)
+        return None
+
+    def pop_due(self, now: float, window: float = BATCH_WINDOW) -> list[str]:
+        """
+        Remove and return the nodes that are due by now + window in the order in which they are due.
+        """
+        batch = []
+        while (due := self.next_due()) is not None and due <= now + window:
+            batch.append(heapq.heappop(self._queue)[1])
+        return batch
+
+    def reschedule(self, name: str, status: str | None, now: float) -> float:
+        """
+        Adapt the interval of a node to its latest status and schedule its next poll. Return the time it is due.
+        """
+        node = self.nodes[name]
+        if status != node.status:
+            node.interval = max(MIN_INTERVAL, node.interval / 2)
+        else:
+            node.interval = min(MAX_INTERVAL, node.interval * INTERVAL_GROWTH)
+        node.status = status
+        self._push(name, now + self._jitter(node.interval))
+        return node.due
+
+
+def run(
+    stop: threading.Event,
+    scheduler: Scheduler | None = None,
+    clock: Callable[[], float] = time.time,
+    **update_options,
+) -> None:
+    """
+    Update nodes as they become due until stop is set.
+
+    update_options are passed to update.update_registry for every batch.
+    """
+    scheduler = Scheduler() if scheduler is None else scheduler
+    scheduler.sync(update._load_registry(), clock())
+    while not stop.is_set():
+        due = scheduler.next_due()
+        if due is None:
+            # wait for nodes to be added to the registry
+            stop.wait(BASE_INTERVAL)
+            scheduler.sync(update._load_registry(), clock())
+            continue
+        if due > clock():
+            stop.wait(due - clock())
+            continue
+        batch = scheduler.pop_due(clock())
+        try:
+            # nodes are named to select the batch, tripped nodes are still only polled when their circuit breaker allows
+            report = update.update_registry(nodes=batch, respect_breaker=True, **update_options)
+        except Exception as e:
+            sys.stderr.write(f"unable to update nodes {', '.join(batch)}: {e}\n")
+            registry = update._load_registry()
+            statuses = {name: scheduler.nodes[name].status for name in batch}
+        else:
+            # the outcome of every node in the registry is reported, including nodes added since the last batch
+            registry = report.nodes
+            statuses = {name: registry[name].get("status") for name in batch if name in registry}
+        now = clock()
+        scheduler.sync(registry, now)
+        for name, status in statuses.items():
+            if name in scheduler.nodes:
+                scheduler.reschedule(name, status, now)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep the node registry up to date continuously.")
+    parser.add_argument(
+        "--probe-services", action="store_true", help="check that the services advertised by each node respond"
+    )
+    args = parser.parse_args()
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+    run(stop_event, probe=args.probe_services)
@@ -0,0 +1,75 @@
+# Changes between two versions of the registry.
+#
+# Each run of the update script records what changed since the previously published
+# registry so that consumers can apply the changes incrementally instead of
+# downloading and comparing the whole registry.
+#
+# A change record is created for each node that was added, removed or modified.
+# Changes to "last_updated" alone are not reported since that value changes every
+# time a node is successfully polled. Likewise, a service is not reported as modified
+# if only the latency or time of its last health check changed.
+
+IGNORED_KEYS = ("last_updated",)
+TRACKED_KEYS = ("status", "version")
+IGNORED_HEALTH_KEYS = ("checked", "latency")
+
+
+def _comparable(service: dict) -> dict:
+    if "health" not in service:
+        return service
+    health = {key: value for key, value in service["health"].items() if key not in IGNORED_HEALTH_KEYS}
+    return {**service, "health": health}
+
+
+def _services_by_name(data: dict) -> dict[str, dict]:
+    return {service.get("name"): _comparable(service) for service in data.get("services", [])}
+
+
+def _node_changes(previous: dict, current: dict) -> dict:
+    """
+    Return a change record describing how a node changed or an empty dictionary if it did not change.
+    """
+    change = {}
+    for key in TRACKED_KEYS:
+        if previous.get(key) != current.get(key):
+            change[key] = {"from": previous.get(key), "to": current.get(key)}
+
+    previous_services = _services_by_name(previous)
+    current_services = _services_by_name(current)
+    services = {
+        "added": [name for name in current_services if name not in previous_services],
+        "removed": [name for name in previous_services if name not in current_services],
+        "modified": [
+            name
+            for name, service in current_services.items()
+            if name in previous_services and previous_services[name] != service
+        ],
+    }
+    if any(services.values()):
+        change["services"] = services
+
+    ignored = {*IGNORED_KEYS, *TRACKED_KEYS, "services"}
+    fields = sorted(
+        key for key in {*previous, *current} if key not in ignored and previous.get(key) != current.get(key)
+    )
+    if fields:
+        change["fields"] = fields
+    return change
+
+
+def compute_delta(previous: dict, current: dict) -> list[dict]:
+    """
+    Return a list of change records for every node that differs between the previous and current registry.
+
+    Records are ordered like the nodes in the current registry followed by nodes that were removed.
+    """
+    changes = []
+    for name, data in current.items():
+        if name not in previous:
+            changes.append({"node": name, "change": "added", "status": {"from": None, "to": data.get("status")}})
+        elif change := _node_changes(previous[name], data):
+            changes.append({"node": name, "change": "modified", **change})
+    for name, data in previous.items():
+        if name not in current:
+            changes.append({"node": name, "change": "removed", "status": {"from": data.get("status"), "to": None}})
+    return changes
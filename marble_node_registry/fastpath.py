@@ -0,0 +1,261 @@
+# Generated python code that checks whether data is valid according to a json schema.
+#
+# The jsonschema package interprets the schema every time that it validates something:
+# every keyword of every subschema is looked up and dispatched for every node and every
+# service. This module instead generates (once per schema) a python function for every
+# subschema, with the regular expressions precompiled and keywords such as "contains"
+# written out as plain loops. The generated functions only answer "is this valid?", they
+# do not report errors. When the answer is no, the data should be validated again with
+# jsonschema to get a detailed error (see validation.RegistryValidator).
+#
+# Only the keywords used by the registry schema are generated. If a subschema uses any
+# other keyword that jsonschema would check, the generated function raises Defer when it
+# reaches that subschema so that the caller falls back to jsonschema.
+#
+# The generated code only depends on the schema and the remote schemas that it references
+# so it is cached on disk, keyed by a hash of both.
+
+import hashlib
+import json
+import os
+import re
+from typing import Any, Callable
+from urllib.parse import urldefrag, urljoin
+
+import jsonschema
+
+from cache import atomic_write
+
+# Increment this when the generated code changes so that previously cached code is not used
+GENERATOR_VERSION = 1
+
+# Keywords that only annotate a schema or that jsonschema does not check (format is only checked if a format checker
+# is given to the validator, which is never the case here)
+IGNORED_KEYWORDS = {"format", "$defs", "definitions"}
+
+JSON_TYPES = {
+    "object": "isinstance({x}, dict)",
+    "array": "isinstance({x}, list)",
+    "string": "isinstance({x}, str)",
+    "boolean": "isinstance({x}, bool)",
+    "null": "{x} is None",
+    "number": "(isinstance({x}, (int, float)) and not isinstance({x}, bool))",
+    "integer": (
+        "((isinstance({x}, int) and not isinstance({x}, bool)) or (isinstance({x}, float) and {x}.is_integer()))"
+    ),
+}
+NUMBER = JSON_TYPES["number"]
+
+
+class Defer(Exception):
+    """
+    The data uses a part of the schema that is not supported by the generated code.
+    """
+
+
+class _Generator:
+    """
+    Generate one function per subschema reachable from the entry points.
+    """
+
+    def __init__(self, root: dict, store: dict[str, dict]) -> None:
+        self.base = root.get("$id", "") if isinstance(root, dict) else ""
+        self.documents = {**store, self.base: root}
+        self.constants: list[str] = []
+        self.functions: list[str] = []
+        self._names: dict[int, str] = {}
+        self._pending: list[tuple[str, Any, str]] = []
+
+    def constant(self, expression: str) -> str:
+        name = f"_c{len(self.constants)}"
+        self.constants.append(f"{name} = {expression}")
+        return name
+
+    def function(self, schema: Any, base: str) -> str:
+        """
+        Return the name of the function that checks schema, generating it later if it does not exist yet.
+        """
+        if id(schema) not in self._names:
+            name = f"_v{len(self._names)}"
+            self._names[id(schema)] = name
+            self._pending.append((name, schema, base))
+        return self._names[id(schema)]
+
+    def resolve(self, ref: str, base: str) -> tuple[Any, str] | None:
+        uri, fragment = urldefrag(urljoin(base, ref))
+        document = self.documents.get(uri)
+        if document is None or (fragment and not fragment.startswith("/")):
+            return None
+        try:
+            for part in fragment.split("/")[1:]:
+                part = part.replace("~1", "/").replace("~0", "~")
+                document = document[int(part)] if isinstance(document, list) else document[part]
+        except (KeyError, IndexError, ValueError, TypeError):
+            return None
+        return document, uri
+
+    def generate(self, entry_points: dict[str, Any]) -> str:
+        for name, schema in entry_points.items():
+            self.functions.append(f"def {name}(x):\n    return {self.function(schema, self.base)}(x)\n")
+        while self._pending:
+            self.functions.append(self._body(*self._pending.pop()))
+        return "\n".join(["import re", "", *self.constants, "", "", *self.functions])
+
+    def _body(self, name: str, schema: Any, base: str) -> str:
+        lines = [f"def {name}(x):"]
+        if schema is True or schema == {}:
+            lines.append("    return True")
+            return "\n".join(lines) + "\n"
+        if schema is False:
+            lines.append("    return False")
+            return "\n".join(lines) + "\n"
+        base = urljoin(base, schema["$id"]) if "$id" in schema else base
+        for keyword, value in schema.items():
+            if keyword in IGNORED_KEYWORDS or keyword not in jsonschema.Draft202012Validator.VALIDATORS:
+                continue
+            statements = self._keyword(keyword, value, schema, base)
+            if statements is None:
+                lines.append("    raise Defer")
+                break
+            lines.extend(f"    {statement}" for statement in statements)
+        lines.append("    return True")
+        return "\n".join(lines) + "\n"
+
+    def _keyword(self, keyword: str, value: Any, schema: dict, base: str) -> list[str] | None:
+        """
+        Return the statements that check keyword or None if the keyword is not supported.
+        """
+        if keyword == "type":
+            types = [value] if isinstance(value, str) else value
+            if any(type_ not in JSON_TYPES for type_ in types):
+                return None
+            check = " or ".join(JSON_TYPES[type_].format(x="x") for type_ in types)
+            return [f"if not ({check}):", "    return False"]
+        if keyword in ("enum", "const"):
+            values = value if keyword == "enum" else [value]
+            # json equality differs from python equality for other values (ex: 1 == True)
+            if not all(isinstance(item, str) for item in values):
+                return None
+            return [
+                f"if not (isinstance(x, str) and x in {self.constant(repr(frozenset(values)))}):",
+                "    return False",
+            ]
+        if keyword in ("minimum", "maximum"):
+            operator = "<" if keyword == "minimum" else ">"
+            return [f"if {NUMBER.format(x='x')} and x {operator} {value!r}:", "    return False"]
+        if keyword in ("minLength", "maxLength", "minItems", "maxItems", "minProperties", "maxProperties"):
+            type_ = {"L": "str", "I": "list", "P": "dict"}[keyword[3]]
+            operator = "<" if keyword.startswith("min") else ">"
+            return [f"if isinstance(x, {type_}) and len(x) {operator} {value!r}:", "    return False"]
+        if keyword == "pattern":
+            pattern = self.constant(f"re.compile({value!r})")
+            return [f"if isinstance(x, str) and not {pattern}.search(x):", "    return False"]
+        if keyword == "required":
+            return [f"if isinstance(x, dict) and not all(key in x for key in {tuple(value)!r}):", "    return False"]
+        if keyword in ("properties", "patternProperties", "additionalProperties"):
+            return self._object(keyword, value, schema, base)
+        if keyword == "items":
+            if "prefixItems" in schema:
+                return None
+            return [
+                "if isinstance(x, list):",
+                "    for item in x:",
+                f"        if not {self.function(value, base)}(item):",
+                "            return False",
+            ]
+        if keyword == "contains":
+            if "minContains" in schema or "maxContains" in schema:
+                return None
+            return [
+                f"if isinstance(x, list) and not any({self.function(value, base)}(item) for item in x):",
+                "    return False",
+            ]
+        if keyword == "allOf":
+            return [
+                statement
+                for subschema in value
+                for statement in (f"if not {self.function(subschema, base)}(x):", "    return False")
+            ]
+        if keyword == "anyOf":
+            check = " or ".join(f"{self.function(subschema, base)}(x)" for subschema in value)
+            return [f"if not ({check}):", "    return False"]
+        if keyword == "oneOf":
+            functions = ", ".join(self.function(subschema, base) for subschema in value)
+            return [f"if sum(1 for f in ({functions},) if f(x)) != 1:", "    return False"]
+        if keyword == "not":
+            return [f"if {self.function(value, base)}(x):", "    return False"]
+        if keyword == "$ref":
+            if (resolved := self.resolve(value, base)) is None:
+                return None
+            return [f"if not {self.function(*resolved)}(x):", "    return False"]
+        return None
+
+    def _object(self, keyword: str, value: Any, schema: dict, base: str) -> list[str]:
+        if keyword == "properties":
+            statements = []
+            for key, subschema in value.items():
+                statements += [
+                    f"if isinstance(x, dict) and {key!r} in x and not {self.function(subschema, base)}(x[{key!r}]):",
+                    "    return False",
+                ]
+            return statements
+        if keyword == "patternProperties":
+            statements = ["if isinstance(x, dict):", "    for key, item in x.items():"]
+            for pattern, subschema in value.items():
+                compiled = self.constant(f"re.compile({pattern!r})")
+                statements += [
+                    f"        if {compiled}.search(key) and not {self.function(subschema, base)}(item):",
+                    "            return False",
+                ]
+            return statements
+        # additionalProperties applies to the properties that are not matched by properties or patternProperties
+        known = self.constant(repr(frozenset(schema.get("properties", {}))))
+        patterns = [self.constant(f"re.compile({pattern!r})") for pattern in schema.get("patternProperties", {})]
+        matched = " or ".join([f"key in {known}", *(f"{pattern}.search(key)" for pattern in patterns)])
+        return [
+            "if isinstance(x, dict):",
+            "    for key, item in x.items():",
+            f"        if not ({matched}) and not {self.function(value, base)}(item):",
+            "            return False",
+        ]
+
+
+def generate_source(schema: dict, store: dict[str, dict], entry_points: dict[str, Any]) -> str:
+    """
+    Return the source of a python module that defines one function for each entry point.
+
+    entry_points maps the name of each function to the subschema of schema that it checks. Each function takes the data
+    to check as its only argument and returns True if it is valid. References to remote schemas are resolved from
+    store (see validation.load_schema_store).
+    """
+    return _Generator(schema, store).generate(entry_points)
+
+
+def _cache_key(schema: dict, store: dict[str, dict], entry_points: dict[str, Any]) -> str:
+    content = json.dumps(
+        {"version": GENERATOR_VERSION, "schema": schema, "store": store, "entry_points": entry_points}, sort_keys=True
+    )
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def load_functions(
+    schema: dict, store: dict[str, dict], entry_points: dict[str, Any], cache_dir: str | None = None
+) -> dict[str, Callable[[Any], bool]]:
+    """
+    Return the functions generated for each entry point (see generate_source).
+
+    If cache_dir is given, the generated source is cached in that directory and reused as long as the schema, the
+    store and the entry points do not change.
+    """
+    path = None if cache_dir is None else os.path.join(cache_dir, f"{_cache_key(schema, store, entry_points)}.py")
+    source = None
+    if path is not None and os.path.isfile(path):
+        with open(path) as f:
+            source = f.read()
+    if source is None:
+        source = generate_source(schema, store, entry_points)
+        if path is not None:
+            atomic_write(path, source.encode())
+    namespace = {"Defer": Defer}
+    exec(compile(source, path or "<fastpath>", "exec"), namespace)
+    return {name: namespace[name] for name in entry_points}
@@ -0,0 +1,804 @@
+# Network access used by the update script to query each node in the registry.
+#
+# Requests to nodes are run concurrently on a thread pool. The number of requests
+# that are in flight at the same time is bounded globally and for each host so
+# that a large registry can be updated quickly without overloading any single
+# node (multiple nodes may be served from the same host). Requests to a busy host wait
+# in a queue for that host instead of on a worker of the pool so that they do not hold
+# up the requests to other hosts.
+#
+# All requests share a pooled session so that connections to a node are reused and
+# transient errors are retried with an exponential backoff. Nodes that keep failing
+# from one run to the next are tripped by a circuit breaker: they are polled less
+# and less often, with a shorter timeout, until they respond again.
+#
+# Response bodies are streamed and read in chunks so that a node cannot make the
+# update script buffer an arbitrarily large body or keep a connection busy forever.
+#
+# Timeouts only bound each individual socket operation, so a node that trickles its
+# response (or that is retried several times) can still take much longer than any of
+# them. Each node therefore also has a hard deadline that covers both of its endpoints,
+# retries included, and the whole sweep has a time budget. When a deadline passes, the
+# requests that have not been sent are not sent, the sockets of the requests that are
+# in flight are shut down (including during the TLS handshake), waits between retries
+# are interrupted and connection attempts time out, so that the worker threads are
+# released immediately. Only resolving the name of a host cannot be interrupted.
+
+import datetime
+import json
+import socket
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Any, Callable, Iterator, Mapping
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.response import BaseHTTPResponse
+from urllib3.util.retry import Retry
+
+from cache import ResponseCache, atomic_write
+
+MAX_CONNECTIONS = 16
+MAX_CONNECTIONS_PER_HOST = 2
+REQUEST_TIMEOUT = 10
+# Maximum size of a response body and maximum time spent reading it
+MAX_RESPONSE_BYTES = 10 * 1024 * 1024
+READ_DEADLINE = 30
+READ_CHUNK_SIZE = 64 * 1024
+RETRIES = 2
+RETRY_BACKOFF_FACTOR = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Maximum time to wait before retrying a request when the response asks for a longer delay (Retry-After header)
+RETRY_AFTER_MAX = 10
+# Maximum time to fetch both endpoints of a node, counted from the moment its first request is sent
+NODE_DEADLINE = 60
+# Maximum time to fetch every node in the registry
+SWEEP_DEADLINE = 20 * 60
+
+# A node is tripped after this many consecutive failed runs
+BREAKER_THRESHOLD = 3
+# A tripped node is polled again after this delay, doubled for every additional failure up to BREAKER_MAX_DELAY
+BREAKER_BASE_DELAY = datetime.timedelta(hours=1)
+BREAKER_MAX_DELAY = datetime.timedelta(days=7)
+# Timeout used when polling a tripped node
+BREAKER_REQUEST_TIMEOUT = 3
+
+
+_current = threading.local()
+
+
+class Cancellation(threading.Event):
+    """
+    An event that is set to cancel the requests to a node.
+
+    Requests that have not been sent yet when it is set are not sent (see get_json) and the sockets of the requests
+    that are in flight are shut down. If it is set with an error, the requests fail with that error.
+
+    If deadline is given, the event is set with a NodeDeadlineExceeded error deadline seconds after start is first
+    called. expires is the time.monotonic value at which the event is set by someone else if it is not set before (ex:
+    the end of the sweep), it is only used to bound the operations that cannot be interrupted (see remaining).
+    """
+
+    def __init__(self, deadline: float | None = None, expires: float | None = None) -> None:
+        super().__init__()
+        self.deadline = deadline
+        self.expires = expires
+        self.error: Exception | None = None
+        self._started: float | None = None
+        self._sockets: set[socket.socket] = set()
+        self._timer: threading.Timer | None = None
+        self._callbacks: list[Callable[[Exception | None], None]] = []
+        self._cancel_lock = threading.Lock()
+
+    def set(self, error: Exception | None = None) -> None:
+        with self._cancel_lock:
+            if self.is_set():
+                return
+            self.error = error
+            super().set()
+            sockets = list(self._sockets)
+            callbacks = list(self._callbacks)
+        for sock in sockets:
+            _abort(sock)
+        for callback in callbacks:
+            callback(error)
+
+    def add_callback(self, callback: Callable[[Exception | None], None]) -> None:
+        """
+        Call callback with the error that the event is set with as soon as it is set.
+        """
+        with self._cancel_lock:
+            if not self.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self.error)
+
+    def start(self) -> None:
+        """
+        Start counting down the deadline, if there is one and it is not already counting down.
+        """
+        with self._cancel_lock:
+            if self.deadline is None or self._timer is not None or self.is_set():
+                return
+            error = NodeDeadlineExceeded(f"requests did not complete within {self.deadline} seconds")
+            self._started = time.monotonic()
+            self._timer = threading.Timer(self.deadline, self.set, args=(error,))
+            self._timer.daemon = True
+            self._timer.start()
+
+    def remaining(self) -> float | None:
+        """
+        Return the number of seconds until the event is set by a deadline or None if there is no deadline yet.
+        """
+        ends = [] if self.expires is None else [self.expires]
+        if self._started is not None:
+            ends.append(self._started + self.deadline)
+        return max(min(ends) - time.monotonic(), 0) if ends else None
+
+    def finish(self) -> None:
+        """
+        Stop counting down the deadline once the requests are complete.
+        """
+        with self._cancel_lock:
+            if self._timer is not None:
+                self._timer.cancel()
+
+    def register(self, sock: socket.socket) -> None:
+        with self._cancel_lock:
+            if not self.is_set():
+                self._sockets.add(sock)
+                return
+        _abort(sock)
+
+    def unregister(self, sock: socket.socket) -> None:
+        with self._cancel_lock:
+            self._sockets.discard(sock)
+
+    @contextmanager
+    def track(self) -> Iterator[None]:
+        """
+        Register the sockets used by the current thread in the body of the with statement.
+
+        Sockets are unregistered when the context exits because the connections are returned to the pool and may then
+        be used for requests to other nodes.
+        """
+        _current.cancellation = self
+        _current.sockets = set()
+        _current.duplicates = []
+        try:
+            yield
+        finally:
+            for sock in _current.sockets:
+                self.unregister(sock)
+            for sock in _current.duplicates:
+                sock.close()
+            _current.cancellation = None
+            _current.sockets = set()
+            _current.duplicates = []
+
+
+def _abort(sock: socket.socket) -> None:
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass  # the socket is already closed
+
+
+def _register_socket(sock: socket.socket | None) -> None:
+    cancellation = getattr(_current, "cancellation", None)
+    if sock is not None and cancellation is not None:
+        _current.sockets.add(sock)
+        cancellation.register(sock)
+
+
+class _CancellableConnectionMixin:
+    """
+    Register the socket of the connection with the cancellation of the current thread (see Cancellation.track).
+
+    The socket that the last request was sent over is kept as request_socket.
+    """
+
+    def connect(self) -> None:
+        # connections (including retries) are not opened once the requests of the node are cancelled
+        cancellation = getattr(_current, "cancellation", None)
+        if cancellation is not None and cancellation.is_set():
+            raise cancellation.error or ConnectionAbortedError("the requests to the node were cancelled")
+        # connecting cannot be interrupted so it must not outlast the deadline
+        if cancellation is not None and (remaining := cancellation.remaining()) is not None:
+            self.timeout = remaining if self.timeout is None else min(self.timeout, remaining)
+        super().connect()
+        _register_socket(self.sock)
+        self.request_socket = self.sock
+
+    def _new_conn(self) -> socket.socket:
+        sock = super()._new_conn()
+        # The TLS handshake detaches the file descriptor from this socket before it starts, a duplicate of it can
+        # still shut the connection down while the handshake is in progress
+        if getattr(_current, "cancellation", None) is not None:
+            duplicate = sock.dup()
+            _current.duplicates.append(duplicate)
+            _register_socket(duplicate)
+        return sock
+
+    def request(self, *args, **kwargs) -> None:
+        # a connection reused from the pool is already connected
+        _register_socket(self.sock)
+        # kept for read_body, the connection forgets its socket when the response is the last one sent over it
+        # (a connection that is not connected yet sets it when it connects)
+        self.request_socket = self.sock
+        super().request(*args, **kwargs)
+
+
+class _CancellableHTTPConnection(_CancellableConnectionMixin, HTTPConnection):
+    pass
+
+
+class _CancellableHTTPSConnection(_CancellableConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _CancellableHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _CancellableHTTPConnection
+
+
+class _CancellableHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _CancellableHTTPSConnection
+
+
+class _CancellableRetry(Retry):
+    """
+    Wait between retries for at most RETRY_AFTER_MAX seconds and stop waiting as soon as the requests of the node are
+    cancelled (see Cancellation.track).
+    """
+
+    def sleep(self, response: BaseHTTPResponse | None = None) -> None:
+        retry_after = self.get_retry_after(response) if self.respect_retry_after_header and response else None
+        seconds = self.get_backoff_time() if retry_after is None else min(retry_after, RETRY_AFTER_MAX)
+        cancellation = getattr(_current, "cancellation", None)
+        if cancellation is None:
+            time.sleep(seconds)
+        elif cancellation.wait(seconds):
+            raise cancellation.error or ConnectionAbortedError("the requests to the node were cancelled")
+
+
+class _CancellableAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CancellableHTTPConnectionPool,
+            "https": _CancellableHTTPSConnectionPool,
+        }
+
+
+def create_session(
+    max_connections: int = MAX_CONNECTIONS, retries: int = RETRIES, backoff_factor: float = RETRY_BACKOFF_FACTOR
+) -> requests.Session:
+    """
+    Return a session with a connection pool large enough for max_connections concurrent requests.
+
+    Requests that fail to connect, time out while reading or return one of the RETRY_STATUSES are retried up to
+    retries times, waiting backoff_factor * 2 ** (retry number - 1) seconds between attempts, or the delay requested
+    by the response (up to RETRY_AFTER_MAX seconds).
+
+    The connections of the session can be shut down, and the waits between retries interrupted, by a Cancellation
+    (see get_json).
+    """
+    retry = _CancellableRetry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods={"GET"},
+        raise_on_status=False,
+    )
+    adapter = _CancellableAdapter(pool_connections=max_connections, pool_maxsize=max_connections, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class CircuitBreaker:
+    """
+    Track consecutive failures of each node across runs and decide which nodes should be polled.
+
+    The state is stored as json in path.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        try:
+            with open(path) as f:
+                self._state = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._state = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _now() -> datetime.datetime:
+        return datetime.datetime.now(tz=datetime.timezone.utc)
+
+    def is_tripped(self, name: str) -> bool:
+        """
+        Return True if the node has failed at least BREAKER_THRESHOLD times in a row.
+        """
+        return self._state.get(name, {}).get("failures", 0) >= BREAKER_THRESHOLD
+
+    def allow(self, name: str) -> bool:
+        """
+        Return True if the node should be polled now.
+        """
+        if not self.is_tripped(name):
+            return True
+        return self._now() >= datetime.datetime.fromisoformat(self._state[name]["next_attempt"])
+
+    def timeout(self, name: str) -> float:
+        """
+        Return the timeout to use for requests to the node.
+        """
+        return BREAKER_REQUEST_TIMEOUT if self.is_tripped(name) else REQUEST_TIMEOUT
+
+    def record_success(self, name: str) -> None:
+        with self._lock:
+            self._state.pop(name, None)
+
+    def record_failure(self, name: str) -> None:
+        with self._lock:
+            failures = self._state.get(name, {}).get("failures", 0) + 1
+            state = {"failures": failures}
+            if failures >= BREAKER_THRESHOLD:
+                # the exponent is bounded so that the delay cannot overflow before it is capped
+                exponent = min(failures - BREAKER_THRESHOLD, 32)
+                delay = min(BREAKER_BASE_DELAY * 2**exponent, BREAKER_MAX_DELAY)
+                state["next_attempt"] = (self._now() + delay).isoformat()
+            self._state[name] = state
+
+    def save(self) -> None:
+        """
+        Write the state to disk so that it can be used in the next run.
+        """
+        with self._lock:
+            atomic_write(self.path, json.dumps(self._state, indent=2).encode())
+
+
+class ResponseTooLarge(requests.exceptions.RequestException):
+    """
+    The response body is larger than the maximum number of bytes allowed.
+    """
+
+
+class ReadDeadlineExceeded(requests.exceptions.Timeout):
+    """
+    The response body was not fully read before the read deadline.
+    """
+
+
+class NodeDeadlineExceeded(requests.exceptions.Timeout):
+    """
+    The requests to a node did not complete before the node's deadline.
+    """
+
+
+class SweepDeadlineExceeded(requests.exceptions.Timeout):
+    """
+    The requests to a node did not complete before the deadline of the whole sweep.
+    """
+
+
+def _host(url: str) -> str:
+    return urlparse(url).netloc.lower()
+
+
+class ConnectionLimiter:
+    """
+    Limit the number of concurrent connections globally and for each host.
+
+    Work that connects to a host should be scheduled with submit rather than submitted to the executor directly: a
+    worker that blocks in limit while the host is busy cannot send a request to any other host, so a run of requests
+    to the same host would otherwise bring the concurrency of the whole pool down to max_per_host.
+    """
+
+    def __init__(self, max_connections: int = MAX_CONNECTIONS, max_per_host: int = MAX_CONNECTIONS_PER_HOST) -> None:
+        self._global = threading.BoundedSemaphore(max_connections)
+        self._max_per_host = max_per_host
+        self._hosts: dict[str, threading.BoundedSemaphore] = {}
+        self._queues: dict[str, deque] = defaultdict(deque)
+        self._submitted: dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def _host_semaphore(self, url: str) -> threading.BoundedSemaphore:
+        host = _host(url)
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.BoundedSemaphore(self._max_per_host)
+            return self._hosts[host]
+
+    @contextmanager
+    def limit(self, url: str) -> Iterator[None]:
+        """
+        Block until a connection to the host of url is allowed and hold that connection slot until the context exits.
+        """
+        host_semaphore = self._host_semaphore(url)
+        # acquire the host slot first so that requests waiting on a busy host do not hold on to a global slot
+        with host_semaphore, self._global:
+            yield
+
+    def submit(self, executor: Executor, url: str, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Schedule fn(*args, **kwargs), which connects to the host of url, to run on executor and return its future.
+
+        At most max_per_host calls for the same host are submitted to the executor at a time, the others wait in a
+        queue for that host without occupying a worker. The returned future can be cancelled until its call starts.
+        """
+        future = Future()
+        host = _host(url)
+        with self._lock:
+            self._queues[host].append((future, fn, args, kwargs))
+        self._dispatch(executor, host)
+        return future
+
+    def _dispatch(self, executor: Executor, host: str) -> None:
+        while True:
+            with self._lock:
+                queue = self._queues[host]
+                if not queue or self._submitted[host] >= self._max_per_host:
+                    return
+                future, fn, args, kwargs = queue.popleft()
+                if future.cancelled():
+                    # as an executor would, so that concurrent.futures.wait sees that the call will never run
+                    future.set_running_or_notify_cancel()
+                    continue
+                self._submitted[host] += 1
+            try:
+                submitted = executor.submit(self._run, executor, host, future, fn, args, kwargs)
+            except RuntimeError:
+                # the executor was shut down so the calls that are still queued will never run
+                with self._lock:
+                    self._submitted[host] -= 1
+                    unsent = [future, *(queued[0] for queued in queue)]
+                    queue.clear()
+                for future in unsent:
+                    future.cancel()
+                    future.set_running_or_notify_cancel()
+                return
+            submitted.add_done_callback(partial(self._cancelled, executor, host, future))
+
+    def _run(self, executor: Executor, host: str, future: Future, fn: Callable, args: tuple, kwargs: dict) -> None:
+        try:
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+        finally:
+            with self._lock:
+                self._submitted[host] -= 1
+            self._dispatch(executor, host)
+
+    def _cancelled(self, executor: Executor, host: str, future: Future, submitted: Future) -> None:
+        # the call was cancelled by the executor (see Executor.shutdown) before it started
+        if submitted.cancelled():
+            future.cancel()
+            future.set_running_or_notify_cancel()
+            with self._lock:
+                self._submitted[host] -= 1
+            self._dispatch(executor, host)
+
+
+@dataclass(frozen=True)
+class EndpointResponse:
+    """
+    Content returned by a node endpoint.
+
+    If not_modified is True, the endpoint reported that its content did not change since the previous run and the
+    content is the one that was cached during that run.
+
+    timings contains the number of seconds spent waiting for a connection slot ("wait"), between sending the request
+    and receiving the response headers, including the time to connect ("ttfb"), and receiving the body ("download").
+    """
+
+    url: str
+    content: bytes
+    not_modified: bool = False
+    timings: dict[str, float] = field(default_factory=dict, compare=False)
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self) -> Any:
+        """
+        Return the content decoded as json. Raise a json.JSONDecodeError if the content is not valid json.
+        """
+        return json.loads(self.content)
+
+
+def read_body(response: requests.Response, max_bytes: int, deadline: float) -> bytes:
+    """
+    Return the body of a streamed response.
+
+    Raise ResponseTooLarge as soon as more than max_bytes have been received and ReadDeadlineExceeded if the body is
+    not fully received by deadline (a time.monotonic value). The connection is closed in either case.
+
+    Reading a chunk only returns once the whole chunk is received, so the connection is shut down when the deadline
+    passes rather than waiting for a body that trickles in to fill a chunk.
+    """
+    try:
+        content_length = int(response.headers.get("Content-Length", 0))
+    except ValueError:
+        content_length = 0
+    if content_length > max_bytes:
+        response.close()
+        raise ResponseTooLarge(f"response from {response.url} is {content_length} bytes (maximum {max_bytes})")
+    expired = threading.Event()
+    timer = None
+    if (sock := getattr(getattr(response.raw, "connection", None), "request_socket", None)) is not None:
+
+        def _expired() -> None:
+            expired.set()
+            _abort(sock)
+
+        timer = threading.Timer(max(deadline - time.monotonic(), 0), _expired)
+        timer.daemon = True
+        timer.start()
+    chunks = []
+    size = 0
+    try:
+        for chunk in response.iter_content(READ_CHUNK_SIZE):
+            size += len(chunk)
+            if size > max_bytes:
+                response.close()
+                raise ResponseTooLarge(f"response from {response.url} is larger than {max_bytes} bytes")
+            if expired.is_set() or time.monotonic() > deadline:
+                break
+            chunks.append(chunk)
+    except (requests.exceptions.RequestException, OSError):
+        if not expired.is_set():
+            raise
+    finally:
+        if timer is not None:
+            timer.cancel()
+    # a connection that is shut down while the body is read looks like the end of the body
+    if expired.is_set() or time.monotonic() > deadline:
+        response.close()
+        raise ReadDeadlineExceeded(f"response from {response.url} was not received before the read deadline")
+    return b"".join(chunks)
+
+
+def get_json(
+    url: str,
+    limiter: ConnectionLimiter,
+    cancelled: threading.Event | None = None,
+    cache: ResponseCache | None = None,
+    session: requests.Session | None = None,
+    timeout: float = REQUEST_TIMEOUT,
+    max_bytes: int | None = None,
+    read_deadline: float | None = None,
+    scheduled: float | None = None,
+) -> EndpointResponse | None:
+    """
+    Send a GET request to url asking for a json response.
+
+    The response body is limited to max_bytes (MAX_RESPONSE_BYTES by default) and must be received within
+    read_deadline seconds (READ_DEADLINE by default) of sending the request (see read_body).
+    If a cache is provided, the request is conditional on the content having changed since it was last cached.
+    If cancelled is set by the time a connection slot is available, return None without sending the request.
+
+    If cancelled is a Cancellation, its deadline starts when the request is sent and the request is aborted as soon
+    as it is set. The request then fails with the error that it was set with, if any.
+
+    scheduled is the time.perf_counter value at which the request was scheduled (see ConnectionLimiter.submit), the
+    time since then is reported as waiting for a connection slot.
+    """
+    if isinstance(cancelled, Cancellation):
+        with cancelled.track():
+            try:
+                return _get_json(
+                    url, limiter, cancelled, cache, session, timeout, max_bytes, read_deadline, scheduled
+                )
+            except (requests.exceptions.RequestException, OSError) as e:
+                # errors raised because the connection was shut down are reported as the reason it was shut down
+                if cancelled.error is not None and e is not cancelled.error:
+                    raise cancelled.error from e
+                raise
+    return _get_json(url, limiter, cancelled, cache, session, timeout, max_bytes, read_deadline, scheduled)
+
+
+def _get_json(
+    url: str,
+    limiter: ConnectionLimiter,
+    cancelled: threading.Event | None,
+    cache: ResponseCache | None,
+    session: requests.Session | None,
+    timeout: float,
+    max_bytes: int | None,
+    read_deadline: float | None,
+    scheduled: float | None,
+) -> EndpointResponse | None:
+    http = session if session is not None else requests
+    max_bytes = MAX_RESPONSE_BYTES if max_bytes is None else max_bytes
+    headers = {"Accept": "application/json"}
+    timings = {}
+    start = time.perf_counter() if scheduled is None else scheduled
+    with limiter.limit(url):
+        if cancelled is not None and cancelled.is_set():
+            if (error := getattr(cancelled, "error", None)) is not None:
+                raise error
+            return None
+        if isinstance(cancelled, Cancellation):
+            cancelled.start()
+        timings["wait"] = time.perf_counter() - start
+        start = time.perf_counter()
+        deadline = time.monotonic() + (READ_DEADLINE if read_deadline is None else read_deadline)
+        conditional_headers = cache.conditional_headers(url) if cache is not None else {}
+        response = http.get(url, headers={**headers, **conditional_headers}, timeout=timeout, stream=True)
+        if response.status_code == 304 and conditional_headers:
+            response.close()
+            if (body := cache.get_body(url)) is not None:
+                timings["ttfb"] = time.perf_counter() - start
+                return EndpointResponse(url, body, not_modified=True, timings=timings)
+            # the cached body is missing or corrupted so the content has to be requested again
+            response = http.get(url, headers=headers, timeout=timeout, stream=True)
+        timings["ttfb"] = time.perf_counter() - start
+        start = time.perf_counter()
+        content = read_body(response, max_bytes, deadline)
+        timings["download"] = time.perf_counter() - start
+    # a connection that is shut down while the body is read looks like the end of the body, which may be truncated
+    if (error := getattr(cancelled, "error", None)) is not None:
+        raise error
+    if cache is not None and response.status_code == 200:
+        cache.store(url, response.headers, content)
+    return EndpointResponse(url, content, timings=timings)
+
+
+def node_urls(data: dict) -> tuple[str | None, str | None]:
+    """
+    Return the urls of the services and version endpoints of the node described by data.
+    """
+    services_url = None
+    version_url = None
+    for link in data["links"]:
+        if link["rel"] == "collection":
+            services_url = link["href"]
+        elif link["rel"] == "version":
+            version_url = link["href"]
+    return services_url, version_url
+
+
+def _gather(services: Future, version: Future, cancelled: Cancellation) -> Future:
+    """
+    Return a future that resolves to the results of both the services and version futures.
+
+    As soon as either of them fails, the returned future fails with the same error and the sibling request is
+    cancelled so that a node that is already known to be unreachable does not hold up a connection slot.
+
+    If cancelled is set with an error (ex: a deadline passed), the returned future fails with that error immediately,
+    even if a request cannot be aborted and is still running.
+    """
+    gathered = Future()
+    lock = threading.RLock()  # cancelling a future runs its callbacks in the current thread
+
+    def _done(future: Future) -> None:
+        with lock:
+            if gathered.done() or future.cancelled():
+                return
+            if (error := future.exception()) is not None:
+                cancelled.set()
+                cancelled.finish()
+                services.cancel()
+                version.cancel()
+                gathered.set_exception(error)
+            elif services.done() and version.done():
+                cancelled.finish()
+                gathered.set_result((services.result(), version.result()))
+
+    def _cancelled(error: Exception | None) -> None:
+        if error is None:
+            return
+        with lock:
+            if gathered.done():
+                return
+            services.cancel()
+            version.cancel()
+            gathered.set_exception(error)
+
+    services.add_done_callback(_done)
+    version.add_done_callback(_done)
+    cancelled.add_callback(_cancelled)
+    return gathered
+
+
+def fetch_nodes(
+    registry: dict,
+    max_connections: int = MAX_CONNECTIONS,
+    max_per_host: int = MAX_CONNECTIONS_PER_HOST,
+    cache: ResponseCache | None = None,
+    session: requests.Session | None = None,
+    timeouts: Mapping[str, float] | None = None,
+    max_bytes: int | None = None,
+    read_deadline: float | None = None,
+    node_deadline: float | None = NODE_DEADLINE,
+    deadline: float | None = SWEEP_DEADLINE,
+) -> Iterator[tuple[str, dict, Future]]:
+    """
+    Fetch the services and version of every node in the registry concurrently.
+
+    Yield a tuple containing the name of the node, its data and a future that resolves to a tuple containing the
+    responses (EndpointResponse) from the services and version endpoints of that node. Both endpoints of a node are
+    requested at the same time. Tuples are yielded in registry order so that the caller can process results
+    deterministically regardless of the order in which nodes respond.
+
+    Requests to a node use the timeout in timeouts for that node, if there is one, or REQUEST_TIMEOUT otherwise.
+    See get_json for max_bytes and read_deadline.
+
+    The future of a node fails with NodeDeadlineExceeded if both of its endpoints are not fetched within node_deadline
+    seconds of sending its first request, and with SweepDeadlineExceeded if they are not fetched within deadline
+    seconds of calling this function. Either deadline can be disabled by setting it to None. The generator only
+    finishes once every request is complete, shortly after the deadlines pass at the latest.
+    """
+    limiter = ConnectionLimiter(max_connections, max_per_host)
+    timeouts = timeouts or {}
+    cancellations = {}
+    executor = ThreadPoolExecutor(max_workers=max_connections)
+    sweep_timer = None
+    exhausted = False
+    expires = None if deadline is None else time.monotonic() + deadline
+    if deadline is not None:
+
+        def _sweep_deadline_exceeded() -> None:
+            for cancellation in list(cancellations.values()):
+                cancellation.set(SweepDeadlineExceeded(f"requests did not complete within {deadline} seconds"))
+
+        sweep_timer = threading.Timer(deadline, _sweep_deadline_exceeded)
+        sweep_timer.daemon = True
+        sweep_timer.start()
+    submitted = []
+    try:
+        futures = {}
+        for name, data in registry.items():
+            # This assumes the json is initially valid according to the schema
+            services_url, version_url = node_urls(data)
+            cancellations[name] = cancelled = Cancellation(node_deadline, expires)
+            timeout = timeouts.get(name, REQUEST_TIMEOUT)
+            services, version = (
+                limiter.submit(
+                    executor,
+                    url,
+                    get_json,
+                    url,
+                    limiter,
+                    cancelled,
+                    cache,
+                    session,
+                    timeout,
+                    max_bytes,
+                    read_deadline,
+                    time.perf_counter(),
+                )
+                for url in (services_url, version_url)
+            )
+            submitted += (services, version)
+            futures[name] = _gather(services, version, cancelled)
+        for name, data in registry.items():
+            yield name, data, futures[name]
+        exhausted = True
+    finally:
+        if not exhausted:
+            # the caller stopped early so the requests still in flight are aborted instead of waited for
+            for cancellation in cancellations.values():
+                cancellation.set()
+        # every request is bounded by the deadlines so the workers are released shortly after they pass
+        wait(submitted)
+        executor.shutdown()
+        if sweep_timer is not None:
+            sweep_timer.cancel()
@@ -0,0 +1,279 @@
+# An append-only history of the status of each node.
+#
+# Every run of the update script appends one observation per node to a small SQLite
+# database: the time of the run, the node's status, version and number of services, and
+# how long the node took to respond. Observations are clustered by node and time so that
+# questions like "what was the uptime of this node last quarter?" are answered with a
+# single range scan instead of by replaying copies of the registry.
+#
+# Query the history written by the update script (see HISTORY_DB) with:
+#
+#   python history.py uptime --since 90d
+#   python history.py latency --since 30d --every 1d --node PAVICS
+
+import argparse
+import datetime
+import json
+import math
+import os
+import re
+import sqlite3
+from typing import Iterable, NamedTuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS observations (
+    node INTEGER NOT NULL REFERENCES nodes (id),
+    time INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    version TEXT,
+    services INTEGER,
+    latency_ms INTEGER,
+    PRIMARY KEY (node, time)
+) WITHOUT ROWID;
+"""
+
+THIS_DIR = os.path.dirname(__file__)
+ROOT_DIR = os.path.dirname(THIS_DIR)
+HISTORY_DB = os.environ.get("MARBLE_NODE_REGISTRY_HISTORY", os.path.join(ROOT_DIR, "node_history.sqlite"))
+
+DEFAULT_PERCENTILES = (50.0, 90.0, 99.0)
+DURATION_PATTERN = re.compile(r"^(\d+(?:\.\d+)?)([smhdw])$")
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+class Observation(NamedTuple):
+    """
+    The state of a node at the end of a run of the update script.
+
+    latency is the time (in seconds) that the node took to respond or None if it was not polled or did not respond.
+    """
+
+    node: str
+    status: str
+    version: str | None = None
+    services: int | None = None
+    latency: float | None = None
+
+
+def _timestamp(time: datetime.datetime | None) -> int:
+    time = datetime.datetime.now(tz=datetime.timezone.utc) if time is None else time
+    return int(time.timestamp())
+
+
+def percentile(values: list[float], p: float) -> float:
+    """
+    Return the pth percentile of the sorted values using linear interpolation between the closest ranks.
+    """
+    rank = (len(values) - 1) * p / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+class HistoryStore:
+    """
+    The history of the nodes' observations kept in the SQLite database at path.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self) -> "HistoryStore":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def _node_ids(self, names: Iterable[str]) -> dict[str, int]:
+        names = list(names)
+        self.connection.executemany("INSERT OR IGNORE INTO nodes (name) VALUES (?)", ((name,) for name in names))
+        ids = {}
+        for name, id_ in self.connection.execute("SELECT name, id FROM nodes"):
+            ids[name] = id_
+        return ids
+
+    def append(self, observations: Iterable[Observation], time: datetime.datetime | None = None) -> None:
+        """
+        Append observations made at time (now if not given) to the history.
+        """
+        observations = list(observations)
+        timestamp = _timestamp(time)
+        with self.connection:
+            ids = self._node_ids(observation.node for observation in observations)
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO observations VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    (
+                        ids[observation.node],
+                        timestamp,
+                        observation.status,
+                        observation.version,
+                        observation.services,
+                        None if observation.latency is None else round(observation.latency * 1000),
+                    )
+                    for observation in observations
+                ),
+            )
+
+    def _where(
+        self, since: datetime.datetime | None, until: datetime.datetime | None, nodes: Iterable[str] | None
+    ) -> tuple[str, list]:
+        clauses, params = [], []
+        if since is not None:
+            clauses.append("observations.time >= ?")
+            params.append(_timestamp(since))
+        if until is not None:
+            clauses.append("observations.time < ?")
+            params.append(_timestamp(until))
+        if nodes is not None:
+            nodes = list(nodes)
+            clauses.append(f"nodes.name IN ({', '.join('?' * len(nodes))})")
+            params.extend(nodes)
+        return (f"WHERE {' AND '.join(clauses)}" if clauses else ""), params
+
+    def uptime(
+        self,
+        since: datetime.datetime | None = None,
+        until: datetime.datetime | None = None,
+        nodes: Iterable[str] | None = None,
+    ) -> dict[str, float]:
+        """
+        Return the percentage of the time between since and until during which each node was online.
+
+        Nodes are not observed at a fixed interval (see daemon.py) so each observation is weighted by the time until
+        the next observation of the same node: a node is assumed to keep the status it was observed with until it is
+        observed again. The last observation made before since counts from since and the most recent observation of
+        each node counts until until or, if until is not given, until the most recent observation in the history.
+        """
+        where, params = self._where(None, until, nodes)
+        if until is not None:
+            end = _timestamp(until)
+        else:
+            (end,) = self.connection.execute("SELECT MAX(time) FROM observations").fetchone()
+        start = None
+        if since is not None:
+            # start from the last observation made at or before since, found with the (node, time) primary key
+            where = f"{where} AND" if where else "WHERE"
+            where = (
+                f"{where} observations.time >= COALESCE((SELECT MAX(previous.time) FROM observations AS previous "
+                "WHERE previous.node = observations.node AND previous.time <= ?), 0)"
+            )
+            start = _timestamp(since)
+            params.append(start)
+        online: dict[str, float] = {}
+        observed: dict[str, float] = {}
+        last_status: dict[str, str] = {}
+        for name, time, next_time, status in self.connection.execute(
+            "SELECT nodes.name, observations.time, "
+            "LEAD(observations.time) OVER (PARTITION BY observations.node ORDER BY observations.time), "
+            "observations.status "
+            f"FROM observations JOIN nodes ON nodes.id = observations.node {where} ORDER BY nodes.name",
+            params,
+        ):
+            observed_until = end if next_time is None else min(next_time, end)
+            duration = max(0, observed_until - (time if start is None else max(time, start)))
+            online[name] = online.get(name, 0) + (duration if status == "online" else 0)
+            observed[name] = observed.get(name, 0) + duration
+            last_status[name] = status
+        return {
+            # a node that was only observed at the very end of the period counts with that observation
+            name: 100.0 * online[name] / observed[name] if observed[name] else 100.0 * (last_status[name] == "online")
+            for name in observed
+        }
+
+    def latency_percentiles(
+        self,
+        percentiles: Iterable[float] = DEFAULT_PERCENTILES,
+        since: datetime.datetime | None = None,
+        until: datetime.datetime | None = None,
+        nodes: Iterable[str] | None = None,
+    ) -> dict[str, dict[float, float]]:
+        """
+        Return the given percentiles of the latency (in seconds) of each node between since and until.
+
+        Nodes that did not respond during that time are not included.
+        """
+        percentiles = list(percentiles)
+        where, params = self._where(since, until, nodes)
+        where = f"{where} AND" if where else "WHERE"
+        latencies: dict[str, list[float]] = {}
+        for name, latency_ms in self.connection.execute(
+            "SELECT nodes.name, observations.latency_ms "
+            "FROM observations JOIN nodes ON nodes.id = observations.node "
+            f"{where} observations.latency_ms IS NOT NULL ORDER BY nodes.name, observations.latency_ms",
+            params,
+        ):
+            latencies.setdefault(name, []).append(latency_ms / 1000)
+        return {name: {p: percentile(values, p) for p in percentiles} for name, values in latencies.items()}
+
+
+def parse_time(value: str, now: datetime.datetime | None = None) -> datetime.datetime:
+    """
+    Parse an ISO 8601 date or a duration before now (ex: '90d', '12h', '4w').
+    """
+    now = datetime.datetime.now(tz=datetime.timezone.utc) if now is None else now
+    if DURATION_PATTERN.match(value):
+        return now - parse_duration(value)
+    time = datetime.datetime.fromisoformat(value)
+    return time if time.tzinfo else time.replace(tzinfo=datetime.timezone.utc)
+
+
+def parse_duration(value: str) -> datetime.timedelta:
+    match = DURATION_PATTERN.match(value)
+    if match is None:
+        raise ValueError(f"invalid duration '{value}', expected a number followed by one of s, m, h, d or w")
+    return datetime.timedelta(seconds=float(match.group(1)) * DURATION_UNITS[match.group(2)])
+
+
+def windows(
+    since: datetime.datetime, until: datetime.datetime, every: datetime.timedelta | None
+) -> list[tuple[datetime.datetime, datetime.datetime]]:
+    """
+    Split the time between since and until into consecutive windows of length every.
+    """
+    if every is None:
+        return [(since, until)]
+    result = []
+    while since < until:
+        result.append((since, min(since + every, until)))
+        since += every
+    return result
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Query the history of the nodes in the registry.")
+    parser.add_argument("query", choices=("uptime", "latency"))
+    parser.add_argument("--history", default=HISTORY_DB, help="path to the history database (default: %(default)s)")
+    parser.add_argument("--since", default="30d", help="start of the time window (ISO 8601 date or ex: '90d')")
+    parser.add_argument("--until", help="end of the time window (ISO 8601 date or ex: '1d'), defaults to now")
+    parser.add_argument("--every", type=parse_duration, help="report for consecutive windows of this length")
+    parser.add_argument("--node", action="append", help="only report on this node (can be repeated)")
+    parser.add_argument(
+        "--percentiles", type=float, nargs="+", default=DEFAULT_PERCENTILES, help="latency percentiles to report"
+    )
+    args = parser.parse_args(argv)
+    if not os.path.isfile(args.history):
+        parser.error(f"history database {args.history} does not exist (see --history)")
+
+    now = datetime.datetime.now(tz=datetime.timezone.utc)
+    since = parse_time(args.since, now)
+    until = now if args.until is None else parse_time(args.until, now)
+    with HistoryStore(args.history) as store:
+        for start, end in windows(since, until, args.every):
+            if args.query == "uptime":
+                result = store.uptime(start, end, args.node)
+            else:
+                result = store.latency_percentiles(args.percentiles, start, end, args.node)
+            print(json.dumps({"since": start.isoformat(), "until": end.isoformat(), args.query: result}))
+
+
+if __name__ == "__main__":
+    main()
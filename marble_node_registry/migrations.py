@@ -2,16 +2,109 @@
 # older version of the schema are updated automatically to comply with the newest
 # version of the schema.
 #
-# If a backwards incompatible change is introduced in the schema, please make a 
+# If a backwards incompatible change is introduced in the schema, please make a
 # new migration function here to ensure that older data is properly updated.
 #
 # Migration functions will be applied to each node's data in the order that they
 # appear in the MIGRATIONS variable at the bottom of this file.
 #
-# All migration function should take a single argument which contains the node's
-# data and modify that data in place.
+# Each migration is tagged with the version of the schema that introduced the change
+# that it migrates. Migrations are skipped for payloads that declare that they comply
+# with that version (or a newer one) of the schema. Migrations can also provide an
+# "applies" function that detects whether a given payload still needs the migration,
+# which keeps the cost of migrating payloads that are already current close to zero.
+#
+# Migrations are either:
+#   - node migrations (node_migration): take the node's data as a single argument
+#   - service migrations (service_migration): take a single service as a single argument
+# Both kinds modify their argument in place. Consecutive service migrations are fused
+# so that the node's services are traversed only once for all of them.
+#
+# The result of migrating a service may be cached between runs (see cache.ServiceMemo),
+# the cache is invalidated whenever the name, version or code of a migration changes.
+
+import hashlib
+import inspect
+import marshal
+import re
+from dataclasses import dataclass
+from typing import Callable, Collection, Iterable
+
+# A payload can declare the version of the schema that it complies with by including
+# either a "schema_version" value or a "$schema" value with a url that contains the tag
+# of the schema (ex: ".../refs/tags/1.3.0/node_registry.schema.json").
+SCHEMA_TAG_PATTERN = re.compile(r"/refs/tags/v?(\d+(?:\.\d+)*)/")
+
+
+class MigrationError(Exception):
+    """
+    A migration raised an error.
+    """
+
+    def __init__(self, migration: "Migration", error: Exception, service_index: int | None = None) -> None:
+        self.migration = migration
+        self.error = error
+        self.service_index = service_index
+        where = "" if service_index is None else f" for service {service_index}"
+        super().__init__(f"migration '{migration.name}' (schema version {migration.version}) failed{where}: {error}")
+
+
+@dataclass(frozen=True)
+class Migration:
+    """
+    A migration function and when it should be applied.
+    """
+
+    func: Callable[[dict], None]
+    version: str
+    per_service: bool
+    applies: Callable[[dict], bool] | None = None
+
+    @property
+    def name(self) -> str:
+        return self.func.__name__
+
+    def needed_for(self, declared_version: tuple[int, ...] | None) -> bool:
+        """
+        Return True if a payload that declares that it complies with declared_version may need this migration.
+        """
+        return declared_version is None or declared_version < parse_version(self.version)
+
+
+def parse_version(version: str) -> tuple[int, ...]:
+    return tuple(int(part) for part in version.split("."))
+
+
+def declared_schema_version(payload: dict) -> tuple[int, ...] | None:
+    """
+    Return the version of the schema that the payload declares that it complies with or None if it does not.
+    """
+    if isinstance(version := payload.get("schema_version"), str):
+        try:
+            return parse_version(version)
+        except ValueError:
+            return None
+    if isinstance(schema := payload.get("$schema"), str) and (match := SCHEMA_TAG_PATTERN.search(schema)):
+        return parse_version(match.group(1))
+    return None
+
+
+def node_migration(version: str, applies: Callable[[dict], bool] | None = None) -> Callable:
+    """
+    Decorate a function that migrates a node's data to comply with the given version of the schema.
+    """
+    return lambda func: Migration(func, version, per_service=False, applies=applies)
+
 
-def convert_keywords_to_types(data: dict) -> None:
+def service_migration(version: str, applies: Callable[[dict], bool] | None = None) -> Callable:
+    """
+    Decorate a function that migrates a single service to comply with the given version of the schema.
+    """
+    return lambda func: Migration(func, version, per_service=True, applies=applies)
+
+
+@service_migration("1.3.0", applies=lambda service: "types" not in service)
+def convert_keywords_to_types(service: dict) -> None:
     """
     Add service types if they don't exist.
 
@@ -31,16 +124,95 @@ def convert_keywords_to_types(data: dict) -> None:
         "service-wcs": "wcs",
         "service-ogcapi_processes": "ogcapi_processes"
     }
-    for service in data["services"]:
-        if "types" not in service:
-            service["types"] = []
-            for keyword in service["keywords"]:
-                if (type_ := keyword2type.get(keyword)):
-                    service["types"].append(type_)
-            if not service["types"]:
-                service["types"].append("other")
+    service["types"] = []
+    for keyword in service["keywords"]:
+        if (type_ := keyword2type.get(keyword)):
+            service["types"].append(type_)
+    if not service["types"]:
+        service["types"].append("other")
 
 
 MIGRATIONS = (
     convert_keywords_to_types,
 )
+
+
+def needs_node_migrations(
+    declared_version: tuple[int, ...] | None = None, migrations: Iterable[Migration] = MIGRATIONS
+) -> bool:
+    """
+    Return True if a node migration may need to be applied to a payload declaring declared_version.
+    """
+    return any(not migration.per_service and migration.needed_for(declared_version) for migration in migrations)
+
+
+def _source(func: Callable) -> bytes:
+    try:
+        return inspect.getsource(func).encode()
+    except (OSError, TypeError):
+        # the source is not available (ex: the function was created by exec), the code object includes the constants
+        return marshal.dumps(func.__code__)
+
+
+def fingerprint(migrations: Iterable[Migration] = MIGRATIONS) -> str:
+    """
+    Return a hash that changes whenever the name, version or code of any of the migrations changes.
+
+    The code of a migration includes its applies function and the constants that either of them use (the bytecode
+    alone does not include constants such as the values of a literal dictionary).
+    """
+    content = hashlib.sha256()
+    for migration in migrations:
+        content.update(f"{migration.name}\n{migration.version}\n".encode())
+        content.update(_source(migration.func))
+        if migration.applies is not None:
+            content.update(_source(migration.applies))
+    return content.hexdigest()
+
+
+def _run(migration: Migration, target: dict, service_index: int | None = None) -> None:
+    try:
+        if migration.applies is None or migration.applies(target):
+            migration.func(target)
+    except Exception as e:
+        raise MigrationError(migration, e, service_index) from e
+
+
+def _passes(migrations: Iterable[Migration]) -> list[tuple[bool, list[Migration]]]:
+    """
+    Group consecutive migrations of the same kind so that service migrations can share a single traversal.
+    """
+    passes = []
+    for migration in migrations:
+        if passes and passes[-1][0] and migration.per_service:
+            passes[-1][1].append(migration)
+        else:
+            passes.append((migration.per_service, [migration]))
+    return passes
+
+
+def apply_migrations(
+    data: dict,
+    declared_version: tuple[int, ...] | None = None,
+    migrations: Iterable[Migration] = MIGRATIONS,
+    services: Collection[int] | None = None,
+) -> None:
+    """
+    Apply all migrations needed for a payload declaring declared_version to data in place.
+
+    Service migrations are only applied to the services at the indices in services (all services by default).
+
+    Raise a MigrationError naming the migration (and service) that failed.
+    """
+    needed = [migration for migration in migrations if migration.needed_for(declared_version)]
+    services = None if services is None else set(services)
+    for per_service, group in _passes(needed):
+        if not per_service:
+            for migration in group:
+                _run(migration, data)
+            continue
+        for i, service in enumerate(data["services"]):
+            if services is not None and i not in services:
+                continue
+            for migration in group:
+                _run(migration, service, i)
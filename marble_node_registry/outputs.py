@@ -0,0 +1,142 @@
+# Static artifacts derived from the registry.
+#
+# Besides 'node_registry.json', each run of the update script writes a directory of
+# smaller artifacts that can be served directly by a static file host:
+#
+#   node_registry.json      the whole registry
+#   nodes/<name>.json       the data for a single node
+#   node_registry.geojson   a GeoJSON FeatureCollection of the location of every node
+#   index.json              the list of nodes and of every artifact with its size and sha256 hash
+#   assets/<sha256>.<ext>   the mirrored icons of the nodes (see assets.py)
+#
+# Every artifact (except index.json and the assets) is also written gzip compressed (.gz)
+# and, if the optional brotli package is installed, brotli compressed (.br).
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Only nodes with names that are safe to use as file names get a shard. This is the
+# same pattern that node names must match in 'node_registry.schema.json'.
+SHARD_NAME_PATTERN = re.compile(r"[a-zA-Z0-9]+")
+
+
+def geojson(registry: dict) -> dict:
+    """
+    Return a GeoJSON FeatureCollection containing a Point feature for every node that has a location.
+    """
+    features = []
+    for name, data in registry.items():
+        location = data.get("location")
+        if not location:
+            continue
+        features.append(
+            {
+                "type": "Feature",
+                "id": name,
+                "geometry": {"type": "Point", "coordinates": [location["longitude"], location["latitude"]]},
+                "properties": {
+                    "name": data.get("name"),
+                    "affiliation": data.get("affiliation"),
+                    "status": data.get("status"),
+                    "registration_status": data.get("registration_status"),
+                    "href": f"nodes/{name}.json",
+                },
+            }
+        )
+    return {"type": "FeatureCollection", "features": features}
+
+
+def _encode(content: dict | list) -> bytes:
+    return json.dumps(content, indent=2).encode()
+
+
+def _compressed_variants(content: bytes) -> dict[str, bytes]:
+    variants = {".gz": gzip.compress(content, mtime=0)}
+    if brotli is not None:
+        variants[".br"] = brotli.compress(content)
+    return variants
+
+
+def _write(directory: str, path: str, content: bytes, manifest: dict) -> None:
+    """
+    Write content and its compressed variants to path (relative to directory) and record them in manifest.
+    """
+    for suffix, data in {"": content, **_compressed_variants(content)}.items():
+        full_path = os.path.join(directory, path + suffix)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, "wb") as f:
+            f.write(data)
+        manifest[path + suffix] = {"size": len(data), "sha256": hashlib.sha256(data).hexdigest()}
+
+
+def _copy_assets(registry: dict, assets_dir: str, directory: str, manifest: dict) -> None:
+    """
+    Copy the assets referenced by the "mirror_href" of any link in the registry from assets_dir to directory.
+    """
+    paths = {
+        link["mirror_href"]
+        for data in registry.values()
+        for link in data.get("links", [])
+        if isinstance(link.get("mirror_href"), str)
+    }
+    for path in sorted(paths):
+        source = os.path.join(assets_dir, os.path.basename(path))
+        try:
+            with open(source, "rb") as f:
+                content = f.read()
+        except FileNotFoundError:
+            sys.stderr.write(f"not writing asset {path}: not found in {assets_dir}\n")
+            continue
+        full_path = os.path.join(directory, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, "wb") as f:
+            f.write(content)
+        manifest[path] = {"size": len(content), "sha256": hashlib.sha256(content).hexdigest()}
+
+
+def write_artifacts(registry: dict, output_dir: str, assets_dir: str | None = None) -> None:
+    """
+    Write all artifacts derived from registry to output_dir, replacing anything that was there before.
+
+    If assets_dir is given, the assets referenced by the registry (see assets.mirror_icons) are copied from it.
+
+    The artifacts are written to a temporary directory first so that output_dir never contains a mix of artifacts
+    from different runs.
+    """
+    tmp_dir = f"{output_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    manifest = {}
+    nodes = {}
+    _write(tmp_dir, "node_registry.json", _encode(registry), manifest)
+    _write(tmp_dir, "node_registry.geojson", _encode(geojson(registry)), manifest)
+    for name, data in registry.items():
+        if not SHARD_NAME_PATTERN.fullmatch(name):
+            sys.stderr.write(f"not writing a shard for Node named {name}: invalid name\n")
+            continue
+        path = f"nodes/{name}.json"
+        _write(tmp_dir, path, _encode(data), manifest)
+        nodes[name] = {
+            "href": path,
+            "sha256": manifest[path]["sha256"],
+            "status": data.get("status"),
+            "last_updated": data.get("last_updated"),
+        }
+    if assets_dir is not None:
+        _copy_assets(registry, assets_dir, tmp_dir, manifest)
+    with open(os.path.join(tmp_dir, "index.json"), "wb") as f:
+        f.write(_encode({"nodes": nodes, "artifacts": manifest}))
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.replace(tmp_dir, output_dir)
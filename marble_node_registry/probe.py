@@ -0,0 +1,120 @@
+# Health checks of the services advertised by each node.
+#
+# A node is online if its services and version endpoints respond, but the services
+# that it advertises (geoserver, weaver, jupyterhub, ...) may still be down. Probing
+# sends a single request to the "service" link of every service and records whether
+# the service responded and how long it took in the service's "health" value.
+#
+# Probes are run concurrently with the same per-host limits as node requests (see
+# fetch.ConnectionLimiter). Each url is only probed once even if it is advertised by
+# several services, and probes are not retried and use a short timeout so that a dead
+# service cannot hold up the update.
+
+import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Iterable
+
+import requests
+
+from fetch import MAX_CONNECTIONS, MAX_CONNECTIONS_PER_HOST, ConnectionLimiter, create_session
+
+PROBE_TIMEOUT = 5
+
+
+@dataclass(frozen=True)
+class ProbeResult:
+    """
+    The outcome of probing a url.
+
+    A service is reachable if it returned any response that is not a server error (authentication errors mean that the
+    service is up). latency is the number of seconds until the response headers were received.
+    """
+
+    reachable: bool
+    status_code: int | None = None
+    latency: float | None = None
+
+    def health(self, checked: str) -> dict:
+        """
+        Return the value stored in a service's "health" for this result.
+        """
+        return {
+            "reachable": self.reachable,
+            "status_code": self.status_code,
+            "latency": None if self.latency is None else round(self.latency, 3),
+            "checked": checked,
+        }
+
+
+def service_url(service: dict) -> str | None:
+    """
+    Return the url of the first "service" link of a service.
+    """
+    for link in service.get("links", []):
+        if link.get("rel") == "service":
+            return link.get("href")
+    return None
+
+
+def probe_url(
+    url: str, limiter: ConnectionLimiter, session: requests.Session, timeout: float = PROBE_TIMEOUT
+) -> ProbeResult:
+    """
+    Send a GET request to url and return whether it responded. The response body is not read.
+    """
+    with limiter.limit(url):
+        start = time.perf_counter()
+        try:
+            response = session.get(url, timeout=timeout, stream=True)
+        except requests.exceptions.RequestException:
+            return ProbeResult(reachable=False)
+        latency = time.perf_counter() - start
+        response.close()
+    return ProbeResult(response.status_code < 500, response.status_code, latency)
+
+
+def probe_urls(
+    urls: Iterable[str],
+    max_connections: int = MAX_CONNECTIONS,
+    max_per_host: int = MAX_CONNECTIONS_PER_HOST,
+    session: requests.Session | None = None,
+    timeout: float = PROBE_TIMEOUT,
+) -> dict[str, ProbeResult]:
+    """
+    Probe every distinct url concurrently and return the result for each url.
+    """
+    urls = list(dict.fromkeys(urls))
+    if not urls:
+        return {}
+    # probes are not retried, a service that does not respond quickly is reported as unreachable
+    session = create_session(max_connections, retries=0) if session is None else session
+    limiter = ConnectionLimiter(max_connections, max_per_host)
+    with ThreadPoolExecutor(max_workers=max_connections) as executor:
+        futures = [limiter.submit(executor, url, probe_url, url, limiter, session, timeout) for url in urls]
+        return {url: future.result() for url, future in zip(urls, futures)}
+
+
+def probe_services(
+    registry: dict,
+    names: Iterable[str],
+    max_connections: int = MAX_CONNECTIONS,
+    max_per_host: int = MAX_CONNECTIONS_PER_HOST,
+    session: requests.Session | None = None,
+    timeout: float = PROBE_TIMEOUT,
+) -> dict[str, ProbeResult]:
+    """
+    Probe the services of the named nodes in the registry and set the "health" of each service in place.
+
+    Return the result for each url that was probed.
+    """
+    services = [service for name in names for service in registry[name].get("services", [])]
+    results = probe_urls(
+        (url for service in services if (url := service_url(service))), max_connections, max_per_host, session, timeout
+    )
+    checked = datetime.datetime.now(tz=datetime.timezone.utc).isoformat()
+    for service in services:
+        if (url := service_url(service)) in results:
+            service["health"] = results[url].health(checked)
+    return results
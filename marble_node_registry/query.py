@@ -0,0 +1,167 @@
+# In-memory indexes for answering queries about the nodes in the registry.
+#
+# The registry is loaded once and indexed by service type, service keyword, node status
+# and registration status. Node locations are indexed on a grid of GRID_CELL_DEGREES
+# so that only the nodes close to a point need to be checked when searching by distance.
+#
+# Example:
+#
+#   index = RegistryIndex.from_file("node_registry.json")
+#   index.query(types=["ogcapi_processes"], status="online", near=(45.5, -73.57, 500))
+
+import json
+import math
+from collections import defaultdict
+from typing import Iterable
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+GRID_CELL_DEGREES = 1.0
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """
+    Return the great-circle distance between two points in kilometres.
+    """
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _as_set(value: str | Iterable[str]) -> set[str]:
+    return {value} if isinstance(value, str) else set(value)
+
+
+class RegistryIndex:
+    """
+    Inverted and spatial indexes over the nodes of a registry.
+
+    Results are always returned as a list of node names in registry order.
+    """
+
+    def __init__(self, registry: dict) -> None:
+        self.registry = registry
+        self._order = {name: i for i, name in enumerate(registry)}
+        self.by_type: dict[str, set[str]] = defaultdict(set)
+        self.by_keyword: dict[str, set[str]] = defaultdict(set)
+        self.by_status: dict[str, set[str]] = defaultdict(set)
+        self.by_registration_status: dict[str, set[str]] = defaultdict(set)
+        self._locations: dict[str, tuple[float, float]] = {}
+        self._grid: dict[tuple[int, int], list[str]] = defaultdict(list)
+        for name, data in registry.items():
+            for service in data.get("services", []):
+                for type_ in service.get("types", []):
+                    self.by_type[type_].add(name)
+                for keyword in service.get("keywords", []):
+                    self.by_keyword[keyword].add(name)
+            if "status" in data:
+                self.by_status[data["status"]].add(name)
+            if "registration_status" in data:
+                self.by_registration_status[data["registration_status"]].add(name)
+            if location := data.get("location"):
+                lat, lon = location["latitude"], location["longitude"]
+                self._locations[name] = (lat, lon)
+                self._grid[self._cell(lat, lon)].append(name)
+
+    @classmethod
+    def from_file(cls, path: str) -> "RegistryIndex":
+        """
+        Return an index of the registry stored in the json file at path.
+        """
+        with open(path) as f:
+            return cls(json.load(f))
+
+    @staticmethod
+    def _cell(lat: float, lon: float) -> tuple[int, int]:
+        # longitude 180 is the same meridian as -180, cells are in [-180, 180) like the candidate cells
+        if lon >= 180:
+            lon -= 360
+        return math.floor(lat / GRID_CELL_DEGREES), math.floor(lon / GRID_CELL_DEGREES)
+
+    def _candidate_cells(self, lat: float, lon: float, radius_km: float) -> Iterable[tuple[int, int]]:
+        """
+        Return the grid cells that may contain points within radius_km of (lat, lon).
+        """
+        lat_span = radius_km / KM_PER_DEGREE
+        min_lat, max_lat = lat - lat_span, lat + lat_span
+        # the span in longitude is widest at the latitude furthest from the equator
+        widest = max(abs(min_lat), abs(max_lat))
+        if widest >= 90 or lat_span >= 90:
+            return list(self._grid)
+        lon_span = lat_span / math.cos(math.radians(widest))
+        if lon_span >= 180:
+            lon_cells = range(math.floor(-180 / GRID_CELL_DEGREES), math.ceil(180 / GRID_CELL_DEGREES) + 1)
+        else:
+            # the range may extend past the antimeridian, the cells are wrapped below
+            lon_cells = range(
+                math.floor((lon - lon_span) / GRID_CELL_DEGREES), math.floor((lon + lon_span) / GRID_CELL_DEGREES) + 1
+            )
+        lat_cells = range(self._cell(min_lat, 0)[0], self._cell(max_lat, 0)[0] + 1)
+        if len(lat_cells) * len(lon_cells) > len(self._grid):
+            return list(self._grid)
+        cells_per_turn = round(360 / GRID_CELL_DEGREES)
+        half_turn = round(180 / GRID_CELL_DEGREES)
+        # wrap longitudes across the antimeridian so that cells are in [-180, 180)
+        return {
+            (lat_cell, (lon_cell + half_turn) % cells_per_turn - half_turn)
+            for lat_cell in lat_cells
+            for lon_cell in lon_cells
+        }
+
+    def near(self, lat: float, lon: float, radius_km: float) -> set[str]:
+        """
+        Return the names of the nodes located within radius_km of (lat, lon).
+        """
+        found = set()
+        for cell in self._candidate_cells(lat, lon, radius_km):
+            for name in self._grid.get(cell, ()):
+                if haversine_km(lat, lon, *self._locations[name]) <= radius_km:
+                    found.add(name)
+        return found
+
+    def distance_km(self, name: str, lat: float, lon: float) -> float | None:
+        """
+        Return the distance between the node and (lat, lon) or None if the node has no location.
+        """
+        if name not in self._locations:
+            return None
+        return haversine_km(lat, lon, *self._locations[name])
+
+    def query(
+        self,
+        types: Iterable[str] | None = None,
+        keywords: Iterable[str] | None = None,
+        status: str | Iterable[str] | None = None,
+        registration_status: str | Iterable[str] | None = None,
+        near: tuple[float, float, float] | None = None,
+    ) -> list[str]:
+        """
+        Return the names of the nodes that match all the given filters.
+
+        - types: nodes offering a service of each of these types
+        - keywords: nodes offering a service with each of these keywords
+        - status: nodes with (any of) this status
+        - registration_status: nodes with (any of) this registration status
+        - near: a (latitude, longitude, radius in km) tuple, nodes located within that radius of the point
+        """
+        matches: set[str] | None = None
+
+        def _restrict(names: set[str]) -> None:
+            nonlocal matches
+            matches = set(names) if matches is None else matches & names
+
+        for type_ in types or ():
+            _restrict(self.by_type.get(type_, set()))
+        for keyword in keywords or ():
+            _restrict(self.by_keyword.get(keyword, set()))
+        if status is not None:
+            _restrict(set().union(*(self.by_status.get(s, set()) for s in _as_set(status))))
+        if registration_status is not None:
+            _restrict(
+                set().union(*(self.by_registration_status.get(s, set()) for s in _as_set(registration_status)))
+            )
+        if near is not None and (matches is None or matches):
+            _restrict(self.near(*near))
+        if matches is None:
+            return list(self.registry)
+        return sorted(matches, key=self._order.__getitem__)
@@ -0,0 +1,131 @@
+# Instrumentation of a run of the update script.
+#
+# A RunReport records how long each phase of the update took for every node:
+#
+#   services.wait, version.wait          waiting for a connection slot
+#   services.ttfb, version.ttfb          connecting and waiting for the response headers
+#   services.download, version.download  receiving the response body
+#   decode                               decoding the json responses
+#   migrate                              applying migrations
+#   validate                             validating the node against the schema
+#
+# and how long the phases that apply to the whole registry took (final validation,
+# writing the outputs). The report can be written as json or in the Prometheus
+# textfile collector format (https://github.com/prometheus/node_exporter#textfile-collector).
+
+import datetime
+import json
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+from cache import atomic_write
+
+METRIC_PREFIX = "marble_registry_update"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class RunReport:
+    """
+    Timings and outcomes collected during a single run of the update script.
+    """
+
+    def __init__(self) -> None:
+        self.started = datetime.datetime.now(tz=datetime.timezone.utc)
+        self._start = time.perf_counter()
+        self.duration: float | None = None
+        self.phases: dict[str, float] = defaultdict(float)
+        self.nodes: dict[str, dict[str, Any]] = defaultdict(lambda: {"phases": defaultdict(float)})
+        self.extra: dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def record(self, phase: str, seconds: float, node: str | None = None) -> None:
+        """
+        Add seconds to the time spent in phase for node (or for the whole run if node is None).
+        """
+        with self._lock:
+            if node is None:
+                self.phases[phase] += seconds
+            else:
+                self.nodes[node]["phases"][phase] += seconds
+
+    @contextmanager
+    def phase(self, phase: str, node: str | None = None) -> Iterator[None]:
+        """
+        Record the time spent in the body of the with statement (see record).
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, time.perf_counter() - start, node)
+
+    def set_outcome(self, node: str, status: str | None, **details: Any) -> None:
+        """
+        Record the status of the node at the end of the run and any other details about how it was updated.
+        """
+        with self._lock:
+            self.nodes[node].update({"status": status, **details})
+
+    def finish(self) -> None:
+        self.duration = time.perf_counter() - self._start
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "started": self.started.isoformat(),
+                "duration": self.duration,
+                "phases": dict(self.phases),
+                "nodes": {name: {**node, "phases": dict(node["phases"])} for name, node in self.nodes.items()},
+                **self.extra,
+            }
+
+    def write_json(self, path: str) -> None:
+        atomic_write(path, json.dumps(self.to_dict(), indent=2).encode())
+
+    def prometheus(self) -> str:
+        """
+        Return the report in the Prometheus text exposition format.
+        """
+        report = self.to_dict()
+        lines = [
+            f"# HELP {METRIC_PREFIX}_timestamp_seconds Time at which the last update started.",
+            f"# TYPE {METRIC_PREFIX}_timestamp_seconds gauge",
+            f"{METRIC_PREFIX}_timestamp_seconds {self.started.timestamp()}",
+            f"# HELP {METRIC_PREFIX}_duration_seconds Duration of the last update.",
+            f"# TYPE {METRIC_PREFIX}_duration_seconds gauge",
+            f"{METRIC_PREFIX}_duration_seconds {report['duration'] or 0}",
+            f"# HELP {METRIC_PREFIX}_phase_seconds Time spent in each phase of the last update (summed over nodes).",
+            f"# TYPE {METRIC_PREFIX}_phase_seconds gauge",
+        ]
+        totals = Counter(report["phases"])
+        for node in report["nodes"].values():
+            totals.update(node["phases"])
+        for phase, seconds in sorted(totals.items()):
+            lines.append(f'{METRIC_PREFIX}_phase_seconds{{phase="{_escape(phase)}"}} {seconds}')
+        lines += [
+            f"# HELP {METRIC_PREFIX}_node_phase_seconds Time spent in each phase of the last update for each node.",
+            f"# TYPE {METRIC_PREFIX}_node_phase_seconds gauge",
+        ]
+        for name, node in report["nodes"].items():
+            for phase, seconds in sorted(node["phases"].items()):
+                lines.append(
+                    f'{METRIC_PREFIX}_node_phase_seconds{{node="{_escape(name)}",phase="{_escape(phase)}"}} {seconds}'
+                )
+        lines += [
+            f"# HELP {METRIC_PREFIX}_nodes Number of nodes with each status after the last update.",
+            f"# TYPE {METRIC_PREFIX}_nodes gauge",
+        ]
+        statuses = Counter(str(node.get("status")) for node in report["nodes"].values())
+        for status, count in sorted(statuses.items()):
+            lines.append(f'{METRIC_PREFIX}_nodes{{status="{_escape(status)}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str) -> None:
+        # written atomically since the textfile collector may read the file at any time
+        atomic_write(path, self.prometheus().encode())
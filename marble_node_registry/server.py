@@ -0,0 +1,230 @@
+# A read-only HTTP server for the registry written by the update script.
+#
+# Routes:
+#
+#   /  or  /node_registry.json   the whole registry
+#   /nodes/<name>                the data for a single node
+#   /types/<type>                the nodes that offer a service of the given type
+#   /status/<status>             the nodes with the given status
+#
+# Every response has a strong ETag and conditional requests (If-None-Match) are answered
+# with 304 Not Modified. Response bodies are encoded and compressed once per version
+# of the registry and served gzip or brotli (if the optional brotli package is
+# installed) compressed when the client accepts it. The registry file is reloaded when
+# it changes on disk.
+#
+# Run with:
+#
+#   python server.py --registry ../node_registry.json --port 8000
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+
+from query import RegistryIndex
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+THIS_DIR = os.path.dirname(__file__)
+ROOT_DIR = os.path.dirname(THIS_DIR)
+CURRENT_REGISTRY = os.path.join(ROOT_DIR, "node_registry.json")
+# Minimum number of seconds between checks for changes to the registry file
+RELOAD_INTERVAL = 1.0
+CACHE_CONTROL = "public, max-age=60"
+
+
+@dataclass(frozen=True)
+class Representation:
+    """
+    An encoded response body, its compressed variants and its ETag.
+    """
+
+    body: bytes
+    etag: str
+    encoded: dict[str, bytes]
+
+    @classmethod
+    def from_content(cls, content: dict) -> "Representation":
+        body = json.dumps(content).encode()
+        encoded = {"gzip": gzip.compress(body, mtime=0)}
+        if brotli is not None:
+            encoded["br"] = brotli.compress(body)
+        return cls(body, f'"{hashlib.sha256(body).hexdigest()[:32]}"', encoded)
+
+    def select(self, accept_encoding: str) -> tuple[str | None, bytes, str]:
+        """
+        Return the content-encoding, body and ETag to use given the value of an Accept-Encoding header.
+
+        Each encoding of the body has its own ETag since they are not byte-for-byte identical.
+        """
+        accepted = set()
+        for item in accept_encoding.split(","):
+            coding, _, params = item.strip().partition(";")
+            q = params.strip().removeprefix("q=") if params.strip().startswith("q=") else "1"
+            try:
+                if float(q) > 0:
+                    accepted.add(coding.strip().lower())
+            except ValueError:
+                continue
+        for coding in ("br", "gzip"):
+            if coding in self.encoded and (coding in accepted or "*" in accepted):
+                return coding, self.encoded[coding], f'{self.etag[:-1]}-{coding}"'
+        return None, self.body, self.etag
+
+
+class RegistryStore:
+    """
+    Hold the current version of the registry and the representations built from it.
+
+    The registry file is reloaded when its modification time or size changes.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._stat = None
+        self._checked = 0.0
+        self._representations: dict[tuple[str, ...], Representation] = {}
+        self.index = RegistryIndex({})
+        self._reload()
+
+    def _reload(self) -> None:
+        stat = os.stat(self.path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        if key == self._stat:
+            return
+        self.index = RegistryIndex.from_file(self.path)
+        self._representations = {}
+        self._stat = key
+
+    def _maybe_reload(self) -> None:
+        now = time.monotonic()
+        if now - self._checked < RELOAD_INTERVAL:
+            return
+        self._checked = now
+        try:
+            self._reload()
+        except (OSError, json.JSONDecodeError):
+            # keep serving the previous version if the file is missing or is being rewritten
+            pass
+
+    def _resource(self, path: str) -> tuple[str, ...] | None:
+        """
+        Return the key of the resource at path or None if there is no such resource.
+
+        Every path of the same resource has the same key and views of a type or status that no node has share the key
+        of an empty view, so the number of keys is bounded by the size of the registry whatever paths are requested.
+        """
+        parts = [unquote(part) for part in path.strip("/").split("/") if part]
+        if parts in ([], ["node_registry.json"]):
+            return ("registry",)
+        if len(parts) != 2:
+            return None
+        view, value = parts
+        if view == "nodes":
+            return (view, value) if value in self.index.registry else None
+        if view == "types":
+            return (view, value) if value in self.index.by_type else ("empty",)
+        if view == "status":
+            return (view, value) if value in self.index.by_status else ("empty",)
+        return None
+
+    def _content(self, key: tuple[str, ...]) -> dict:
+        registry = self.index.registry
+        view, *value = key
+        if view == "registry":
+            return registry
+        if view == "nodes":
+            return registry[value[0]]
+        if view == "types":
+            return {name: registry[name] for name in self.index.query(types=value)}
+        if view == "status":
+            return {name: registry[name] for name in self.index.query(status=value[0])}
+        return {}
+
+    def get(self, path: str) -> Representation | None:
+        """
+        Return the representation of the resource at path or None if there is no such resource.
+        """
+        with self._lock:
+            self._maybe_reload()
+            key = self._resource(path)
+            if key is None:
+                return None
+            if key not in self._representations:
+                self._representations[key] = Representation.from_content(self._content(key))
+            return self._representations[key]
+
+
+class RegistryRequestHandler(BaseHTTPRequestHandler):
+    store: RegistryStore
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, include_body: bool) -> None:
+        representation = self.store.get(urlparse(self.path).path)
+        if representation is None:
+            body = json.dumps({"error": "not found"}).encode()
+            self.send_response(HTTPStatus.NOT_FOUND)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if include_body:
+                self.wfile.write(body)
+            return
+        encoding, body, etag = representation.select(self.headers.get("Accept-Encoding", ""))
+        if_none_match = self.headers.get("If-None-Match", "")
+        not_modified = if_none_match.strip() == "*" or etag in (tag.strip() for tag in if_none_match.split(","))
+        self.send_response(HTTPStatus.NOT_MODIFIED if not_modified else HTTPStatus.OK)
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", CACHE_CONTROL)
+        self.send_header("Vary", "Accept-Encoding")
+        if not_modified:
+            self.end_headers()
+            return
+        self.send_header("Content-Type", "application/json")
+        if encoding is not None:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if include_body:
+            self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        self._send(include_body=True)
+
+    def do_HEAD(self) -> None:
+        self._send(include_body=False)
+
+    def log_request(self, code: int | str = "-", size: int | str = "-") -> None:
+        # only errors are logged, logging every request is too slow for a busy server
+        pass
+
+
+def create_server(registry_path: str, host: str = "127.0.0.1", port: int = 8000) -> ThreadingHTTPServer:
+    """
+    Return a server (not yet started) that serves the registry found at registry_path.
+    """
+    handler = type("Handler", (RegistryRequestHandler,), {"store": RegistryStore(registry_path)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the node registry over HTTP.")
+    parser.add_argument("--registry", default=CURRENT_REGISTRY, help="path to the registry file to serve")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    create_server(args.registry, args.host, args.port).serve_forever()
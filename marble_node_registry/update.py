@@ -1,17 +1,71 @@
+import argparse
+import cProfile
+import hashlib
 import json
 import os
 import sys
 import jsonschema
 import requests
 import datetime
+import tracemalloc
 from copy import deepcopy
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Iterable, Mapping
 
-from migrations import MIGRATIONS
+from assets import AssetStore, mirror_icons
+from cache import JsonStore, ResponseCache, ServiceMemo, atomic_write
+from delta import compute_delta
+from fetch import (
+    MAX_CONNECTIONS,
+    MAX_CONNECTIONS_PER_HOST,
+    MAX_RESPONSE_BYTES,
+    NODE_DEADLINE,
+    READ_DEADLINE,
+    RETRIES,
+    RETRY_BACKOFF_FACTOR,
+    SWEEP_DEADLINE,
+    CircuitBreaker,
+    ResponseTooLarge,
+    SweepDeadlineExceeded,
+    create_session,
+    fetch_nodes,
+)
+from history import HISTORY_DB, HistoryStore, Observation, parse_duration
+from migrations import apply_migrations, declared_schema_version, fingerprint, needs_node_migrations
+from outputs import write_artifacts
+from probe import probe_services
+from report import RunReport
+from validation import SCHEMA_CACHE_DIR, RegistryValidator
 
 THIS_DIR = os.path.dirname(__file__)
 ROOT_DIR = os.path.dirname(THIS_DIR)
 SCHEMA_FILE = os.path.join(ROOT_DIR, "node_registry.schema.json")
 CURRENT_REGISTRY = os.path.join(ROOT_DIR, "node_registry.json")
+DELTA_FILE = os.path.join(ROOT_DIR, "node_registry.delta.json")
+ARTIFACTS_DIR = os.path.join(ROOT_DIR, "artifacts")
+CACHE_DIR = os.environ.get("MARBLE_NODE_REGISTRY_CACHE_DIR", os.path.join(ROOT_DIR, ".cache"))
+
+
+@dataclass(frozen=True, slots=True)
+class NodeOutcome:
+    """
+    The result of an attempt to update a node.
+
+    data is the node's new data if the node was updated or None if its previous data is kept and only its status
+    changes. latency is the number of seconds that the node took to respond or None if it did not respond.
+    """
+
+    status: str
+    data: Mapping[str, Any] | None = None
+    latency: float | None = None
+    not_modified: bool = False
+
+    def apply(self, previous: Mapping[str, Any]) -> dict:
+        """
+        Return the node's data after this outcome, previous is not modified.
+        """
+        return {**(previous if self.data is None else self.data), "status": self.status}
 
 
 def _load_schema() -> dict:
@@ -35,83 +89,468 @@ def _load_registry() -> dict:
 def _write_registry(registry: dict) -> None:
     """
     Write the registry as a json string to the 'node_registry.json' file.
+
+    The file is replaced atomically so that readers (see server.py) never see a partially written registry.
+    """
+    atomic_write(CURRENT_REGISTRY, json.dumps(registry, indent=2).encode())
+
+
+def _write_artifacts(registry: dict) -> None:
+    """
+    Write the artifacts derived from the registry, including the mirrored icons, to the 'artifacts' directory (see
+    outputs.write_artifacts).
+    """
+    write_artifacts(registry, ARTIFACTS_DIR, os.path.join(CACHE_DIR, "assets"))
+
+
+def _load_previous_registry(path: str) -> dict:
+    """
+    Load a previously published version of the registry from path and return it as a dictionary.
+    """
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_delta(delta: list[dict]) -> None:
+    """
+    Write the changes made to the registry during this run to the 'node_registry.delta.json' file.
+    """
+    atomic_write(DELTA_FILE, json.dumps({"generated": _now(), "changes": delta}, indent=2).encode())
+
+
+def _remove_delta() -> None:
+    """
+    Remove the 'node_registry.delta.json' file written by a previous run so that it is not mistaken for the changes
+    made during this run.
+    """
+    try:
+        os.remove(DELTA_FILE)
+    except FileNotFoundError:
+        pass
+
+
+def _write_history(observations: list[Observation]) -> None:
+    """
+    Append the state of each node at the end of this run to the 'node_history.sqlite' database (see history.py).
     """
-    with open(CURRENT_REGISTRY, "w") as f:
-        json.dump(registry, f, indent=2)
+    with HistoryStore(HISTORY_DB) as store:
+        store.append(observations)
+
+
+def _now() -> str:
+    return datetime.datetime.now(tz=datetime.timezone.utc).isoformat()
+
 
+def _is_stale(data: dict, stale_after: datetime.timedelta) -> bool:
+    try:
+        last_updated = datetime.datetime.fromisoformat(data["last_updated"])
+    except (KeyError, TypeError, ValueError):
+        return True
+    return datetime.datetime.now(tz=datetime.timezone.utc) - last_updated >= stale_after
 
-def update_registry() -> None:
+
+def _select_nodes(
+    registry: dict,
+    nodes: Iterable[str] | None = None,
+    stale_after: datetime.timedelta | None = None,
+    statuses: Iterable[str] | None = None,
+) -> list[str]:
+    """
+    Return the names of the nodes in the registry that match all of the given criteria.
+
+    Raise a ValueError if nodes contains a name that is not in the registry.
+    """
+    if nodes is not None:
+        nodes = set(nodes)
+        if unknown := nodes - registry.keys():
+            raise ValueError(f"unknown nodes: {', '.join(sorted(unknown))}")
+    statuses = None if statuses is None else set(statuses)
+    return [
+        name
+        for name, data in registry.items()
+        if (nodes is None or name in nodes)
+        and (statuses is None or data.get("status") in statuses)
+        and (stale_after is None or _is_stale(data, stale_after))
+    ]
+
+
+def update_registry(
+    max_connections: int = MAX_CONNECTIONS,
+    max_connections_per_host: int = MAX_CONNECTIONS_PER_HOST,
+    retries: int = RETRIES,
+    retry_backoff_factor: float = RETRY_BACKOFF_FACTOR,
+    max_response_bytes: int = MAX_RESPONSE_BYTES,
+    read_deadline: float = READ_DEADLINE,
+    previous_registry: str | None = None,
+    report: RunReport | None = None,
+    probe: bool = False,
+    mirror_assets: bool = False,
+    nodes: Iterable[str] | None = None,
+    stale_after: datetime.timedelta | None = None,
+    statuses: Iterable[str] | None = None,
+    node_deadline: float | None = NODE_DEADLINE,
+    sweep_deadline: float | None = SWEEP_DEADLINE,
+    respect_breaker: bool = False,
+) -> RunReport:
     """
     Update the 'node_registry.json' file with new data returned by each node.
 
+    Only the nodes named in nodes, that were last updated at least stale_after ago and whose status is one of statuses
+    are updated (all nodes are updated if none of these are given). The data of the other nodes is left unchanged.
+
+    Nodes are queried concurrently (see fetch.fetch_nodes) but results are applied in registry order.
     If the node is unresponsive, set the status field accordingly.
+
+    Fetching a node takes at most node_deadline seconds and fetching all nodes takes at most sweep_deadline seconds
+    (see fetch.fetch_nodes). Nodes that are not fetched in time are marked as unresponsive and the rest of their
+    data is left unchanged. Only nodes that exceed their own deadline count as failures for the circuit breaker.
+
+    Responses from nodes are cached in CACHE_DIR. If neither endpoint of a node changed since the last time that the
+    node was successfully updated, the data from that update is reused without being migrated or validated again.
+    Likewise, services that are identical to a service that was already migrated and validated (for any node) are
+    not migrated or validated again.
+
+    Nodes that could not be reached for several runs in a row are only polled occasionally (see fetch.CircuitBreaker),
+    in the meantime their data is left unchanged. Nodes that are named explicitly in nodes are always polled unless
+    respect_breaker is True (ex: when nodes are named by a scheduler rather than by a person, see daemon.py).
+
+    The changes made during this run are written to 'node_registry.delta.json' (see delta.compute_delta). They are
+    computed relative to the registry found at previous_registry or, if it is not given, to the registry as it was
+    before this run. The file is not written if nothing changed.
+
+    Per-node shards, a GeoJSON view and compressed variants of the registry are written to the 'artifacts' directory.
+
+    If probe is True, the "service" link of every service of the nodes that are online is requested (see
+    probe.probe_services) and the outcome is stored in the "health" value of each service.
+
+    If mirror_assets is True, the icons of the nodes that are online are downloaded to CACHE_DIR and the path of the
+    mirrored icon is stored in the "mirror_href" of each icon link (see assets.mirror_icons).
+
+    The status, version, number of services and latency of each updated node are appended to the history database.
+
+    Return a report of the time spent in each phase of the update for each node (see report.RunReport).
     """
+    report = RunReport() if report is None else report
     registry = _load_registry()
+    previous = _load_previous_registry(previous_registry) if previous_registry else registry
     schema = _load_schema()
+    validator = RegistryValidator(
+        schema, schema_cache_dir=SCHEMA_CACHE_DIR, compiled_cache_dir=os.path.join(CACHE_DIR, "validators")
+    )
+    response_cache = ResponseCache(os.path.join(CACHE_DIR, "responses"))
+    validated_nodes = JsonStore(os.path.join(CACHE_DIR, "nodes"))
+    # results of migrating and validating are only reused while the schemas, the generated validators and the
+    # migrations are unchanged
+    validation_fingerprint = f"{validator.fingerprint}\n{fingerprint()}"
+    service_memo = ServiceMemo(os.path.join(CACHE_DIR, "services"), validation_fingerprint)
+    breaker = CircuitBreaker(os.path.join(CACHE_DIR, "circuit_breaker.json"))
+    session = create_session(max_connections, retries, retry_backoff_factor)
+    outcomes: dict[str, NodeOutcome] = {}
 
-    for name, data in registry.items():
-        org_data = deepcopy(data)
-        # set services and version
-        services_url = None
-        version_url = None
-        for link in data["links"]:
-            if link["rel"] == "collection":
-                services_url = link["href"]
-            elif link["rel"] == "version":
-                version_url = link["href"]
+    selected = _select_nodes(registry, nodes, stale_after, statuses)
+    polled = {}
+    for name in selected:
+        data = registry[name]
+        if (nodes is not None and not respect_breaker) or breaker.allow(name):
+            polled[name] = data
+        else:
+            print(f"skipping Node named {name} which has failed repeatedly, it will be polled again later")
+    timeouts = {name: breaker.timeout(name) for name in polled}
+
+    for name, data, fetched in fetch_nodes(
+        polled,
+        max_connections,
+        max_connections_per_host,
+        response_cache,
+        session,
+        timeouts,
+        max_response_bytes,
+        read_deadline,
+        node_deadline,
+        sweep_deadline,
+    ):
         try:
-            # This assumes the json is initially valid according to the schema
-            services_response = requests.get(services_url, headers={"Accept": "application/json"}, timeout=10)
-            version_response = requests.get(version_url, headers={"Accept": "application/json"}, timeout=10)
+            services_response, version_response = fetched.result()
         except requests.exceptions.ConnectionError as e:
             # if either url fails, report that the node is offline
-            data["status"] = "offline"
+            outcomes[name] = NodeOutcome("offline")
+            breaker.record_failure(name)
             sys.stderr.write(f"unable to access node named {name}. Error message: {e}\n")
             continue
+        except SweepDeadlineExceeded as e:
+            # the node may simply not have had its turn before the sweep ran out of time
+            outcomes[name] = NodeOutcome("unresponsive")
+            sys.stderr.write(f"node named '{name}' was not updated in time. Error message: {e}\n")
+            continue
         except requests.exceptions.Timeout as e:
-            data["status"] = "unresponsive"
+            outcomes[name] = NodeOutcome("unresponsive")
+            breaker.record_failure(name)
             sys.stderr.write(f"node named '{name}' is unrespsonsive. Error message: {e}\n")
             continue
+        except ResponseTooLarge as e:
+            outcomes[name] = NodeOutcome("invalid_configuration")
+            sys.stderr.write(f"response from node named '{name}' is too large. Error message: {e}\n")
+            continue
+        except requests.exceptions.RequestException as e:
+            # ex: the connection was closed before the whole body was received
+            outcomes[name] = NodeOutcome("unresponsive")
+            breaker.record_failure(name)
+            sys.stderr.write(f"unable to read the response from node named '{name}'. Error message: {e}\n")
+            continue
+        breaker.record_success(name)
+        for endpoint, response in (("services", services_response), ("version", version_response)):
+            for phase, seconds in response.timings.items():
+                report.record(f"{endpoint}.{phase}", seconds, name)
+        latency = max(
+            response.timings.get("ttfb", 0) + response.timings.get("download", 0)
+            for response in (services_response, version_response)
+        )
+
+        validated_key = f"{name}\n{services_response.url}\n{version_response.url}"
+        # the cached responses may be newer than the ones that were last validated successfully (ex: if they failed)
+        content_hashes = [hashlib.sha256(r.content).hexdigest() for r in (services_response, version_response)]
+        if services_response.not_modified and version_response.not_modified:
+            validated = validated_nodes.get(validated_key)
+            if (
+                validated is not None
+                and validated["schema"] == validation_fingerprint
+                and validated.get("content") == content_hashes
+            ):
+                print(f"Node named {name} has not changed since it was last updated")
+                new_data = {**data, "services": validated["services"], "version": validated["version"]}
+                new_data["last_updated"] = _now()
+                outcomes[name] = NodeOutcome("online", MappingProxyType(new_data), latency, not_modified=True)
+                continue
 
         try:
-            data["version"] = version_response.json().get("version", "unknown")
-        except requests.exceptions.JSONDecodeError:
-            data["status"] = "unresponsive"
+            with report.phase("decode", name):
+                version = version_response.json().get("version", "unknown")
+        except json.JSONDecodeError:
+            outcomes[name] = NodeOutcome("unresponsive", latency=latency)
             sys.stderr.write(
                 f"invalid json returned when accessing version for Node named {name}: {version_response.text}\n"
             )
             continue
 
         try:
-            data["services"] = services_response.json().get("services", [])
-        except requests.exceptions.JSONDecodeError:
-            data["status"] = "unresponsive"
+            with report.phase("decode", name):
+                services_payload = services_response.json()
+            services = services_payload.get("services", [])
+        except json.JSONDecodeError:
+            outcomes[name] = NodeOutcome("unresponsive", latency=latency)
             sys.stderr.write(
                 f"invalid json returned when accessing services for Node named {name}: {services_response.text}\n"
             )
             continue
 
+        # the health of a service is only ever set by probing it (see probe.py), never by the node itself
+        for service in services if isinstance(services, list) else ():
+            if isinstance(service, dict):
+                service.pop("health", None)
+
+        # The services and version are decoded from the responses so they are not shared with the registry and can be
+        # migrated in place. Node migrations may modify any part of the node's data so they are given their own copy.
+        declared_version = declared_schema_version(services_payload)
+        base = deepcopy(data) if needs_node_migrations(declared_version) else data
+        candidate = {**base, "version": version, "services": services}
+
+        # services that were already migrated and validated (for any node) are reused, see cache.ServiceMemo
+        # (services that are not a list of objects are left to fail validation)
+        fresh_services = None
+        if (
+            validator.validates_services_independently
+            and not needs_node_migrations(declared_version)
+            and isinstance(services, list)
+            and all(isinstance(service, dict) for service in services)
+        ):
+            service_keys = [service_memo.key(service, declared_version) for service in services]
+            fresh_services = []
+            for i, key in enumerate(service_keys):
+                if (service := service_memo.get(key)) is not None:
+                    services[i] = service
+                else:
+                    fresh_services.append(i)
+
         try:
-            for migration in MIGRATIONS:
-                migration(data)
+            with report.phase("migrate", name):
+                apply_migrations(candidate, declared_version, services=fresh_services)
         except Exception as e:
-            registry[name] = org_data
-            registry[name]["status"] = "invalid_configuration"
+            outcomes[name] = NodeOutcome("invalid_configuration", latency=latency)
             sys.stderr.write(f"unable to apply migrations for Node named {name}: {e}.")
             continue
 
         try:
-            jsonschema.validate(instance=registry, schema=schema)
-        except jsonschema.exceptions.ValidationError as e:
-            registry[name] = {**org_data, "status": "invalid_configuration"}  # do not include services data if it is invalid
+            with report.phase("validate", name):
+                validator.validate_node(name, candidate, services=fresh_services)
+        except (jsonschema.exceptions.ValidationError, jsonschema.exceptions.RefResolutionError) as e:
+            # do not include services data if it is invalid or refers to a schema that cannot be resolved
+            outcomes[name] = NodeOutcome("invalid_configuration", latency=latency)
             sys.stderr.write(f"invalid configuration for Node named {name}: {e}\n")
         else:
             print(f"successfully updated Node named {name}")
-            data["last_updated"] = datetime.datetime.now(tz=datetime.timezone.utc).isoformat()
-            data["status"] = "online"
+            candidate["last_updated"] = _now()
+            outcomes[name] = NodeOutcome("online", MappingProxyType(candidate), latency)
+            validated_nodes.set(
+                validated_key,
+                {
+                    "schema": validation_fingerprint,
+                    "content": content_hashes,
+                    "services": candidate["services"],
+                    "version": candidate["version"],
+                },
+            )
+            for i in fresh_services or ():
+                service_memo.set(service_keys[i], candidate["services"][i])
 
-    _write_registry(registry)
+    # All outcomes are committed at once, the registry that was loaded is not modified
+    original = registry
+    registry = {name: outcomes[name].apply(data) if name in outcomes else dict(data) for name, data in original.items()}
+    updated = {name for name, outcome in outcomes.items() if outcome.data is not None}
+
+    # Nodes are validated individually above, this catches anything that can only be checked for the whole registry
+    with report.phase("final_validation"):
+        registry_errors = list(validator.iter_registry_errors(registry))
+    for error in registry_errors:
+        sys.stderr.write(f"invalid registry: {error.message}\n")
+        if error.path and error.path[0] in updated:
+            name = error.path[0]
+            updated.discard(name)
+            registry[name] = {**original[name], "status": "invalid_configuration"}
+
+    if probe:
+        with report.phase("probe"):
+            probe_services(
+                registry,
+                [name for name in polled if registry[name].get("status") == "online"],
+                max_connections,
+                max_connections_per_host,
+            )
+
+    if mirror_assets:
+        with report.phase("mirror"):
+            failed = mirror_icons(
+                registry,
+                [name for name in polled if registry[name].get("status") == "online"],
+                AssetStore(os.path.join(CACHE_DIR, "assets")),
+                ResponseCache(os.path.join(CACHE_DIR, "asset_responses")),
+                max_connections,
+                max_connections_per_host,
+                session,
+            )
+        for url, error in failed.items():
+            sys.stderr.write(f"unable to mirror icon {url}: {error}\n")
+
+    for name, data in registry.items():
+        report.set_outcome(
+            name, data.get("status"), polled=name in polled, not_modified=name in outcomes and outcomes[name].not_modified
+        )
+
+    with report.phase("write"):
+        breaker.save()
+        _write_registry(registry)
+        _write_artifacts(registry)
+        if delta := compute_delta(previous, registry):
+            _write_delta(delta)
+        else:
+            _remove_delta()
+        _write_history(
+            [
+                Observation(
+                    name,
+                    registry[name].get("status", "unknown"),
+                    registry[name].get("version"),
+                    len(registry[name]["services"]) if "services" in registry[name] else None,
+                    outcomes[name].latency if name in outcomes else None,
+                )
+                for name in selected
+            ]
+        )
+    report.finish()
+    return report
+
+
+def _top_allocations(snapshot: tracemalloc.Snapshot, limit: int = 25) -> list[dict]:
+    return [
+        {"location": str(stat.traceback), "size": stat.size, "count": stat.count}
+        for stat in snapshot.statistics("lineno")[:limit]
+    ]
 
 
 if __name__ == "__main__":
-    update_registry()
+    parser = argparse.ArgumentParser(description="Update the node registry with data returned by each node.")
+    parser.add_argument(
+        "--previous-registry",
+        help="previously published registry used to compute the changes made during this run",
+    )
+    parser.add_argument("--report", help="write a json report of the time spent in each phase to this file")
+    parser.add_argument(
+        "--prometheus", help="write the report in the Prometheus textfile collector format to this file"
+    )
+    parser.add_argument("--profile", help="profile the update with cProfile and write the stats to this file")
+    parser.add_argument(
+        "--tracemalloc", action="store_true", help="include the largest memory allocations in the json report"
+    )
+    parser.add_argument(
+        "--probe-services", action="store_true", help="check that the services advertised by each node respond"
+    )
+    parser.add_argument(
+        "--mirror-icons", action="store_true", help="download the icon of each node to the artifacts directory"
+    )
+    parser.add_argument("nodes", nargs="*", help="only update these nodes (all nodes by default)")
+    parser.add_argument(
+        "--stale-after",
+        type=parse_duration,
+        help="only update nodes that were last updated at least this long ago (ex: '6h', '2d')",
+    )
+    parser.add_argument(
+        "--status",
+        action="append",
+        choices=("online", "offline", "unresponsive", "invalid_configuration"),
+        help="only update nodes with this status (can be repeated)",
+    )
+    parser.add_argument(
+        "--node-deadline",
+        type=float,
+        default=NODE_DEADLINE,
+        help="maximum number of seconds spent fetching each node (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--sweep-deadline",
+        type=float,
+        default=SWEEP_DEADLINE,
+        help="maximum number of seconds spent fetching all nodes (default: %(default)s)",
+    )
+    args = parser.parse_args()
+    if unknown := set(args.nodes) - _load_registry().keys():
+        parser.error(f"unknown nodes: {', '.join(sorted(unknown))}")
+
+    run_report = RunReport()
+    profiler = cProfile.Profile() if args.profile else None
+    if args.tracemalloc:
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+    update_registry(
+        previous_registry=args.previous_registry,
+        report=run_report,
+        probe=args.probe_services,
+        mirror_assets=args.mirror_icons,
+        nodes=args.nodes or None,
+        stale_after=args.stale_after,
+        statuses=args.status,
+        node_deadline=args.node_deadline,
+        sweep_deadline=args.sweep_deadline,
+    )
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+    if args.tracemalloc:
+        run_report.extra["tracemalloc"] = {
+            "peak": tracemalloc.get_traced_memory()[1],
+            "top": _top_allocations(tracemalloc.take_snapshot()),
+        }
+        tracemalloc.stop()
+    if args.report:
+        run_report.write_json(args.report)
+    if args.prometheus:
+        run_report.write_prometheus(args.prometheus)
@@ -0,0 +1,323 @@
+# Validation of the registry against the json schema in 'node_registry.schema.json'.
+#
+# The schema describes the whole registry but each node is described by the single
+# subschema under "patternProperties". Validating a single node against that
+# subschema is much cheaper than validating the whole registry every time a node
+# changes. Errors raised when validating a single node have the same path and
+# schema path as if the whole registry had been validated.
+#
+# Remote schemas referenced by the registry schema are never fetched while validating.
+# A pinned copy of each of them is shipped in the 'schema_store' directory. A more
+# recent copy can be downloaded to a cache directory with refresh_schema_cache and
+# is used instead of the bundled one when that directory is passed to the validator
+# (the update script and the validate command use SCHEMA_CACHE_DIR if it is set).
+#
+# Valid data is recognized by functions generated from the schema (see fastpath.py),
+# jsonschema is only used to find out why data is invalid.
+#
+# Changes proposed to the registry (ex: in a pull request) are checked with:
+#
+#   python validation.py validate --base origin/main
+#
+# which only validates the nodes that were added or modified relative to the base
+# revision and reports every error with a JSON pointer to the invalid value. Results
+# are cached by the content of each node so that a node is only validated once.
+
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+from typing import Any, Callable, Collection, Iterable, Iterator
+
+import jsonschema
+import requests
+from jsonschema.exceptions import RefResolutionError, ValidationError, best_match
+
+from cache import JsonStore
+from fastpath import GENERATOR_VERSION, Defer, load_functions
+
+THIS_DIR = os.path.dirname(__file__)
+ROOT_DIR = os.path.dirname(THIS_DIR)
+SCHEMA_FILE = os.path.join(ROOT_DIR, "node_registry.schema.json")
+CURRENT_REGISTRY = os.path.join(ROOT_DIR, "node_registry.json")
+CACHE_DIR = os.environ.get("MARBLE_NODE_REGISTRY_CACHE_DIR", os.path.join(ROOT_DIR, ".cache"))
+# Keywords that do not constrain the items of an array relative to each other
+_ITEMWISE_KEYWORDS = {"type", "items", "$comment", "description", "title"}
+# Keywords that could constrain the services of a node together with other values of the node
+_COMBINATOR_KEYWORDS = {"allOf", "anyOf", "oneOf", "not", "if", "dependentSchemas", "unevaluatedProperties"}
+SCHEMA_STORE_DIR = os.path.join(THIS_DIR, "schema_store")
+# Directory of refreshed remote schemas that take precedence over the bundled copies (none by default)
+SCHEMA_CACHE_DIR = os.environ.get("MARBLE_NODE_REGISTRY_SCHEMA_CACHE_DIR")
+
+# Remote schemas referenced by 'node_registry.schema.json', directly or through another remote schema, and the file
+# that they are stored in. The draft 2020-12 meta-schemas are shipped with jsonschema.
+REMOTE_SCHEMAS = {
+    "https://json-schema.org/draft/2020-12/links": "links-2020-12.json",
+    "https://json-schema.org/draft/2020-12/hyper-schema": "hyper-schema-2020-12.json",
+    "https://json-schema.org/draft/2020-12/meta/hyper-schema": "meta-hyper-schema-2020-12.json",
+}
+
+
+def load_schema_store(cache_dir: str | None = None) -> dict[str, dict]:
+    """
+    Return a dictionary mapping the uri of each remote schema to its content.
+
+    Schemas found in cache_dir take precedence over the bundled copies.
+    """
+    store = {}
+    for uri, filename in REMOTE_SCHEMAS.items():
+        path = os.path.join(SCHEMA_STORE_DIR, filename)
+        if cache_dir is not None and os.path.isfile(os.path.join(cache_dir, filename)):
+            path = os.path.join(cache_dir, filename)
+        with open(path) as f:
+            store[uri] = json.load(f)
+    return store
+
+
+def refresh_schema_cache(cache_dir: str) -> None:
+    """
+    Download the current version of each remote schema and write it to cache_dir.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    for uri, filename in REMOTE_SCHEMAS.items():
+        response = requests.get(uri, timeout=10)
+        response.raise_for_status()
+        content = response.json()
+        jsonschema.Draft202012Validator.check_schema(content)
+        with open(os.path.join(cache_dir, filename), "w") as f:
+            json.dump(content, f, indent=2)
+
+
+def json_pointer(path: Iterable[str | int]) -> str:
+    """
+    Return the JSON pointer (RFC 6901) to the value at path (ex: the path of a ValidationError).
+    """
+    return "".join(f"/{str(part).replace('~', '~0').replace('/', '~1')}" for part in path)
+
+
+def _offline_handler(uri: str) -> dict:
+    raise RefResolutionError(f"remote schema '{uri}' is not in the schema store, add it to REMOTE_SCHEMAS")
+
+
+def _resolver(schema: dict, store: dict[str, dict]) -> jsonschema.RefResolver:
+    return jsonschema.RefResolver.from_schema(
+        schema, store=store, handlers={"http": _offline_handler, "https": _offline_handler}
+    )
+
+
+class RegistryValidator:
+    """
+    Pre-compiled validators for the whole registry and for individual nodes.
+
+    Create one of these per run and reuse it for every node. Remote references are resolved from the schema store
+    (see load_schema_store) so validation never accesses the network.
+
+    The code generated to recognize valid data is cached in compiled_cache_dir if it is given.
+
+    fingerprint is a hash of everything that the outcome of validating data depends on: the schema, the remote
+    schemas in the store and the version of the code generator (see fastpath.GENERATOR_VERSION).
+    """
+
+    def __init__(
+        self, schema: dict, schema_cache_dir: str | None = None, compiled_cache_dir: str | None = None
+    ) -> None:
+        jsonschema.Draft202012Validator.check_schema(schema)
+        store = load_schema_store(schema_cache_dir)
+        self.fingerprint = hashlib.sha256(
+            json.dumps([schema, store, GENERATOR_VERSION], sort_keys=True).encode()
+        ).hexdigest()
+        self._registry_validator = jsonschema.Draft202012Validator(schema, resolver=_resolver(schema, store))
+        ((self._node_pattern, node_schema),) = schema["patternProperties"].items()
+        # references in the node subschema (ex: "#/$defs/service") are resolved relative to the whole schema
+        self._node_validator = jsonschema.Draft202012Validator(node_schema, resolver=_resolver(schema, store))
+        services_schema = node_schema.get("properties", {}).get("services", {})
+        self._services_validator = jsonschema.Draft202012Validator(services_schema, resolver=_resolver(schema, store))
+        functions = load_functions(
+            schema,
+            store,
+            {"is_valid_registry": schema, "is_valid_node": node_schema, "is_valid_services": services_schema},
+            compiled_cache_dir,
+        )
+        self._is_valid_registry = functions["is_valid_registry"]
+        self._is_valid_node = functions["is_valid_node"]
+        self._is_valid_services = functions["is_valid_services"]
+        # True if the validity of a service does not depend on the other services or on the rest of the node
+        self.validates_services_independently = (
+            isinstance(services_schema, dict)
+            and services_schema.keys() <= _ITEMWISE_KEYWORDS
+            and not node_schema.keys() & _COMBINATOR_KEYWORDS
+        )
+
+    @staticmethod
+    def _fast_path(is_valid: Callable[[Any], bool], data: Any) -> bool:
+        try:
+            return is_valid(data)
+        except Defer:
+            return False
+
+    def validate_node(self, name: str, data: dict, services: Collection[int] | None = None) -> None:
+        """
+        Raise a ValidationError if data is not valid for a node named name.
+
+        The error is the same as the one that jsonschema.validate would raise if the node was validated as part
+        of the whole registry.
+
+        If services is given and validates_services_independently is True, only the services at these indices are
+        validated, the others are assumed to be valid.
+        """
+        checked = data
+        if services is not None and self.validates_services_independently:
+            checked = {**data, "services": [data["services"][i] for i in services]}
+        if self._fast_path(self._is_valid_node, checked):
+            return
+        # errors are found in the whole node so that their path refers to the right service
+        error = best_match(self._node_validator.iter_errors(data))
+        if error is not None:
+            error.path.appendleft(name)
+            error.schema_path.extendleft(reversed(["patternProperties", self._node_pattern]))
+            raise error
+
+    def iter_services_errors(self, services: Any) -> Iterator[ValidationError]:
+        """
+        Yield all validation errors for the services of a node (as returned by the node's services endpoint).
+
+        The path of each error starts with "services" as if the services had been validated as part of a node.
+        """
+        if self._fast_path(self._is_valid_services, services):
+            return
+        for error in self._services_validator.iter_errors(services):
+            error.path.appendleft("services")
+            yield error
+
+    def iter_registry_errors(self, registry: dict) -> Iterator[ValidationError]:
+        """
+        Yield all validation errors for the whole registry.
+        """
+        if self._fast_path(self._is_valid_registry, registry):
+            return
+        yield from self._registry_validator.iter_errors(registry)
+
+    def validate_registry(self, registry: dict) -> None:
+        """
+        Raise a ValidationError if the whole registry is not valid.
+        """
+        error = best_match(self.iter_registry_errors(registry))
+        if error is not None:
+            raise error
+
+
+def changed_nodes(base: dict, proposed: dict) -> list[str]:
+    """
+    Return the names of the nodes in proposed that were added or modified relative to base.
+    """
+    return [name for name, data in proposed.items() if name not in base or base[name] != data]
+
+
+def validate_changes(
+    validator: RegistryValidator,
+    base: dict,
+    proposed: dict,
+    cache: JsonStore | None = None,
+    fingerprint: str = "",
+) -> dict[str, list[dict]]:
+    """
+    Validate the nodes that were added or modified in proposed relative to base.
+
+    Return the errors found for each of these nodes (an empty list if the node is valid). Each error is a dictionary
+    with the JSON pointer to the invalid value in the registry ("pointer") and the error message ("message"). The name
+    of each node is checked as well as its data.
+
+    If cache is given, the errors found for a node are cached by the name and content of the node. fingerprint must
+    change whenever the result of validating a node could change (ex: a hash of the schema).
+    """
+    results = {}
+    for name in changed_nodes(base, proposed):
+        key = json.dumps([fingerprint, name, proposed[name]], sort_keys=True)
+        if cache is not None and (errors := cache.get(key)) is not None:
+            results[name] = errors
+            continue
+        results[name] = [
+            {"pointer": json_pointer(error.path), "message": error.message}
+            for error in sorted(
+                validator.iter_registry_errors({name: proposed[name]}), key=lambda error: list(map(str, error.path))
+            )
+        ]
+        if cache is not None:
+            cache.set(key, results[name])
+    return results
+
+
+def load_revision(revision: str, path: str = CURRENT_REGISTRY) -> dict:
+    """
+    Return the content of the registry file at path as it was at the given git revision or an empty registry if the
+    file did not exist at that revision.
+    """
+    repository = os.path.dirname(os.path.abspath(path))
+    relative_path = subprocess.run(
+        ["git", "-C", repository, "ls-files", "--full-name", "--error-unmatch", os.path.basename(path)],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
+    result = subprocess.run(
+        ["git", "-C", repository, "show", f"{revision}:{relative_path}"], capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        if "does not exist" in result.stderr or "exists on disk, but not in" in result.stderr:
+            return {}
+        raise RuntimeError(f"unable to read {relative_path} at revision {revision}: {result.stderr.strip()}")
+    return json.loads(result.stdout)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Manage the schemas used to validate the node registry.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    refresh_parser = subparsers.add_parser("refresh-schemas", help="download remote schemas to a cache directory")
+    refresh_parser.add_argument(
+        "cache_dir",
+        nargs="?",
+        default=SCHEMA_CACHE_DIR,
+        help="directory to download the schemas to (default: $MARBLE_NODE_REGISTRY_SCHEMA_CACHE_DIR)",
+    )
+    validate_parser = subparsers.add_parser(
+        "validate", help="validate the nodes that were added or modified relative to a base revision"
+    )
+    validate_parser.add_argument("--base", required=True, help="git revision to compare the registry with")
+    validate_parser.add_argument("--registry", default=CURRENT_REGISTRY, help="registry file (default: %(default)s)")
+    validate_parser.add_argument("--schema", default=SCHEMA_FILE, help="schema file (default: %(default)s)")
+    validate_parser.add_argument(
+        "--cache-dir",
+        default=os.path.join(CACHE_DIR, "validation"),
+        help="directory where results are cached (default: %(default)s)",
+    )
+    args = parser.parse_args(argv)
+    if args.command == "refresh-schemas":
+        if args.cache_dir is None:
+            parser.error("the cache directory is required when MARBLE_NODE_REGISTRY_SCHEMA_CACHE_DIR is not set")
+        refresh_schema_cache(args.cache_dir)
+        return 0
+
+    with open(args.schema) as f:
+        schema = json.load(f)
+    with open(args.registry) as f:
+        proposed = json.load(f)
+    base = load_revision(args.base, args.registry)
+    validator = RegistryValidator(
+        schema, schema_cache_dir=SCHEMA_CACHE_DIR, compiled_cache_dir=os.path.join(args.cache_dir, "compiled")
+    )
+    results = validate_changes(
+        validator, base, proposed, JsonStore(os.path.join(args.cache_dir, "nodes")), validator.fingerprint
+    )
+    print(f"validated {len(results)} added or modified nodes, {len(proposed) - len(results)} nodes are unchanged")
+    for name, errors in results.items():
+        if not errors:
+            print(f"Node named {name} is valid")
+        for error in errors:
+            sys.stderr.write(f"invalid Node named {name} at {error['pointer']}: {error['message']}\n")
+    return 1 if any(results.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
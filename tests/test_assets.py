@@ -0,0 +1,199 @@
+import socket
+import threading
+import time
+
+import pytest
+import requests
+
+import assets  # type: ignore
+import cache  # type: ignore
+import fetch  # type: ignore
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 32
+SVG = (
+    b'<svg xmlns="http://www.w3.org/2000/svg" onload="alert(1)">'
+    b'<script>alert(2)</script><a href="javascript:alert(3)"><circle r="1"/></a></svg>'
+)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return assets.AssetStore(str(tmp_path / "assets"))
+
+
+@pytest.fixture
+def response_cache(tmp_path):
+    return cache.ResponseCache(str(tmp_path / "responses"))
+
+
+@pytest.fixture
+def registry():
+    def node(icon):
+        return {"links": [{"rel": "service", "href": "https://node.example.com/"}, {"rel": "icon", "href": icon}]}
+
+    return {
+        "node1": node("https://node1.example.com/logo"),
+        "node2": node("https://shared.example.com/logo.svg"),
+        "node3": node("https://shared.example.com/logo.svg"),
+        "node4": node("https://node4.example.com/logo"),
+    }
+
+
+def _icon(registry, node):
+    return next(link for link in registry[node]["links"] if link["rel"] == "icon")
+
+
+class TestNormalize:
+    def test_raster_format_detected(self):
+        assert assets.normalize(PNG) == (PNG, ".png")
+
+    def test_svg_scripts_removed(self):
+        content, extension = assets.normalize(SVG)
+        assert extension == ".svg"
+        assert b"script" not in content
+        assert b"onload" not in content
+        assert b"javascript" not in content
+        assert b"circle" in content
+
+    @pytest.mark.parametrize(
+        "svg",
+        [
+            b'<a href="java&#x09;script:alert(1)"><circle r="1"/></a>',
+            b'<a xmlns:xlink="http://www.w3.org/1999/xlink" xlink:href="https://example.com"><circle r="1"/></a>',
+            b'<a href="#x"><set attributeName="href" to="javascript:alert(1)"/><circle r="1"/></a>',
+            b'<a href="#x"><animate attributeName="href" values="javascript:alert(1)"/><circle r="1"/></a>',
+            b'<image href="https://example.com/track.png"/><circle r="1"/>',
+            b'<style>circle { fill: url(https://example.com/track) }</style><circle r="1"/>',
+            b'<circle r="1" style="fill: u\\rl(https://example.com/track)"/>',
+            b'<circle r="1" fill="url(https://example.com/track)"/>',
+            b'<foo:script xmlns:foo="http://www.w3.org/1999/xhtml">alert(1)</foo:script><circle r="1"/>',
+        ],
+    )
+    def test_svg_allowlist(self, svg):
+        content, _ = assets.normalize(b'<svg xmlns="http://www.w3.org/2000/svg">' + svg + b"</svg>")
+        for unsafe in (b"script", b"example.com", b"set", b"animate", b"image", b"style"):
+            assert unsafe not in content
+        assert b"<circle" in content
+
+    def test_svg_fragment_references_kept(self):
+        svg = (
+            b'<svg xmlns="http://www.w3.org/2000/svg"><defs><linearGradient id="g"><stop offset="0"/></linearGradient>'
+            b'<circle id="c" r="1"/></defs><use href="#c" fill="url(#g)"/></svg>'
+        )
+        content, _ = assets.normalize(svg)
+        assert b'href="#c"' in content
+        assert b'fill="url(#g)"' in content
+
+    def test_unsupported_format(self):
+        with pytest.raises(assets.InvalidAsset):
+            assets.normalize(b"<html></html>")
+
+    def test_invalid_svg(self):
+        with pytest.raises(assets.InvalidAsset):
+            assets.normalize(b"<svg><g></svg>")
+
+
+def test_stored_by_content_hash(store):
+    filename = store.add(PNG, ".png")
+    assert filename == f"{assets.hashlib.sha256(PNG).hexdigest()}.png"
+    assert filename in store
+
+
+class TestMirrorIcons:
+    @pytest.fixture(autouse=True)
+    def responses(self, requests_mock):
+        requests_mock.get("https://node1.example.com/logo", content=PNG, headers={"ETag": '"1"'})
+        requests_mock.get("https://shared.example.com/logo.svg", content=SVG)
+        requests_mock.get("https://node4.example.com/logo", text="<html>not an image</html>")
+
+    def test_mirror_href_set(self, registry, store, response_cache):
+        failed = assets.mirror_icons(registry, ["node1", "node2", "node3", "node4"], store, response_cache)
+        assert _icon(registry, "node1")["mirror_href"] == f"assets/{store.add(PNG, '.png')}"
+        assert _icon(registry, "node2")["mirror_href"] == _icon(registry, "node3")["mirror_href"]
+        assert "mirror_href" not in _icon(registry, "node4")
+        assert list(failed) == ["https://node4.example.com/logo"]
+
+    def test_shared_urls_downloaded_once(self, registry, store, requests_mock):
+        assets.mirror_icons(registry, ["node2", "node3"], store)
+        assert [request.url for request in requests_mock.request_history] == ["https://shared.example.com/logo.svg"]
+
+    def test_only_named_nodes_mirrored(self, registry, store):
+        assets.mirror_icons(registry, ["node1"], store)
+        assert "mirror_href" not in _icon(registry, "node2")
+
+    def test_size_capped(self, registry, store):
+        failed = assets.mirror_icons(registry, ["node1"], store, max_bytes=8)
+        assert isinstance(failed["https://node1.example.com/logo"], fetch.ResponseTooLarge)
+        assert "mirror_href" not in _icon(registry, "node1")
+
+    def test_conditional_request(self, registry, store, response_cache, requests_mock):
+        assets.mirror_icons(registry, ["node1"], store, response_cache)
+        mirror_href = _icon(registry, "node1")["mirror_href"]
+        requests_mock.get("https://node1.example.com/logo", status_code=304)
+        assets.mirror_icons(registry, ["node1"], store, response_cache)
+        assert requests_mock.last_request.headers["If-None-Match"] == '"1"'
+        assert _icon(registry, "node1")["mirror_href"] == mirror_href
+
+    def test_previous_mirror_kept_on_error(self, registry, store, requests_mock):
+        assets.mirror_icons(registry, ["node1"], store)
+        mirror_href = _icon(registry, "node1")["mirror_href"]
+        requests_mock.get("https://node1.example.com/logo", exc=requests.exceptions.ConnectionError)
+        assets.mirror_icons(registry, ["node1"], store)
+        assert _icon(registry, "node1")["mirror_href"] == mirror_href
+
+    def test_links_not_modified_in_place(self, registry, store):
+        icon = _icon(registry, "node1")
+        assets.mirror_icons(registry, ["node1"], store)
+        assert "mirror_href" not in icon
+        assert "mirror_href" in _icon(registry, "node1")
+
+    def test_missing_mirror_removed(self, registry, store):
+        _icon(registry, "node2")["mirror_href"] = "assets/missing.png"
+        assets.mirror_icons(registry, [], store)
+        assert "mirror_href" not in _icon(registry, "node2")
+
+
+@pytest.fixture
+def silent_server():
+    """Accept connections but never respond"""
+    listener = socket.create_server(("127.0.0.1", 0))
+    connections = []
+    stop = threading.Event()
+
+    def _accept():
+        listener.settimeout(0.05)
+        while not stop.is_set():
+            try:
+                connections.append(listener.accept()[0])
+            except OSError:
+                continue
+
+    thread = threading.Thread(target=_accept, daemon=True)
+    thread.start()
+    yield f"127.0.0.1:{listener.getsockname()[1]}"
+    stop.set()
+    thread.join()
+    for connection in connections:
+        connection.close()
+    listener.close()
+
+
+class TestDeadlines:
+    @pytest.fixture
+    def registry(self, silent_server):
+        return {
+            f"node{i}": {"links": [{"rel": "icon", "href": f"http://{silent_server}/logo{i}"}]} for i in range(4)
+        }
+
+    def test_icon_deadline(self, registry, store):
+        start = time.monotonic()
+        failed = assets.mirror_icons(registry, ["node0"], store, icon_deadline=0.3, deadline=None)
+        assert isinstance(failed[_icon(registry, "node0")["href"]], fetch.NodeDeadlineExceeded)
+        assert time.monotonic() - start < fetch.REQUEST_TIMEOUT / 2
+
+    def test_mirror_deadline(self, registry, store):
+        start = time.monotonic()
+        failed = assets.mirror_icons(registry, list(registry), store, max_per_host=1, icon_deadline=None, deadline=0.3)
+        assert len(failed) == 4
+        assert all(isinstance(error, fetch.SweepDeadlineExceeded) for error in failed.values())
+        assert time.monotonic() - start < fetch.REQUEST_TIMEOUT / 2
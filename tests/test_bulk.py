@@ -0,0 +1,130 @@
+import json
+import os
+import subprocess
+
+import pytest
+
+import bulk  # type: ignore
+from validation import RegistryValidator  # type: ignore
+
+
+def _service(**extra):
+    return {
+        "name": "geoserver",
+        "keywords": ["data", "service-wms"],
+        "description": "GeoServer",
+        "links": [
+            {"rel": "service", "href": "https://node.example.com/geoserver/"},
+            {"rel": "service-doc", "href": "https://docs.geoserver.org/"},
+        ],
+        **extra,
+    }
+
+
+@pytest.fixture
+def schema(request):
+    root_dir = os.path.dirname(os.path.dirname(request.fspath))
+    with open(os.path.join(root_dir, "node_registry.schema.json")) as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def validator(schema):
+    return RegistryValidator(schema)
+
+
+@pytest.fixture
+def registry(request):
+    root_dir = os.path.dirname(os.path.dirname(request.fspath))
+    with open(os.path.join(root_dir, "doc", "node_registry.example.json")) as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def archive(tmp_path, registry):
+    (tmp_path / "registries").mkdir()
+    (tmp_path / "registries" / "2024.json").write_text(json.dumps(registry))
+    (tmp_path / "NodeA").mkdir()
+    (tmp_path / "NodeA" / "old.json").write_text(json.dumps({"services": [_service()]}))
+    (tmp_path / "NodeA" / "new.json").write_text(
+        json.dumps({"schema_version": "1.3.0", "services": [_service(types=["data"], version="bad")]})
+    )
+    (tmp_path / "NodeB").mkdir()
+    (tmp_path / "NodeB" / "broken.json").write_text('{"services": [')
+    (tmp_path / "notes.txt").write_text("not json")
+    return tmp_path
+
+
+def test_json_files_found_in_order(archive):
+    assert [os.path.relpath(path, archive) for path in bulk.iter_files([str(archive)])] == [
+        os.path.join("NodeA", "new.json"),
+        os.path.join("NodeA", "old.json"),
+        os.path.join("NodeB", "broken.json"),
+        os.path.join("registries", "2024.json"),
+    ]
+
+
+def test_registry_nodes_checked(archive, validator, registry):
+    results = bulk.check_source(str(archive / "registries" / "2024.json"), validator)
+    assert [(result.node, result.status) for result in results] == [(name, "valid") for name in registry]
+
+
+def test_payload_migrated_before_validation(archive, validator):
+    (result,) = bulk.check_source(str(archive / "NodeA" / "old.json"), validator)
+    assert (result.node, result.version, result.status) == ("NodeA", "undeclared", "valid")
+
+
+def test_invalid_payload_reported_with_pointer(archive, validator):
+    (result,) = bulk.check_source(str(archive / "NodeA" / "new.json"), validator)
+    assert (result.version, result.status, result.pointer) == ("1.3.0", "invalid", "/services/0/version")
+
+
+def test_unresolvable_reference_reported(archive, validator, mocker):
+    mocker.patch.object(
+        validator, "validate_node", side_effect=bulk.RefResolutionError("remote schema is not in the schema store")
+    )
+    results = bulk.check_source(str(archive / "registries" / "2024.json"), validator)
+    assert {result.status for result in results} == {"invalid"}
+
+
+def test_unreadable_payload(archive, validator):
+    (result,) = bulk.check_source(str(archive / "NodeB" / "broken.json"), validator)
+    assert result.status == "unreadable"
+
+
+def test_migration_failure_reported(archive, validator):
+    (archive / "NodeA" / "old.json").write_text(json.dumps({"services": [{"name": "no keywords"}]}))
+    (result,) = bulk.check_source(str(archive / "NodeA" / "old.json"), validator)
+    assert result.status == "migration_failed"
+    assert "convert_keywords_to_types" in result.message
+
+
+def test_checked_on_process_pool(archive, schema, registry):
+    results = list(bulk.check_sources(bulk.iter_files([str(archive)]), schema, workers=2))
+    report = bulk.summarize(results)
+    assert report["sources"] == 4
+    assert report["statuses"] == {"valid": 1 + len(registry), "invalid": 1, "unreadable": 1}
+    assert report["versions"]["1.3.0"] == {"invalid": 1}
+    assert [failure["pointer"] for failure in report["nodes"]["NodeA"]["failures"]] == ["/services/0/version"]
+    assert report["nodes"][""]["statuses"] == {"unreadable": 1}
+
+
+def test_git_history(tmp_path, registry, validator):
+    def git(*args):
+        subprocess.run(["git", "-C", str(tmp_path), *args], check=True, capture_output=True)
+
+    git("init")
+    for description in ("first", "second"):
+        registry[next(iter(registry))]["description"] = description
+        (tmp_path / "node_registry.json").write_text(json.dumps(registry))
+        git("add", "node_registry.json")
+        git("-c", "user.name=test", "-c", "user.email=test@example.com", "commit", "-m", description)
+    sources = list(bulk.iter_git_history(str(tmp_path), "node_registry.json"))
+    assert len(sources) == 2
+    assert all(result.status == "valid" for source in sources for result in bulk.check_source(source, validator))
+
+
+def test_exit_status(archive, capsys):
+    assert bulk.main([str(archive / "registries"), "--workers", "1"]) == 0
+    assert bulk.main([str(archive), "--workers", "1", "--report", str(archive / "report.json")]) == 1
+    assert json.loads((archive / "report.json").read_text())["statuses"]["invalid"] == 1
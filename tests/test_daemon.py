@@ -0,0 +1,99 @@
+import random
+import threading
+
+import pytest
+
+import daemon  # type: ignore
+from report import RunReport  # type: ignore
+
+NOW = 1_700_000_000.0
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = daemon.Scheduler(random.Random(0))
+    scheduler.sync({"node1": {"status": "online"}, "node2": {"status": "offline"}}, NOW)
+    return scheduler
+
+
+def test_new_nodes_due_now(scheduler):
+    assert scheduler.next_due() == NOW
+    assert sorted(scheduler.pop_due(NOW)) == ["node1", "node2"]
+    assert scheduler.next_due() is None
+
+
+def test_recently_updated_node_not_due(scheduler):
+    scheduler.sync({"node3": {"last_updated": "2023-11-14T22:13:20+00:00"}}, NOW)
+    assert scheduler.nodes.keys() == {"node3"}
+    assert scheduler.next_due() == pytest.approx(NOW + daemon.BASE_INTERVAL, rel=daemon.JITTER)
+
+
+def test_stable_node_polled_less_often(scheduler):
+    scheduler.pop_due(NOW)
+    due = scheduler.reschedule("node1", "online", NOW)
+    assert scheduler.nodes["node1"].interval == daemon.BASE_INTERVAL * daemon.INTERVAL_GROWTH
+    assert due - NOW == pytest.approx(scheduler.nodes["node1"].interval, rel=daemon.JITTER)
+
+
+def test_flapping_node_polled_more_often(scheduler):
+    scheduler.pop_due(NOW)
+    scheduler.reschedule("node1", "offline", NOW)
+    assert scheduler.nodes["node1"].interval == daemon.BASE_INTERVAL / 2
+
+
+def test_interval_bounds(scheduler):
+    for _ in range(50):
+        scheduler.reschedule("node1", "online", NOW)
+        scheduler.reschedule("node2", "offline" if scheduler.nodes["node2"].status == "online" else "online", NOW)
+    assert scheduler.nodes["node1"].interval == daemon.MAX_INTERVAL
+    assert scheduler.nodes["node2"].interval == daemon.MIN_INTERVAL
+
+
+def test_batches_nodes_due_together(scheduler):
+    scheduler.pop_due(NOW)
+    scheduler.reschedule("node1", "offline", NOW)
+    scheduler.reschedule("node2", "offline", NOW)
+    first = scheduler.next_due()
+    assert scheduler.pop_due(first, window=0) == ["node1"]
+    assert scheduler.pop_due(first + daemon.MAX_INTERVAL) == ["node2"]
+
+
+def test_removed_nodes_forgotten(scheduler):
+    scheduler.sync({"node2": {}}, NOW)
+    assert scheduler.pop_due(NOW) == ["node2"]
+
+
+class TestRun:
+    @pytest.fixture(autouse=True)
+    def setup(self, mocker):
+        self.clock = [NOW]
+        self.stop = threading.Event()
+        self.batches = []
+        registry = {"node1": {"status": "online"}, "node2": {"status": "offline"}}
+        mocker.patch.object(daemon.update, "_load_registry", return_value=registry)
+
+        def update_registry(nodes, **options):
+            self.batches.append(sorted(nodes))
+            self.options = options
+            if len(self.batches) == 3:
+                self.stop.set()
+            report = RunReport()
+            for name, data in registry.items():
+                report.set_outcome(name, data["status"])
+            return report
+
+        mocker.patch.object(daemon.update, "update_registry", side_effect=update_registry)
+        mocker.patch.object(self.stop, "wait", side_effect=lambda seconds: self.clock.append(self.clock[-1] + seconds))
+        daemon.run(self.stop, daemon.Scheduler(random.Random(0)), clock=lambda: self.clock[-1])
+
+    def test_all_nodes_polled_first(self):
+        assert self.batches[0] == ["node1", "node2"]
+
+    def test_waits_until_next_due(self):
+        assert self.clock[1] - NOW == pytest.approx(daemon.BASE_INTERVAL * daemon.INTERVAL_GROWTH, rel=daemon.JITTER)
+
+    def test_stops(self):
+        assert len(self.batches) == 3
+
+    def test_circuit_breaker_respected(self):
+        assert self.options["respect_breaker"] is True
@@ -0,0 +1,95 @@
+import copy
+import json
+import os
+
+import pytest
+
+import delta  # type: ignore
+
+
+@pytest.fixture
+def example_registry_content(request):
+    """Return the content contained in ../doc/node_registry.example.json"""
+    root_dir = os.path.dirname(os.path.dirname(request.fspath))
+    with open(os.path.join(root_dir, "doc", "node_registry.example.json")) as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def example_node_name(example_registry_content):
+    return list(example_registry_content)[0]
+
+
+@pytest.fixture
+def current(example_registry_content):
+    return copy.deepcopy(example_registry_content)
+
+
+def test_no_changes(example_registry_content, current):
+    assert delta.compute_delta(example_registry_content, current) == []
+
+
+def test_last_updated_ignored(example_registry_content, current, example_node_name):
+    current[example_node_name]["last_updated"] = "2030-01-01T00:00:00+00:00"
+    assert delta.compute_delta(example_registry_content, current) == []
+
+
+def test_status_transition(example_registry_content, current, example_node_name):
+    previous_status = current[example_node_name]["status"]
+    current[example_node_name]["status"] = "invalid_configuration"
+    assert delta.compute_delta(example_registry_content, current) == [
+        {"node": example_node_name, "change": "modified", "status": {"from": previous_status, "to": "invalid_configuration"}}
+    ]
+
+
+def test_version_bump(example_registry_content, current, example_node_name):
+    current[example_node_name]["version"] = "99.0.0"
+    (change,) = delta.compute_delta(example_registry_content, current)
+    assert change["version"]["to"] == "99.0.0"
+
+
+def test_services_changes(example_registry_content, current, example_node_name):
+    services = current[example_node_name]["services"]
+    removed = services.pop(0)["name"]
+    services[0]["description"] = "changed"
+    services.append({**services[0], "name": "new-service"})
+    (change,) = delta.compute_delta(example_registry_content, current)
+    assert change["services"] == {"added": ["new-service"], "removed": [removed], "modified": [services[0]["name"]]}
+
+
+def test_service_health_check_time_ignored(example_registry_content, current, example_node_name):
+    health = {"reachable": True, "status_code": 200, "latency": 0.1, "checked": "2030-01-01T00:00:00+00:00"}
+    example_registry_content[example_node_name]["services"][0]["health"] = health
+    current[example_node_name]["services"][0]["health"] = {
+        **health,
+        "latency": 0.2,
+        "checked": "2030-01-02T00:00:00+00:00",
+    }
+    assert delta.compute_delta(example_registry_content, current) == []
+
+
+def test_service_reachability_change(example_registry_content, current, example_node_name):
+    service = current[example_node_name]["services"][0]
+    health = {"reachable": True, "status_code": 200, "latency": 0.1, "checked": "2030-01-01T00:00:00+00:00"}
+    example_registry_content[example_node_name]["services"][0]["health"] = health
+    service["health"] = {**health, "reachable": False, "status_code": None}
+    (change,) = delta.compute_delta(example_registry_content, current)
+    assert change["services"]["modified"] == [service["name"]]
+
+
+def test_other_fields(example_registry_content, current, example_node_name):
+    current[example_node_name]["contact"] = "new@example.com"
+    (change,) = delta.compute_delta(example_registry_content, current)
+    assert change["fields"] == ["contact"]
+
+
+def test_nodes_added_and_removed(example_registry_content, example_node_name):
+    current = {"NewNode": {"status": "online"}}
+    assert delta.compute_delta(example_registry_content, current) == [
+        {"node": "NewNode", "change": "added", "status": {"from": None, "to": "online"}},
+        {
+            "node": example_node_name,
+            "change": "removed",
+            "status": {"from": example_registry_content[example_node_name]["status"], "to": None},
+        },
+    ]
@@ -0,0 +1,122 @@
+import copy
+import json
+import os
+
+import jsonschema
+import pytest
+
+import fastpath  # type: ignore
+import validation  # type: ignore
+
+
+def _is_valid(schema, instance, store=None):
+    (function,) = fastpath.load_functions(schema, store or {}, {"is_valid": schema}).values()
+    return function(instance)
+
+
+@pytest.mark.parametrize(
+    "schema, instance",
+    [
+        ({"type": "integer"}, 1),
+        ({"type": "integer"}, 1.0),
+        ({"type": "integer"}, 1.5),
+        ({"type": "integer"}, True),
+        ({"type": "number"}, False),
+        ({"type": ["string", "null"]}, None),
+        ({"type": ["string", "null"]}, 0),
+        ({"enum": ["a", "b"]}, "a"),
+        ({"enum": ["a", "b"]}, ["a"]),
+        ({"const": "a"}, {"a": 1}),
+        ({"minimum": 0, "maximum": 1}, 2),
+        ({"minimum": 0}, "not a number"),
+        ({"minLength": 2}, "ab"),
+        ({"minLength": 2}, "a"),
+        ({"minItems": 1}, []),
+        ({"pattern": "^a"}, "ba"),
+        ({"pattern": "a"}, "ba"),
+        ({"required": ["a"]}, {}),
+        ({"required": ["a"]}, []),
+        ({"properties": {"a": {"type": "string"}}, "additionalProperties": False}, {"a": "b"}),
+        ({"properties": {"a": {"type": "string"}}, "additionalProperties": False}, {"a": "b", "c": 1}),
+        ({"patternProperties": {"^x": {"type": "integer"}}, "additionalProperties": False}, {"xa": 1}),
+        ({"patternProperties": {"^x": {"type": "integer"}}, "additionalProperties": False}, {"xa": "1"}),
+        ({"additionalProperties": {"type": "string"}}, {"a": 1}),
+        ({"items": {"type": "string"}}, ["a", 1]),
+        ({"contains": {"const": "a"}}, ["b", "a"]),
+        ({"contains": {"const": "a"}}, ["b"]),
+        ({"contains": {"const": "a"}}, "not an array"),
+        ({"anyOf": [{"type": "string"}, {"type": "integer"}]}, 1),
+        ({"anyOf": [{"type": "string"}, {"type": "integer"}]}, None),
+        ({"oneOf": [{"type": "number"}, {"type": "integer"}]}, 1),
+        ({"not": {"type": "string"}}, "a"),
+        ({"allOf": [{"minimum": 1}, {"maximum": 2}]}, 3),
+        ({"$defs": {"a": {"type": "string"}}, "items": {"$ref": "#/$defs/a"}}, ["a"]),
+        ({"$defs": {"a": {"type": "string"}}, "items": {"$ref": "#/$defs/a"}}, [1]),
+        ({"items": {"$ref": "#"}, "type": "array"}, [[[]], []]),
+        (True, 1),
+        ({"properties": {"a": False}}, {"a": 1}),
+        ({"format": "email", "description": "annotations are ignored"}, "not an email"),
+    ],
+)
+def test_matches_jsonschema(schema, instance):
+    assert _is_valid(schema, instance) == jsonschema.Draft202012Validator(schema).is_valid(instance)
+
+
+@pytest.mark.parametrize("schema", [{"uniqueItems": True}, {"enum": [1, 2]}, {"$dynamicRef": "#meta"}])
+def test_unsupported_keywords_defer(schema):
+    with pytest.raises(fastpath.Defer):
+        _is_valid(schema, [1, 1])
+
+
+def test_unsupported_keywords_only_defer_when_reached():
+    assert _is_valid({"properties": {"a": {"uniqueItems": True}}}, {"b": 1})
+
+
+def test_remote_references():
+    store = {"https://example.com/string": {"$id": "https://example.com/string", "type": "string"}}
+    schema = {"$id": "https://example.com/root", "items": {"$ref": "string"}}
+    assert _is_valid(schema, ["a"], store)
+    assert not _is_valid(schema, [1], store)
+
+
+def test_cached_source_reused(tmp_path):
+    schema = {"type": "string"}
+    fastpath.load_functions(schema, {}, {"is_valid": schema}, str(tmp_path))
+    (path,) = tmp_path.iterdir()
+    path.write_text("def is_valid(x):\n    return 'cached'\n")
+    (function,) = fastpath.load_functions(schema, {}, {"is_valid": schema}, str(tmp_path)).values()
+    assert function(1) == "cached"
+
+
+def _mutations(node):
+    yield lambda n: n["services"][0].update(version="bad_version")
+    yield lambda n: n["services"][0].update(version="1.2.3")
+    yield lambda n: n["services"][0].pop("links")
+    yield lambda n: n["services"][0].update(types=[])
+    yield lambda n: n["services"][0].update(types=["not-a-type"])
+    yield lambda n: n["services"][0]["links"][0].pop("href")
+    yield lambda n: n["services"][0]["links"][0].update(rel=["service"])
+    yield lambda n: n["services"][0]["links"][0].update(rel=[])
+    yield lambda n: n.update(links=[link for link in n["links"] if link["rel"] != "version"])
+    yield lambda n: n.update(status="something-bad")
+    yield lambda n: n.update(extra="field")
+    yield lambda n: n["location"].update(latitude=91)
+    yield lambda n: n["location"].update(latitude=True)
+    yield lambda n: n.update(version="1.2.3-beta")
+    yield lambda n: n.pop("contact")
+
+
+def test_node_schema_matches_jsonschema(request):
+    root_dir = os.path.dirname(os.path.dirname(request.fspath))
+    with open(os.path.join(root_dir, "node_registry.schema.json")) as f:
+        schema = json.load(f)
+    with open(os.path.join(root_dir, "doc", "node_registry.example.json")) as f:
+        registry = json.load(f)
+    store = validation.load_schema_store()
+    functions = fastpath.load_functions(schema, store, {"is_valid": schema})
+    validator = jsonschema.Draft202012Validator(schema, resolver=validation._resolver(schema, store))
+    name, node = next(iter(registry.items()))
+    for mutate in [lambda n: None, *_mutations(node)]:
+        mutated = copy.deepcopy(node)
+        mutate(mutated)
+        assert functions["is_valid"]({name: mutated}) == validator.is_valid({name: mutated})
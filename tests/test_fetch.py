@@ -0,0 +1,508 @@
+import io
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import urllib3
+
+import fetch  # type: ignore
+
+
+def _response(url):
+    response = fetch.requests.Response()
+    response.status_code = 200
+    response.url = url
+    response.raw = io.BytesIO(url.encode())
+    return response
+
+
+def _node(host):
+    return {
+        "links": [
+            {"rel": "collection", "href": f"https://{host}/services"},
+            {"rel": "version", "href": f"https://{host}/version"},
+        ]
+    }
+
+
+class ConcurrencyRecorder:
+    """Record the maximum number of concurrent requests made globally and for each host"""
+
+    def __init__(self, delay=0.02):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.active = {}
+        self.max_active = {}
+        self.active_total = 0
+        self.max_active_total = 0
+        self.hosts = []
+
+    def __call__(self, url, **kwargs):
+        host = url.split("/")[2]
+        with self.lock:
+            self.hosts.append(host)
+            self.active[host] = self.active.get(host, 0) + 1
+            self.active_total += 1
+            self.max_active[host] = max(self.max_active.get(host, 0), self.active[host])
+            self.max_active_total = max(self.max_active_total, self.active_total)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active[host] -= 1
+            self.active_total -= 1
+        return _response(url)
+
+
+@pytest.fixture
+def session():
+    return fetch.create_session()
+
+
+@pytest.fixture
+def recorder(mocker):
+    recorder_ = ConcurrencyRecorder()
+    mocker.patch.object(fetch.requests.Session, "get", side_effect=recorder_)
+    return recorder_
+
+
+def test_results_in_registry_order(recorder, session):
+    registry = {f"node{i}": _node(f"host{i}.example.com") for i in range(10)}
+    results = [(name, future.result()) for name, _, future in fetch.fetch_nodes(registry, session=session)]
+    assert [name for name, _ in results] == list(registry)
+    services_response, version_response = results[3][1]
+    assert services_response.text == "https://host3.example.com/services"
+    assert version_response.text == "https://host3.example.com/version"
+
+
+def test_global_connection_limit(recorder, session):
+    registry = {f"node{i}": _node(f"host{i}.example.com") for i in range(10)}
+    for _, _, future in fetch.fetch_nodes(registry, session=session, max_connections=3):
+        future.result()
+    assert 1 < recorder.max_active_total <= 3
+
+
+def test_per_host_connection_limit(recorder, session):
+    registry = {f"node{i}": _node("shared.example.com") for i in range(10)}
+    for _, _, future in fetch.fetch_nodes(registry, session=session, max_connections=8, max_per_host=2):
+        future.result()
+    assert recorder.max_active["shared.example.com"] <= 2
+
+
+def test_busy_host_does_not_hold_up_other_hosts(recorder, session):
+    registry = {f"shared{i}": _node("shared.example.com") for i in range(10)}
+    registry["other"] = _node("other.example.com")
+    for _, _, future in fetch.fetch_nodes(registry, session=session, max_connections=4, max_per_host=2):
+        future.result()
+    # the requests queued for the shared host do not occupy the workers of the pool
+    assert recorder.hosts.index("other.example.com") < 4
+
+
+def test_cancelled_while_queued_is_done(session):
+    limiter = fetch.ConnectionLimiter(max_per_host=1)
+    release = threading.Event()
+    with fetch.ThreadPoolExecutor() as executor:
+        running = limiter.submit(executor, "https://host.example.com/a", release.wait)
+        queued = limiter.submit(executor, "https://host.example.com/b", time.sleep, 0)
+        assert queued.cancel()
+        release.set()
+        done, not_done = fetch.wait([running, queued], timeout=5)
+    assert not not_done
+
+
+def test_errors_are_returned_per_node(mocker, session):
+    def get(url, **kwargs):
+        if "bad" in url:
+            raise fetch.requests.exceptions.ConnectionError("message")
+        return _response(url)
+
+    mocker.patch.object(fetch.requests.Session, "get", side_effect=get)
+    registry = {"good": _node("good.example.com"), "bad": _node("bad.example.com")}
+    futures = {name: future for name, _, future in fetch.fetch_nodes(registry, session=session)}
+    assert futures["good"].result()
+    with pytest.raises(fetch.requests.exceptions.ConnectionError):
+        futures["bad"].result()
+
+
+def test_sibling_request_cancelled_on_error(mocker, session):
+    requested = []
+
+    def get(url, **kwargs):
+        requested.append(url)
+        raise fetch.requests.exceptions.ConnectionError("message")
+
+    mocker.patch.object(fetch.requests.Session, "get", side_effect=get)
+    registry = {"node": _node("host.example.com")}
+    for _, _, future in fetch.fetch_nodes(registry, session=session, max_connections=1):
+        with pytest.raises(fetch.requests.exceptions.ConnectionError):
+            future.result()
+    assert requested == ["https://host.example.com/services"]
+
+
+def test_endpoints_requested_in_parallel(recorder, session):
+    registry = {"node": _node("host.example.com")}
+    for _, _, future in fetch.fetch_nodes(registry, session=session):
+        future.result()
+    assert recorder.max_active["host.example.com"] == 2
+
+
+class TestConditionalRequests:
+    url = "https://host.example.com/services"
+
+    @pytest.fixture
+    def cache(self, tmp_path):
+        return fetch.ResponseCache(str(tmp_path))
+
+    @pytest.fixture
+    def limiter(self):
+        return fetch.ConnectionLimiter()
+
+    def test_no_validators_not_cached(self, requests_mock, cache, limiter):
+        requests_mock.get(self.url, json={"services": []})
+        fetch.get_json(self.url, limiter, cache=cache)
+        fetch.get_json(self.url, limiter, cache=cache)
+        assert "If-None-Match" not in requests_mock.last_request.headers
+
+    def test_conditional_headers_sent(self, requests_mock, cache, limiter):
+        requests_mock.get(self.url, json={"services": []}, headers={"ETag": '"abc"', "Last-Modified": "yesterday"})
+        fetch.get_json(self.url, limiter, cache=cache)
+        fetch.get_json(self.url, limiter, cache=cache)
+        assert requests_mock.last_request.headers["If-None-Match"] == '"abc"'
+        assert requests_mock.last_request.headers["If-Modified-Since"] == "yesterday"
+
+    def test_not_modified_returns_cached_body(self, requests_mock, cache, limiter):
+        requests_mock.get(self.url, json={"services": []}, headers={"ETag": '"abc"'})
+        fetch.get_json(self.url, limiter, cache=cache)
+        requests_mock.get(self.url, status_code=304)
+        response = fetch.get_json(self.url, limiter, cache=cache)
+        assert response.not_modified
+        assert response.json() == {"services": []}
+
+    def test_corrupted_cache_requests_again(self, requests_mock, cache, limiter):
+        requests_mock.get(self.url, json={"services": []}, headers={"ETag": '"abc"'})
+        fetch.get_json(self.url, limiter, cache=cache)
+        with open(cache._body_path(self.url), "wb") as f:
+            f.write(b"corrupted")
+        requests_mock.get(
+            self.url,
+            [{"status_code": 304}, {"json": {"services": [1]}, "headers": {"ETag": '"def"'}}],
+        )
+        response = fetch.get_json(self.url, limiter, cache=cache)
+        assert not response.not_modified
+        assert response.json() == {"services": [1]}
+
+
+class TestCircuitBreaker:
+    @pytest.fixture
+    def breaker(self, tmp_path):
+        return fetch.CircuitBreaker(str(tmp_path / "breaker.json"))
+
+    def test_allowed_until_threshold(self, breaker):
+        for _ in range(fetch.BREAKER_THRESHOLD - 1):
+            breaker.record_failure("node")
+        assert breaker.allow("node")
+        assert breaker.timeout("node") == fetch.REQUEST_TIMEOUT
+
+    def test_tripped_after_threshold(self, breaker):
+        for _ in range(fetch.BREAKER_THRESHOLD):
+            breaker.record_failure("node")
+        assert not breaker.allow("node")
+        assert breaker.timeout("node") == fetch.BREAKER_REQUEST_TIMEOUT
+
+    def test_delay_grows_and_is_capped(self, breaker):
+        for _ in range(fetch.BREAKER_THRESHOLD + 100):
+            breaker.record_failure("node")
+        next_attempt = fetch.datetime.datetime.fromisoformat(breaker._state["node"]["next_attempt"])
+        assert next_attempt - breaker._now() <= fetch.BREAKER_MAX_DELAY
+
+    def test_success_resets(self, breaker):
+        for _ in range(fetch.BREAKER_THRESHOLD):
+            breaker.record_failure("node")
+        breaker.record_success("node")
+        assert breaker.allow("node")
+
+    def test_state_persisted(self, breaker):
+        for _ in range(fetch.BREAKER_THRESHOLD):
+            breaker.record_failure("node")
+        breaker.save()
+        assert not fetch.CircuitBreaker(breaker.path).allow("node")
+
+
+def test_session_retries(requests_mock):
+    session = fetch.create_session(retries=3)
+    adapter = session.get_adapter("https://host.example.com")
+    assert adapter.max_retries.total == 3
+    assert 503 in adapter.max_retries.status_forcelist
+
+
+def test_retry_after_capped(mocker):
+    sleep = mocker.patch.object(fetch.time, "sleep")
+    response = urllib3.response.HTTPResponse(status=503, headers={"Retry-After": "3600"})
+    fetch.create_session().get_adapter("https://host.example.com").max_retries.sleep(response)
+    sleep.assert_called_once_with(fetch.RETRY_AFTER_MAX)
+
+
+class TestResponseLimits:
+    url = "https://host.example.com/services"
+
+    @pytest.fixture
+    def limiter(self):
+        return fetch.ConnectionLimiter()
+
+    def test_body_within_limit(self, requests_mock, limiter):
+        requests_mock.get(self.url, content=b"x" * 100)
+        assert fetch.get_json(self.url, limiter, max_bytes=100).content == b"x" * 100
+
+    def test_declared_content_length_too_large(self, requests_mock, limiter):
+        requests_mock.get(self.url, content=b"x" * 10, headers={"Content-Length": "1000"})
+        with pytest.raises(fetch.ResponseTooLarge):
+            fetch.get_json(self.url, limiter, max_bytes=100)
+
+    def test_streamed_body_too_large(self, requests_mock, limiter):
+        requests_mock.get(self.url, body=io.BytesIO(b"x" * (fetch.READ_CHUNK_SIZE * 3)))
+        with pytest.raises(fetch.ResponseTooLarge):
+            fetch.get_json(self.url, limiter, max_bytes=fetch.READ_CHUNK_SIZE)
+
+    def test_read_deadline_exceeded(self, requests_mock, limiter):
+        requests_mock.get(self.url, content=b"x" * 10)
+        with pytest.raises(fetch.ReadDeadlineExceeded):
+            fetch.get_json(self.url, limiter, read_deadline=-1)
+
+
+class TrickleHandler(BaseHTTPRequestHandler):
+    """Send the response body one byte at a time, never finishing it"""
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        try:
+            while True:
+                self.wfile.write(b" ")
+                self.wfile.flush()
+                time.sleep(0.05)
+        except OSError:
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+class TruncatedHandler(BaseHTTPRequestHandler):
+    """Close the connection before sending the whole body announced in Content-Length"""
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", "100")
+        self.end_headers()
+        self.wfile.write(b'{"services": [')
+        self.wfile.flush()
+        self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+class RetryAfterHandler(BaseHTTPRequestHandler):
+    """Always ask to retry much later"""
+
+    def do_GET(self):
+        self.send_response(503)
+        self.send_header("Retry-After", "25")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class DripHandler(BaseHTTPRequestHandler):
+    """Send a small response body one byte at a time"""
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", "100")
+        self.end_headers()
+        try:
+            for _ in range(100):
+                self.wfile.write(b" ")
+                self.wfile.flush()
+                time.sleep(0.05)
+        except OSError:
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+def _serve(handler):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def trickle_server():
+    yield from _serve(TrickleHandler)
+
+
+@pytest.fixture
+def truncated_server():
+    yield from _serve(TruncatedHandler)
+
+
+@pytest.fixture
+def drip_server():
+    yield from _serve(DripHandler)
+
+
+@pytest.fixture
+def retry_after_server():
+    yield from _serve(RetryAfterHandler)
+
+
+@pytest.fixture
+def stalled_tls_server():
+    """Accept connections but never answer the TLS handshake"""
+    listener = socket.create_server(("127.0.0.1", 0))
+    connections = []
+    stop = threading.Event()
+
+    def _accept():
+        listener.settimeout(0.05)
+        while not stop.is_set():
+            try:
+                connections.append(listener.accept()[0])
+            except OSError:
+                continue
+
+    thread = threading.Thread(target=_accept, daemon=True)
+    thread.start()
+    yield f"127.0.0.1:{listener.getsockname()[1]}"
+    stop.set()
+    thread.join()
+    for connection in connections:
+        connection.close()
+    listener.close()
+
+
+def _local_node(host):
+    return {
+        "links": [
+            {"rel": "collection", "href": f"http://{host}/services"},
+            {"rel": "version", "href": f"http://{host}/version"},
+        ]
+    }
+
+
+def _worker_threads():
+    return [thread for thread in threading.enumerate() if thread.name.startswith("ThreadPoolExecutor")]
+
+
+def test_truncated_body(truncated_server):
+    with pytest.raises(fetch.requests.exceptions.ChunkedEncodingError):
+        fetch.get_json(f"http://{truncated_server}/services", fetch.ConnectionLimiter(), session=fetch.create_session())
+
+
+def test_read_deadline_within_a_chunk(drip_server):
+    start = time.monotonic()
+    with pytest.raises(fetch.ReadDeadlineExceeded):
+        fetch.get_json(
+            f"http://{drip_server}/services", fetch.ConnectionLimiter(), session=fetch.create_session(), read_deadline=0.3
+        )
+    # the body is much smaller than a chunk and would take 5 seconds to receive
+    assert time.monotonic() - start < 2
+
+
+class TestDeadlines:
+    def test_node_deadline_aborts_requests_in_flight(self, trickle_server):
+        registry = {"node": _local_node(trickle_server)}
+        start = time.monotonic()
+        for _, _, future in fetch.fetch_nodes(
+            registry, session=fetch.create_session(), read_deadline=60, node_deadline=0.3, deadline=None
+        ):
+            with pytest.raises(fetch.NodeDeadlineExceeded):
+                future.result()
+        assert time.monotonic() - start < 5
+
+    def test_sweep_deadline_fails_remaining_nodes(self, trickle_server):
+        registry = {f"node{i}": _local_node(trickle_server) for i in range(4)}
+        start = time.monotonic()
+        for _, _, future in fetch.fetch_nodes(
+            registry,
+            max_connections=2,
+            session=fetch.create_session(),
+            read_deadline=60,
+            node_deadline=None,
+            deadline=0.3,
+        ):
+            with pytest.raises(fetch.SweepDeadlineExceeded):
+                future.result()
+        assert time.monotonic() - start < 5
+
+    def test_node_deadline_during_tls_handshake(self, stalled_tls_server):
+        registry = {"node": _node(stalled_tls_server)}
+        start = time.monotonic()
+        for _, _, future in fetch.fetch_nodes(registry, session=fetch.create_session(), node_deadline=0.3, deadline=None):
+            with pytest.raises(fetch.NodeDeadlineExceeded):
+                future.result()
+        # the handshake is aborted at the deadline rather than when the request times out and no worker is left behind
+        assert time.monotonic() - start < fetch.REQUEST_TIMEOUT / 2
+        assert not _worker_threads()
+
+    def test_sweep_deadline_during_tls_handshake(self, stalled_tls_server):
+        registry = {f"node{i}": _node(stalled_tls_server) for i in range(4)}
+        start = time.monotonic()
+        for _, _, future in fetch.fetch_nodes(
+            registry, max_connections=2, session=fetch.create_session(), node_deadline=None, deadline=0.3
+        ):
+            with pytest.raises(fetch.SweepDeadlineExceeded):
+                future.result()
+        assert time.monotonic() - start < fetch.REQUEST_TIMEOUT / 2
+        assert not _worker_threads()
+
+    def test_node_deadline_during_retry_after(self, retry_after_server):
+        registry = {"node": _local_node(retry_after_server)}
+        start = time.monotonic()
+        for _, _, future in fetch.fetch_nodes(registry, session=fetch.create_session(), node_deadline=0.3, deadline=None):
+            with pytest.raises(fetch.NodeDeadlineExceeded):
+                future.result()
+        # the worker does not sleep for as long as the node asks
+        assert time.monotonic() - start < 3
+        assert not _worker_threads()
+
+    def test_cancelled_with_error_not_sent(self, mocker):
+        get = mocker.patch.object(fetch.requests.Session, "get")
+        cancelled = fetch.Cancellation()
+        cancelled.set(fetch.NodeDeadlineExceeded("message"))
+        with pytest.raises(fetch.NodeDeadlineExceeded):
+            fetch.get_json("https://host.example.com/services", fetch.ConnectionLimiter(), cancelled)
+        assert not get.called
+
+    def test_deadline_starts_with_first_request(self):
+        cancelled = fetch.Cancellation(deadline=0.05)
+        time.sleep(0.1)
+        assert not cancelled.is_set()
+        cancelled.start()
+        assert cancelled.wait(1)
+        assert isinstance(cancelled.error, fetch.NodeDeadlineExceeded)
+
+    def test_remaining(self):
+        cancelled = fetch.Cancellation(deadline=10, expires=time.monotonic() + 60)
+        assert 59 < cancelled.remaining() <= 60
+        cancelled.start()
+        assert 9 < cancelled.remaining() <= 10
+        cancelled.finish()
+        assert fetch.Cancellation().remaining() is None
+
+    def test_deadline_stopped_when_finished(self):
+        cancelled = fetch.Cancellation(deadline=0.05)
+        cancelled.start()
+        cancelled.finish()
+        assert not cancelled.wait(0.1)
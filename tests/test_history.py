@@ -0,0 +1,104 @@
+import datetime
+import json
+
+import pytest
+
+import history  # type: ignore
+from history import HistoryStore, Observation  # type: ignore
+
+START = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+DAY = datetime.timedelta(days=1)
+
+
+@pytest.fixture
+def store(tmp_path):
+    with HistoryStore(str(tmp_path / "history.sqlite")) as store:
+        for day in range(10):
+            store.append(
+                [
+                    # node1 is online (and responds more slowly) every other day
+                    Observation("node1", "offline", "1.0", 2)
+                    if day % 2 == 0
+                    else Observation("node1", "online", "1.0", 2, 0.1 * (day + 1)),
+                    Observation("node2", "online", "2.0", 3, 0.5),
+                ],
+                START + day * DAY,
+            )
+        yield store
+
+
+def test_uptime(store):
+    # node1 was offline for 5 of the 9 days between the first and the last observation
+    assert store.uptime() == {"node1": pytest.approx(100 * 4 / 9), "node2": 100.0}
+
+
+def test_uptime_window(store):
+    assert store.uptime(since=START + DAY, until=START + 2 * DAY) == {"node1": 100.0, "node2": 100.0}
+
+
+def test_uptime_weighted_by_time(tmp_path):
+    hour, minute = datetime.timedelta(hours=1), datetime.timedelta(minutes=1)
+    with HistoryStore(str(tmp_path / "history.sqlite")) as store:
+        # a stable node is observed every 6 hours and a flapping one every 5 minutes
+        for offset, status in [(0 * hour, "online"), (6 * hour, "offline"), (6 * hour + 5 * minute, "online")]:
+            store.append([Observation("node1", status)], START + offset)
+        assert store.uptime(until=START + 12 * hour) == {"node1": pytest.approx(100 * (12 * 60 - 5) / (12 * 60))}
+        # the status observed before the start of the period holds until the next observation
+        assert store.uptime(since=START + 3 * hour, until=START + 6 * hour) == {"node1": 100.0}
+
+
+def test_uptime_nodes(store):
+    assert store.uptime(nodes=["node2"]) == {"node2": 100.0}
+
+
+def test_latency_percentiles(store):
+    latencies = store.latency_percentiles([0, 50, 100])
+    assert latencies["node1"] == pytest.approx({0: 0.2, 50: 0.6, 100: 1.0})
+    assert latencies["node2"] == {0: 0.5, 50: 0.5, 100: 0.5}
+
+
+def test_latency_excludes_nodes_without_responses(store):
+    assert store.latency_percentiles(since=START, until=START + DAY) == {
+        "node2": {p: 0.5 for p in history.DEFAULT_PERCENTILES}
+    }
+
+
+def test_append_is_persistent(tmp_path):
+    path = str(tmp_path / "history.sqlite")
+    with HistoryStore(path) as store:
+        store.append([Observation("node1", "online")], START)
+    with HistoryStore(path) as store:
+        store.append([Observation("node1", "offline")], START + DAY)
+        assert store.uptime(until=START + 2 * DAY) == {"node1": 50.0}
+
+
+def test_main_uses_default_history(tmp_path, mocker, capsys):
+    path = str(tmp_path / "history.sqlite")
+    with HistoryStore(path) as store:
+        store.append([Observation("node1", "online")], datetime.datetime.now(tz=datetime.timezone.utc) - DAY / 2)
+    mocker.patch.object(history, "HISTORY_DB", path)
+    history.main(["uptime", "--since", "1d"])
+    assert "node1" in capsys.readouterr().out
+
+
+def test_percentile_interpolates():
+    assert history.percentile([1.0, 2.0, 3.0, 4.0], 50) == 2.5
+
+
+def test_parse_time():
+    now = START + 90 * DAY
+    assert history.parse_time("90d", now) == START
+    assert history.parse_time("2024-01-01", now) == START
+
+
+def test_windows():
+    assert history.windows(START, START + 3 * DAY, 2 * DAY) == [
+        (START, START + 2 * DAY),
+        (START + 2 * DAY, START + 3 * DAY),
+    ]
+
+
+def test_cli(store, capsys):
+    history.main(["uptime", "--history", store.path, "--since", "2024-01-01", "--until", "2024-01-11", "--every", "5d"])
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [line["uptime"] for line in lines] == [{"node1": 40.0, "node2": 100.0}, {"node1": 60.0, "node2": 100.0}]
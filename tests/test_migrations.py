@@ -0,0 +1,141 @@
+from copy import deepcopy
+
+import pytest
+
+import migrations  # type: ignore
+
+SERVICE = {
+    "name": "geoserver",
+    "keywords": ["data", "service-wps", "some-other-keyword"],
+    "description": "GeoServer",
+    "links": [],
+}
+
+
+@pytest.fixture
+def data():
+    return {"services": [deepcopy(SERVICE), {**deepcopy(SERVICE), "keywords": ["unknown"]}]}
+
+
+def test_convert_keywords_to_types(data):
+    migrations.apply_migrations(data)
+    assert data["services"][0]["types"] == ["data", "wps"]
+    assert data["services"][1]["types"] == ["other"]
+
+
+def test_existing_types_not_changed(data):
+    data["services"][0]["types"] = ["catalog"]
+    migrations.apply_migrations(data)
+    assert data["services"][0]["types"] == ["catalog"]
+
+
+def test_skipped_for_current_payloads(data):
+    migrations.apply_migrations(data, declared_version=(1, 3, 0))
+    assert "types" not in data["services"][0]
+
+
+def test_applied_for_older_payloads(data):
+    migrations.apply_migrations(data, declared_version=(1, 2, 0))
+    assert data["services"][0]["types"] == ["data", "wps"]
+
+
+@pytest.mark.parametrize(
+    ["payload", "expected"],
+    [
+        ({"schema_version": "1.3.0"}, (1, 3, 0)),
+        ({"$schema": "https://example.com/refs/tags/1.2.1/node_registry.schema.json"}, (1, 2, 1)),
+        ({"$schema": "https://example.com/schema.json"}, None),
+        ({"schema_version": "abc"}, None),
+        ({}, None),
+    ],
+)
+def test_declared_schema_version(payload, expected):
+    assert migrations.declared_schema_version(payload) == expected
+
+
+def test_service_migrations_fused(data):
+    calls = []
+
+    @migrations.service_migration("9.0.0")
+    def first(service):
+        calls.append(("first", service["keywords"][0]))
+
+    @migrations.service_migration("9.0.0")
+    def second(service):
+        calls.append(("second", service["keywords"][0]))
+
+    migrations.apply_migrations(data, migrations=(first, second))
+    assert calls == [("first", "data"), ("second", "data"), ("first", "unknown"), ("second", "unknown")]
+
+
+def test_node_migrations_keep_order(data):
+    calls = []
+
+    @migrations.service_migration("9.0.0")
+    def service_step(service):
+        calls.append("service")
+
+    @migrations.node_migration("9.0.0")
+    def node_step(node):
+        calls.append("node")
+
+    migrations.apply_migrations(data, migrations=(service_step, node_step, service_step))
+    assert calls == ["service", "service", "node", "service", "service"]
+
+
+def test_error_reports_failed_step(data):
+    del data["services"][1]["keywords"]
+    with pytest.raises(migrations.MigrationError) as exc:
+        migrations.apply_migrations(data)
+    assert exc.value.migration is migrations.convert_keywords_to_types
+    assert exc.value.service_index == 1
+    assert "convert_keywords_to_types" in str(exc.value)
+
+
+def test_only_selected_services_migrated(data):
+    migrations.apply_migrations(data, services=[1])
+    assert "types" not in data["services"][0]
+    assert data["services"][1]["types"] == ["other"]
+
+
+def test_needs_node_migrations():
+    @migrations.node_migration("2.0.0")
+    def node_step(node):
+        pass
+
+    assert not migrations.needs_node_migrations(None)
+    assert migrations.needs_node_migrations((1, 0, 0), migrations=(node_step,))
+    assert not migrations.needs_node_migrations((2, 0, 0), migrations=(node_step,))
+
+
+def test_fingerprint_changes_with_migrations():
+    @migrations.service_migration("1.3.0")
+    def convert_keywords_to_types(service):
+        service["types"] = ["other"]
+
+    assert migrations.fingerprint() == migrations.fingerprint(migrations.MIGRATIONS)
+    assert migrations.fingerprint() != migrations.fingerprint((convert_keywords_to_types,))
+
+
+def test_fingerprint_changes_with_constants():
+    # the bytecode of these functions is identical, only their constants differ
+    @migrations.service_migration("1.3.0")
+    def convert_keywords_to_types(service):
+        service["types"] = [{"service-wms": "wms"}.get(service["keywords"][0])]
+
+    first = migrations.fingerprint((convert_keywords_to_types,))
+
+    @migrations.service_migration("1.3.0")
+    def convert_keywords_to_types(service):
+        service["types"] = [{"service-wms": "stac"}.get(service["keywords"][0])]
+
+    assert migrations.fingerprint((convert_keywords_to_types,)) != first
+
+
+def test_fingerprint_changes_with_applies():
+    def migrate(service):
+        service["types"] = ["other"]
+
+    first = migrations.fingerprint((migrations.service_migration("1.3.0", applies=lambda service: True)(migrate),))
+    second = migrations.fingerprint((migrations.service_migration("1.3.0", applies=lambda service: False)(migrate),))
+    assert first != second
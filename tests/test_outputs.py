@@ -0,0 +1,85 @@
+import gzip
+import hashlib
+import json
+import os
+
+import pytest
+
+import outputs  # type: ignore
+
+
+@pytest.fixture
+def example_registry_content(request):
+    """Return the content contained in ../doc/node_registry.example.json"""
+    root_dir = os.path.dirname(os.path.dirname(request.fspath))
+    with open(os.path.join(root_dir, "doc", "node_registry.example.json")) as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def output_dir(tmp_path, example_registry_content):
+    output_dir_ = tmp_path / "artifacts"
+    outputs.write_artifacts(example_registry_content, str(output_dir_))
+    return output_dir_
+
+
+@pytest.fixture
+def index(output_dir):
+    return json.loads((output_dir / "index.json").read_text())
+
+
+def test_full_registry(output_dir, example_registry_content):
+    assert json.loads((output_dir / "node_registry.json").read_text()) == example_registry_content
+
+
+def test_node_shards(output_dir, index, example_registry_content):
+    assert list(index["nodes"]) == list(example_registry_content)
+    for name, data in example_registry_content.items():
+        assert json.loads((output_dir / index["nodes"][name]["href"]).read_text()) == data
+
+
+def test_geojson(output_dir, example_registry_content):
+    content = json.loads((output_dir / "node_registry.geojson").read_text())
+    name, data = next(iter(example_registry_content.items()))
+    assert content["type"] == "FeatureCollection"
+    assert content["features"][0]["id"] == name
+    assert content["features"][0]["geometry"]["coordinates"] == [
+        data["location"]["longitude"],
+        data["location"]["latitude"],
+    ]
+
+
+def test_compressed_variants(output_dir, index):
+    for path in ("node_registry.json", "node_registry.geojson"):
+        assert gzip.decompress((output_dir / f"{path}.gz").read_bytes()) == (output_dir / path).read_bytes()
+
+
+def test_content_hashes(output_dir, index):
+    for path, info in index["artifacts"].items():
+        content = (output_dir / path).read_bytes()
+        assert info == {"size": len(content), "sha256": hashlib.sha256(content).hexdigest()}
+
+
+def test_stale_shards_removed(output_dir, example_registry_content):
+    outputs.write_artifacts({}, str(output_dir))
+    assert not (output_dir / "nodes").exists()
+    assert json.loads((output_dir / "index.json").read_text())["nodes"] == {}
+
+
+def test_invalid_names_not_sharded(tmp_path, example_registry_content):
+    registry = {"../bad": next(iter(example_registry_content.values()))}
+    outputs.write_artifacts(registry, str(tmp_path / "artifacts"))
+    assert not (tmp_path / "bad.json").exists()
+    assert json.loads((tmp_path / "artifacts" / "index.json").read_text())["nodes"] == {}
+
+
+def test_mirrored_assets_copied(tmp_path, example_registry_content):
+    assets_dir = tmp_path / "assets"
+    assets_dir.mkdir()
+    (assets_dir / "abc.png").write_bytes(b"image")
+    icon = next(link for link in example_registry_content["UofT"]["links"] if link["rel"] == "icon")
+    icon["mirror_href"] = "assets/abc.png"
+    outputs.write_artifacts(example_registry_content, str(tmp_path / "artifacts"), str(assets_dir))
+    assert (tmp_path / "artifacts" / "assets" / "abc.png").read_bytes() == b"image"
+    index = json.loads((tmp_path / "artifacts" / "index.json").read_text())
+    assert index["artifacts"]["assets/abc.png"]["sha256"] == hashlib.sha256(b"image").hexdigest()
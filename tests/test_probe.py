@@ -0,0 +1,79 @@
+import pytest
+import requests
+
+import probe  # type: ignore
+
+
+@pytest.fixture
+def registry():
+    def service(name, url):
+        links = [{"rel": "service-doc", "href": "https://docs.example.com"}, {"rel": "service", "href": url}]
+        return {"name": name, "links": links}
+
+    return {
+        "node1": {
+            "services": [
+                service("up", "https://node1.example.com/up/"),
+                service("forbidden", "https://node1.example.com/forbidden/"),
+                service("shared", "https://shared.example.com/"),
+            ]
+        },
+        "node2": {
+            "services": [
+                service("down", "https://node2.example.com/down/"),
+                service("shared", "https://shared.example.com/"),
+                service("offline", "https://node2.example.com/offline/"),
+            ]
+        },
+        "node3": {"services": [service("not-probed", "https://node3.example.com/")]},
+    }
+
+
+@pytest.fixture(autouse=True)
+def responses(requests_mock):
+    requests_mock.get("https://node1.example.com/up/", status_code=200)
+    requests_mock.get("https://node1.example.com/forbidden/", status_code=403)
+    requests_mock.get("https://shared.example.com/", status_code=200)
+    requests_mock.get("https://node2.example.com/down/", status_code=503)
+    requests_mock.get("https://node2.example.com/offline/", exc=requests.exceptions.ConnectTimeout)
+
+
+def _health(registry, node):
+    return {service["name"]: service.get("health") for service in registry[node]["services"]}
+
+
+def test_reachability(registry):
+    probe.probe_services(registry, ["node1", "node2"])
+    health = {**_health(registry, "node1"), **_health(registry, "node2")}
+    assert {name: value["reachable"] for name, value in health.items()} == {
+        "up": True,
+        "forbidden": True,
+        "shared": True,
+        "down": False,
+        "offline": False,
+    }
+    assert health["forbidden"]["status_code"] == 403
+    assert health["up"]["latency"] >= 0
+    assert health["offline"]["latency"] is None
+
+
+def test_only_named_nodes_probed(registry, requests_mock):
+    probe.probe_services(registry, ["node1", "node2"])
+    assert _health(registry, "node3") == {"not-probed": None}
+    assert "node3.example.com" not in {request.hostname for request in requests_mock.request_history}
+
+
+def test_shared_urls_probed_once(registry, requests_mock):
+    results = probe.probe_services(registry, ["node1", "node2"])
+    assert len(results) == 5
+    assert [request.url for request in requests_mock.request_history].count("https://shared.example.com/") == 1
+
+
+def test_probes_are_not_retried(requests_mock):
+    (result,) = probe.probe_urls(["https://node2.example.com/down/"]).values()
+    assert (result.reachable, result.status_code) == (False, 503)
+    assert requests_mock.call_count == 1
+
+
+def test_service_without_service_link():
+    assert probe.service_url({"links": [{"rel": "service-doc", "href": "https://docs.example.com"}]}) is None
@@ -0,0 +1,107 @@
+import copy
+import json
+import os
+
+import pytest
+
+import query  # type: ignore
+
+
+@pytest.fixture
+def example_registry_content(request):
+    """Return the content contained in ../doc/node_registry.example.json"""
+    root_dir = os.path.dirname(os.path.dirname(request.fspath))
+    with open(os.path.join(root_dir, "doc", "node_registry.example.json")) as f:
+        return json.load(f)
+
+
+def _node(example, lat, lon, status="online", registration_status="open", types=("data",), keywords=("data",)):
+    node = copy.deepcopy(example)
+    node["location"] = {"latitude": lat, "longitude": lon}
+    node["status"] = status
+    node["registration_status"] = registration_status
+    node["services"] = [{**node["services"][0], "types": list(types), "keywords": list(keywords)}]
+    return node
+
+
+@pytest.fixture
+def registry(example_registry_content):
+    example = next(iter(example_registry_content.values()))
+    return {
+        "Toronto": _node(example, 43.65, -79.39, types=("data", "wps")),
+        "Montreal": _node(example, 45.5, -73.57, types=("ogcapi_processes",), keywords=("weaver",)),
+        "Vancouver": _node(example, 49.28, -123.12, status="offline", types=("ogcapi_processes",)),
+        "Fiji": _node(example, -17.8, 179.9, registration_status="closed"),
+        "Samoa": _node(example, -13.8, -172.1),
+    }
+
+
+@pytest.fixture
+def index(registry):
+    return query.RegistryIndex(registry)
+
+
+def test_no_filters(index, registry):
+    assert index.query() == list(registry)
+
+
+def test_by_type(index):
+    assert index.query(types=["ogcapi_processes"]) == ["Montreal", "Vancouver"]
+
+
+def test_by_multiple_types(index):
+    assert index.query(types=["data", "wps"]) == ["Toronto"]
+
+
+def test_by_keyword(index):
+    assert index.query(keywords=["weaver"]) == ["Montreal"]
+
+
+def test_by_status(index):
+    assert index.query(types=["ogcapi_processes"], status="online") == ["Montreal"]
+    assert index.query(status=["online", "offline"]) == ["Toronto", "Montreal", "Vancouver", "Fiji", "Samoa"]
+
+
+def test_by_registration_status(index):
+    assert index.query(registration_status="closed") == ["Fiji"]
+
+
+def test_near(index):
+    assert index.query(near=(45.5, -73.57, 600)) == ["Toronto", "Montreal"]
+    assert index.query(near=(45.5, -73.57, 100)) == ["Montreal"]
+
+
+def test_near_across_antimeridian(index):
+    assert index.query(near=(-15.8, -176.0, 1000)) == ["Fiji", "Samoa"]
+
+
+def test_near_antimeridian_longitude(registry, example_registry_content):
+    example = next(iter(example_registry_content.values()))
+    registry["Kiribati"] = _node(example, 0, 180)
+    assert query.RegistryIndex(registry).query(near=(0, 179.5, 100)) == ["Kiribati"]
+    assert query.RegistryIndex(registry).query(near=(0, -179.5, 100)) == ["Kiribati"]
+
+
+def test_near_large_radius(index, registry):
+    assert index.query(near=(0, 0, 25000)) == list(registry)
+
+
+def test_near_matches_brute_force(index, registry):
+    for lat, lon, radius in [(40, -100, 3000), (80, 0, 5000), (-16, 179, 500), (0, 0, 10)]:
+        expected = [
+            name
+            for name, data in registry.items()
+            if query.haversine_km(lat, lon, data["location"]["latitude"], data["location"]["longitude"]) <= radius
+        ]
+        assert index.query(near=(lat, lon, radius)) == expected
+
+
+def test_unknown_values(index):
+    assert index.query(types=["unknown"]) == []
+    assert index.query(status="unknown", near=(0, 0, 25000)) == []
+
+
+def test_from_file(tmp_path, registry):
+    path = tmp_path / "registry.json"
+    path.write_text(json.dumps(registry))
+    assert query.RegistryIndex.from_file(str(path)).query(types=["wps"]) == ["Toronto"]
@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+from report import RunReport  # type: ignore
+
+
+@pytest.fixture
+def report():
+    report = RunReport()
+    report.record("services.ttfb", 0.25, "node1")
+    report.record("services.ttfb", 0.5, "node2")
+    with report.phase("validate", "node1"):
+        pass
+    report.record("write", 1.0)
+    report.set_outcome("node1", "online", polled=True)
+    report.set_outcome("node2", "offline", polled=True)
+    report.finish()
+    return report
+
+
+def test_record_sums(report):
+    report.record("services.ttfb", 0.25, "node1")
+    assert report.nodes["node1"]["phases"]["services.ttfb"] == 0.5
+
+
+def test_to_dict(report):
+    data = report.to_dict()
+    assert data["phases"] == {"write": 1.0}
+    assert data["nodes"]["node1"]["status"] == "online"
+    assert "validate" in data["nodes"]["node1"]["phases"]
+    assert data["duration"] >= 0
+
+
+def test_write_json(report, tmp_path):
+    report.extra["tracemalloc"] = {"peak": 1}
+    path = tmp_path / "report.json"
+    report.write_json(str(path))
+    data = json.loads(path.read_text())
+    assert data["tracemalloc"] == {"peak": 1}
+    assert data["nodes"]["node2"]["phases"] == {"services.ttfb": 0.5}
+
+
+def test_prometheus(report):
+    lines = report.prometheus().splitlines()
+    assert 'marble_registry_update_phase_seconds{phase="services.ttfb"} 0.75' in lines
+    assert 'marble_registry_update_node_phase_seconds{node="node2",phase="services.ttfb"} 0.5' in lines
+    assert 'marble_registry_update_nodes{status="online"} 1' in lines
+    assert 'marble_registry_update_nodes{status="offline"} 1' in lines
+
+
+def test_prometheus_escapes_labels():
+    report = RunReport()
+    report.record("decode", 0.1, 'a "quoted" node')
+    assert 'node="a \\"quoted\\" node"' in report.prometheus()
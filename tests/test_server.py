@@ -0,0 +1,105 @@
+import gzip
+import json
+import os
+import threading
+
+import pytest
+import requests
+
+import server  # type: ignore
+
+
+@pytest.fixture
+def example_registry_content(request):
+    """Return the content contained in ../doc/node_registry.example.json"""
+    root_dir = os.path.dirname(os.path.dirname(request.fspath))
+    with open(os.path.join(root_dir, "doc", "node_registry.example.json")) as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def example_node_name(example_registry_content):
+    return list(example_registry_content)[0]
+
+
+@pytest.fixture
+def registry_file(tmp_path, example_registry_content):
+    path = tmp_path / "node_registry.json"
+    path.write_text(json.dumps(example_registry_content))
+    return path
+
+
+@pytest.fixture
+def base_url(mocker, registry_file):
+    mocker.patch.object(server, "RELOAD_INTERVAL", 0)
+    server_ = server.create_server(str(registry_file), port=0)
+    thread = threading.Thread(target=server_.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server_.server_address[1]}"
+    server_.shutdown()
+    server_.server_close()
+
+
+def test_full_registry(base_url, example_registry_content):
+    assert requests.get(base_url).json() == example_registry_content
+    assert requests.get(f"{base_url}/node_registry.json").json() == example_registry_content
+
+
+def test_node(base_url, example_registry_content, example_node_name):
+    assert requests.get(f"{base_url}/nodes/{example_node_name}").json() == example_registry_content[example_node_name]
+
+
+def test_unknown_node(base_url):
+    assert requests.get(f"{base_url}/nodes/unknown").status_code == 404
+
+
+def test_type_view(base_url, example_registry_content, example_node_name):
+    assert list(requests.get(f"{base_url}/types/ogcapi_processes").json()) == [example_node_name]
+    assert requests.get(f"{base_url}/types/unknown").json() == {}
+
+
+def test_status_view(base_url, example_registry_content, example_node_name):
+    status = example_registry_content[example_node_name]["status"]
+    assert list(requests.get(f"{base_url}/status/{status}").json()) == [example_node_name]
+
+
+def test_not_modified(base_url):
+    response = requests.get(base_url, headers={"Accept-Encoding": "identity"})
+    etag = response.headers["ETag"]
+    conditional = requests.get(base_url, headers={"Accept-Encoding": "identity", "If-None-Match": etag})
+    assert conditional.status_code == 304
+    assert conditional.headers["ETag"] == etag
+
+
+def test_gzip(base_url, example_registry_content):
+    response = requests.get(base_url, headers={"Accept-Encoding": "gzip"}, stream=True)
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(response.raw.read())) == example_registry_content
+    identity = requests.get(base_url, headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in identity.headers
+    assert identity.headers["ETag"] != response.headers["ETag"]
+
+
+def test_reload(base_url, registry_file, example_registry_content, example_node_name):
+    etag = requests.get(base_url).headers["ETag"]
+    registry = {example_node_name: {**example_registry_content[example_node_name], "status": "offline", "x": 1}}
+    registry_file.write_text(json.dumps(registry))
+    response = requests.get(base_url)
+    assert response.json() == registry
+    assert response.headers["ETag"] != etag
+
+
+def test_head(base_url):
+    response = requests.head(base_url)
+    assert response.status_code == 200
+    assert response.content == b""
+
+
+def test_cache_bounded_by_registry(registry_file, example_node_name):
+    store = server.RegistryStore(str(registry_file))
+    for i in range(100):
+        assert store.get(f"/nodes/unknown{i}") is None
+        assert json.loads(store.get(f"/types/unknown{i}").body) == {}
+        assert json.loads(store.get(f"/status/unknown{i}").body) == {}
+        assert store.get(f"/nodes//{example_node_name}/") is store.get(f"/nodes/{example_node_name}")
+    assert len(store._representations) == 2
@@ -6,6 +6,7 @@ import jsonschema
 import pytest
 
 import update # type: ignore
+import fetch # type: ignore
 
 GOOD_SERVICES = {
     "services": [
@@ -44,6 +45,39 @@ def updated_registry(mocker):
     yield mocker.patch.object(update, "_write_registry")
 
 
+@pytest.fixture(autouse=True)
+def written_artifacts(mocker):
+    """Mock the _write_artifacts function so that nothing is actually written to disk during the tests run"""
+    yield mocker.patch.object(update, "_write_artifacts")
+
+
+@pytest.fixture(autouse=True)
+def written_delta(mocker):
+    """Mock the _write_delta function so that nothing is actually written to disk during the tests run"""
+    yield mocker.patch.object(update, "_write_delta")
+
+
+@pytest.fixture(autouse=True)
+def delta_file(mocker, tmp_path):
+    """Keep the delta file removed by the update script in a temporary directory during the tests run"""
+    path = tmp_path / "node_registry.delta.json"
+    mocker.patch.object(update, "DELTA_FILE", str(path))
+    return path
+
+
+@pytest.fixture(autouse=True)
+def written_history(mocker):
+    """Mock the _write_history function so that nothing is actually written to disk during the tests run"""
+    yield mocker.patch.object(update, "_write_history")
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(mocker, tmp_path):
+    """Keep the cache used by the update script in a temporary directory during the tests run"""
+    mocker.patch.object(update, "CACHE_DIR", str(tmp_path))
+    return tmp_path
+
+
 @pytest.fixture(autouse=True)
 def links_json_schema(requests_mock, request):
     """
@@ -131,7 +165,9 @@ class TestOfflineNode:
 
     @pytest.fixture(autouse=True)
     def setup(self, mocker, example_registry):
-        mocker.patch.object(update.requests, "get").side_effect = update.requests.exceptions.ConnectionError("message")
+        mocker.patch.object(update.requests.Session, "get").side_effect = update.requests.exceptions.ConnectionError(
+            "message"
+        )
         update.update_registry()
 
     def test_status_offline(self, example_node_name, example_registry_content, updated_registry):
@@ -160,6 +196,29 @@ class TestOfflineNode:
         )
 
 
+class TestLoadedRegistryNotModified:
+    """Test that outcomes are committed to a new registry instead of modifying the loaded one"""
+
+    def test_online_node(self, example_node_name, example_registry, example_registry_content, requests_mock):
+        links = example_registry_content[example_node_name]["links"]
+        requests_mock.get(next(link["href"] for link in links if link["rel"] == "collection"), json=GOOD_SERVICES)
+        requests_mock.get(next(link["href"] for link in links if link["rel"] == "version"), json={"version": "1.2.3"})
+        update.update_registry()
+        assert example_registry.return_value == example_registry_content
+
+    def test_offline_node(self, mocker, example_registry, example_registry_content):
+        mocker.patch.object(update.requests.Session, "get").side_effect = update.requests.exceptions.ConnectionError()
+        update.update_registry()
+        assert example_registry.return_value == example_registry_content
+
+    def test_outcome_applied(self):
+        previous = {"name": "node", "status": "online", "version": "1.0.0"}
+        assert update.NodeOutcome("offline").apply(previous) == {**previous, "status": "offline"}
+        new_data = update.MappingProxyType({"name": "node", "version": "2.0.0"})
+        assert update.NodeOutcome("online", new_data).apply(previous) == {**new_data, "status": "online"}
+        assert previous["status"] == "online"
+
+
 class TestNodeReturnsInvalidJson:
     """Test when the /services route returns a string that is not parseable as valid json"""
 
@@ -201,6 +260,33 @@ class TestNodeReturnsInvalidJson:
         )
 
 
+class TestNodeReturnsTooLargeResponse:
+    """Test when the /services route returns a body that is larger than the maximum allowed"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, example_node_name, example_registry, example_registry_content, requests_mock):
+        services_url = next(
+            link["href"] for link in example_registry_content[example_node_name]["links"] if link["rel"] == "collection"
+        )
+        version_url = next(
+            link["href"] for link in example_registry_content[example_node_name]["links"] if link["rel"] == "version"
+        )
+        requests_mock.get(services_url, json=GOOD_SERVICES)
+        requests_mock.get(version_url, json={"version": "1.2.3"})
+        update.update_registry(max_response_bytes=100)
+
+    def test_status_invalid_configuration(self, example_node_name, updated_registry):
+        """Test that the status is updated to 'invalid_configuration'"""
+        assert updated_registry.call_args.args[0][example_node_name]["status"] == "invalid_configuration"
+
+    def test_services_no_change(self, example_node_name, example_registry_content, updated_registry):
+        """Test that the services values did not change"""
+        assert (
+            updated_registry.call_args.args[0][example_node_name]["services"]
+            == example_registry_content[example_node_name]["services"]
+        )
+
+
 class InitialTests:
     """Abstract test class used to test when no updates have previously been run"""
 
@@ -362,6 +448,66 @@ class TestOnlineNodeUpdateWithInvalidServiceTypes(InvalidResponseTests, NonIniti
         self.services["services"][0]["types"] = ["something-bad"]
 
 
+class TestOnlineNodeUpdateWithUnresolvableReference(InvalidResponseTests, NonInitialTests):
+    """Test when the reported services refer to a schema that cannot be resolved"""
+
+    services = GOOD_SERVICES
+
+    @pytest.fixture(scope="class", autouse=True)
+    def unresolvable_reference(self, class_mocker):
+        class_mocker.patch.object(
+            update.RegistryValidator,
+            "validate_node",
+            side_effect=jsonschema.exceptions.RefResolutionError("remote schema is not in the schema store"),
+        )
+
+
+class TestOnlineNodeUpdateWithNullServices(InvalidResponseTests, NonInitialTests):
+    """Test when updates have previously been run and the reported services are null"""
+
+    services = {"services": None}
+
+
+class TestOnlineNodeUpdateWithNonListServices(InvalidResponseTests, NonInitialTests):
+    """Test when updates have previously been run and the reported services are not a list"""
+
+    services = {"services": 5}
+
+
+class TestOnlineNodeUpdateWithNonObjectService(InvalidResponseTests, NonInitialTests):
+    """Test when updates have previously been run and one of the reported services is not an object"""
+
+    services = {"services": [*GOOD_SERVICES["services"], "not a service"]}
+
+
+class TestOnlineNodeUpdateWithRefreshedSchemas(InvalidResponseTests, NonInitialTests):
+    """Test when the refreshed remote schemas (see validation.SCHEMA_CACHE_DIR) are stricter than the bundled ones"""
+
+    services = GOOD_SERVICES
+
+    @pytest.fixture(scope="class", autouse=True)
+    def schema_cache_dir(self, class_mocker, tmp_path_factory):
+        cache_dir = tmp_path_factory.mktemp("schemas")
+        with open(cache_dir / "links-2020-12.json", "w") as f:
+            json.dump({"type": "object", "required": ["rel", "href", "a-property-that-no-link-has"]}, f)
+        class_mocker.patch.object(update, "SCHEMA_CACHE_DIR", str(cache_dir))
+
+
+class TestOnlineNodeUpdateWithReportedHealth(ValidResponseTests, NonInitialTests):
+    """Test when the reported services include a health value, which is only set by probing services"""
+
+    services = {
+        "services": [
+            {**service, "health": {"reachable": True, "checked": "2024-01-01T00:00:00+00:00"}}
+            for service in GOOD_SERVICES["services"]
+        ]
+    }
+
+    def test_services_updated(self, example_node_name, updated_registry):
+        """Test that the services are updated without the health reported by the node"""
+        assert updated_registry.call_args.args[0][example_node_name]["services"] == GOOD_SERVICES["services"]
+
+
 class TestOnlineNodeUpdateWithNoTypes(ValidResponseTests, NonInitialTests):
     """
     Test when updates have previously been run and there are no services types
@@ -379,3 +525,427 @@ class TestOnlineNodeUpdateWithNoTypes(ValidResponseTests, NonInitialTests):
     def test_services_updated(self, example_node_name, updated_registry):
         """Test that the services values are updated"""
         assert updated_registry.call_args.args[0][example_node_name]["services"] == GOOD_SERVICES["services"]
+
+
+class TestNodeNotModified:
+    """Test when neither endpoint of a node has changed since the last successful update"""
+
+    @pytest.fixture(autouse=True)
+    def setup(
+        self,
+        mocker,
+        example_node_name,
+        example_initial_registry,
+        example_initial_registry_content,
+        requests_mock,
+    ):
+        links = example_initial_registry_content[example_node_name]["links"]
+        services_url = next(link["href"] for link in links if link["rel"] == "collection")
+        version_url = next(link["href"] for link in links if link["rel"] == "version")
+        requests_mock.get(services_url, json=GOOD_SERVICES, headers={"ETag": '"services"'})
+        requests_mock.get(version_url, json={"version": "1.2.3"}, headers={"ETag": '"version"'})
+        update.update_registry()
+        self.first_last_updated = update._write_registry.call_args.args[0][example_node_name]["last_updated"]
+        example_initial_registry.return_value = deepcopy(example_initial_registry_content)
+        requests_mock.get(services_url, status_code=304)
+        requests_mock.get(version_url, status_code=304)
+        self.validate_node = mocker.spy(update.RegistryValidator, "validate_node")
+        update.update_registry()
+
+    def test_conditional_request_sent(self, requests_mock):
+        assert requests_mock.last_request.headers["If-None-Match"] in ('"services"', '"version"')
+
+    def test_validation_skipped(self):
+        assert self.validate_node.call_count == 0
+
+    def test_status_online(self, example_node_name, updated_registry):
+        assert updated_registry.call_args.args[0][example_node_name]["status"] == "online"
+
+    def test_services_reused(self, example_node_name, updated_registry):
+        assert updated_registry.call_args.args[0][example_node_name]["services"] == GOOD_SERVICES["services"]
+        assert updated_registry.call_args.args[0][example_node_name]["version"] == "1.2.3"
+
+    def test_last_updated_refreshed(self, example_node_name, updated_registry):
+        assert updated_registry.call_args.args[0][example_node_name]["last_updated"] != self.first_last_updated
+
+
+class TestNodeNotModifiedMigrationsChanged:
+    """Test when neither endpoint of a node has changed but the migrations or the validators have changed since"""
+
+    def test_migrated_and_validated_again(self, mocker, example_node_name, example_initial_registry, requests_mock):
+        links = deepcopy(example_initial_registry.return_value)[example_node_name]["links"]
+        services_url = next(link["href"] for link in links if link["rel"] == "collection")
+        version_url = next(link["href"] for link in links if link["rel"] == "version")
+        requests_mock.get(services_url, json=GOOD_SERVICES, headers={"ETag": '"services"'})
+        requests_mock.get(version_url, json={"version": "1.2.3"}, headers={"ETag": '"version"'})
+        initial_registry = deepcopy(example_initial_registry.return_value)
+        update.update_registry()
+        example_initial_registry.return_value = initial_registry
+        requests_mock.get(services_url, status_code=304)
+        requests_mock.get(version_url, status_code=304)
+        mocker.patch.object(update, "fingerprint", return_value="changed migrations")
+        validate_node = mocker.spy(update.RegistryValidator, "validate_node")
+        update.update_registry()
+        assert validate_node.call_count == 1
+
+    def test_validated_again_when_the_generated_validators_changed(
+        self, mocker, example_node_name, example_initial_registry, requests_mock
+    ):
+        links = deepcopy(example_initial_registry.return_value)[example_node_name]["links"]
+        services_url = next(link["href"] for link in links if link["rel"] == "collection")
+        version_url = next(link["href"] for link in links if link["rel"] == "version")
+        requests_mock.get(services_url, json=GOOD_SERVICES, headers={"ETag": '"services"'})
+        requests_mock.get(version_url, json={"version": "1.2.3"}, headers={"ETag": '"version"'})
+        initial_registry = deepcopy(example_initial_registry.return_value)
+        update.update_registry()
+        example_initial_registry.return_value = initial_registry
+        requests_mock.get(services_url, status_code=304)
+        requests_mock.get(version_url, status_code=304)
+        mocker.patch("validation.GENERATOR_VERSION", -1)
+        validate_node = mocker.spy(update.RegistryValidator, "validate_node")
+        update.update_registry()
+        assert validate_node.call_count == 1
+
+
+class TestNodeNotModifiedSinceInvalidResponse:
+    """Test when neither endpoint of a node has changed since an update that failed validation"""
+
+    def test_not_reused(self, example_node_name, example_initial_registry, requests_mock):
+        links = deepcopy(example_initial_registry.return_value)[example_node_name]["links"]
+        services_url = next(link["href"] for link in links if link["rel"] == "collection")
+        version_url = next(link["href"] for link in links if link["rel"] == "version")
+        initial_registry = deepcopy(example_initial_registry.return_value)
+        requests_mock.get(services_url, json=GOOD_SERVICES, headers={"ETag": '"valid"'})
+        requests_mock.get(version_url, json={"version": "1.2.3"}, headers={"ETag": '"version"'})
+        update.update_registry()
+        assert update._write_registry.call_args.args[0][example_node_name]["status"] == "online"
+        example_initial_registry.return_value = deepcopy(initial_registry)
+        requests_mock.get(services_url, json={"services": [{"bad_key": "some_value"}]}, headers={"ETag": '"invalid"'})
+        requests_mock.get(version_url, status_code=304)
+        update.update_registry()
+        assert update._write_registry.call_args.args[0][example_node_name]["status"] == "invalid_configuration"
+        example_initial_registry.return_value = deepcopy(initial_registry)
+        requests_mock.get(services_url, status_code=304)
+        update.update_registry()
+        assert update._write_registry.call_args.args[0][example_node_name]["status"] == "invalid_configuration"
+
+
+class TestTruncatedResponse:
+    """Test when a node closes the connection before sending the whole response body"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, example_node_name, example_registry, example_registry_content, requests_mock):
+        links = example_registry_content[example_node_name]["links"]
+        requests_mock.get(
+            next(link["href"] for link in links if link["rel"] == "collection"),
+            exc=update.requests.exceptions.ChunkedEncodingError("IncompleteRead"),
+        )
+        requests_mock.get(next(link["href"] for link in links if link["rel"] == "version"), json={"version": "1.2.3"})
+        update.update_registry()
+
+    def test_status_unresponsive(self, example_node_name, updated_registry):
+        assert updated_registry.call_args.args[0][example_node_name]["status"] == "unresponsive"
+
+    def test_services_no_change(self, example_node_name, example_registry_content, updated_registry):
+        assert (
+            updated_registry.call_args.args[0][example_node_name]["services"]
+            == example_registry_content[example_node_name]["services"]
+        )
+
+
+class TestCircuitBreaker:
+    """Test when a node has failed repeatedly in previous runs"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, mocker, example_node_name, example_registry):
+        self.get = mocker.patch.object(update.requests.Session, "get")
+        self.get.side_effect = update.requests.exceptions.ConnectionError("message")
+        for _ in range(fetch.BREAKER_THRESHOLD):
+            update.update_registry()
+        # the sibling request is cancelled when the first one fails, so a node is polled with one or two requests
+        self.calls = self.get.call_count
+        update.update_registry()
+
+    def test_tripped_node_not_polled(self):
+        assert self.calls >= fetch.BREAKER_THRESHOLD
+        assert self.get.call_count == self.calls
+
+    def test_status_unchanged(self, example_node_name, updated_registry):
+        assert updated_registry.call_args.args[0][example_node_name]["status"] == "offline"
+
+    def test_polled_again_when_due(self, mocker, example_node_name, cache_dir):
+        breaker = update.CircuitBreaker(str(cache_dir / "circuit_breaker.json"))
+        assert not breaker.allow(example_node_name)
+        later = breaker._now() + fetch.BREAKER_BASE_DELAY
+        mocker.patch.object(update.CircuitBreaker, "_now", return_value=later)
+        update.update_registry()
+        assert self.get.call_count > self.calls
+        assert self.get.call_args.kwargs["timeout"] == fetch.BREAKER_REQUEST_TIMEOUT
+
+
+class TestDeadlines:
+    """Test when a node is not fetched before the deadline of the whole update"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, mocker, example_node_name, example_registry):
+        mocker.patch.object(update.requests.Session, "get").side_effect = fetch.SweepDeadlineExceeded("message")
+        update.update_registry()
+
+    def test_status_unresponsive(self, example_node_name, updated_registry):
+        assert updated_registry.call_args.args[0][example_node_name]["status"] == "unresponsive"
+
+    def test_services_no_change(self, example_node_name, example_registry_content, updated_registry):
+        assert (
+            updated_registry.call_args.args[0][example_node_name]["services"]
+            == example_registry_content[example_node_name]["services"]
+        )
+
+    def test_not_a_breaker_failure(self, example_node_name, cache_dir):
+        breaker = update.CircuitBreaker(str(cache_dir / "circuit_breaker.json"))
+        assert breaker._state.get(example_node_name) is None
+
+
+class TestDelta:
+    """Test that the changes made during a run are recorded"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, example_node_name, example_registry, example_registry_content, requests_mock):
+        links = example_registry_content[example_node_name]["links"]
+        requests_mock.get(next(link["href"] for link in links if link["rel"] == "collection"), json=GOOD_SERVICES)
+        requests_mock.get(next(link["href"] for link in links if link["rel"] == "version"), json={"version": "1.2.3"})
+
+    def test_delta_written(self, example_node_name, written_delta):
+        update.update_registry()
+        (change,) = written_delta.call_args.args[0]
+        assert change["node"] == example_node_name
+        assert change["version"]["to"] == "1.2.3"
+
+    def test_no_delta_when_nothing_changed(
+        self, tmp_path, example_registry, example_registry_content, updated_registry, written_delta, delta_file
+    ):
+        update.update_registry()
+        previous = tmp_path / "previous.json"
+        previous.write_text(json.dumps(updated_registry.call_args.args[0]))
+        written_delta.reset_mock()
+        delta_file.write_text('{"changes": [{"node": "from a previous run"}]}')
+        example_registry.return_value = deepcopy(example_registry_content)
+        update.update_registry(previous_registry=str(previous))
+        assert not written_delta.called
+        # the delta of a previous run is not left behind as if it described this run
+        assert not delta_file.exists()
+
+
+class TestRunReport:
+    """Test that the time spent in each phase of the update is reported"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, example_node_name, example_registry, example_registry_content, requests_mock):
+        links = example_registry_content[example_node_name]["links"]
+        requests_mock.get(next(link["href"] for link in links if link["rel"] == "collection"), json=GOOD_SERVICES)
+        requests_mock.get(next(link["href"] for link in links if link["rel"] == "version"), json={"version": "1.2.3"})
+        self.report = update.update_registry()
+
+    def test_node_phases(self, example_node_name):
+        phases = self.report.nodes[example_node_name]["phases"]
+        for phase in ("services.wait", "services.ttfb", "services.download", "decode", "migrate", "validate"):
+            assert phase in phases
+
+    def test_run_phases(self):
+        assert {"final_validation", "write"} <= set(self.report.phases)
+        assert self.report.duration is not None
+
+    def test_outcome(self, example_node_name):
+        node = self.report.nodes[example_node_name]
+        assert node["status"] == "online"
+        assert node["polled"]
+
+
+class TestHistory:
+    """Test that the state of each node is appended to the history"""
+
+    def test_online_node(
+        self, example_node_name, example_registry, example_registry_content, requests_mock, written_history
+    ):
+        links = example_registry_content[example_node_name]["links"]
+        requests_mock.get(next(link["href"] for link in links if link["rel"] == "collection"), json=GOOD_SERVICES)
+        requests_mock.get(next(link["href"] for link in links if link["rel"] == "version"), json={"version": "1.2.3"})
+        update.update_registry()
+        (observation,) = written_history.call_args.args[0]
+        assert observation[:4] == (example_node_name, "online", "1.2.3", len(GOOD_SERVICES["services"]))
+        assert observation.latency is not None
+
+    def test_offline_node(self, mocker, example_node_name, example_registry, written_history):
+        mocker.patch.object(update.requests.Session, "get").side_effect = update.requests.exceptions.ConnectionError()
+        update.update_registry()
+        (observation,) = written_history.call_args.args[0]
+        assert observation.status == "offline"
+        assert observation.latency is None
+
+
+class TestProbeServices:
+    """Test when the services advertised by online nodes are probed"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, example_node_name, example_registry, example_registry_content, requests_mock):
+        links = example_registry_content[example_node_name]["links"]
+        requests_mock.get(next(link["href"] for link in links if link["rel"] == "collection"), json=GOOD_SERVICES)
+        requests_mock.get(next(link["href"] for link in links if link["rel"] == "version"), json={"version": "1.2.3"})
+        requests_mock.get("https://daccs-uoft.example.com/geoserver/", status_code=200)
+        requests_mock.get("https://daccs-uoft.example.com/weaver/", status_code=502)
+
+    def test_not_probed_by_default(self, example_node_name, updated_registry):
+        update.update_registry()
+        for service in updated_registry.call_args.args[0][example_node_name]["services"]:
+            assert "health" not in service
+
+    def test_health_recorded(self, example_node_name, updated_registry, node_registry_schema):
+        update.update_registry(probe=True)
+        registry = updated_registry.call_args.args[0]
+        health = {service["name"]: service["health"] for service in registry[example_node_name]["services"]}
+        assert health["geoserver"]["reachable"]
+        assert not health["weaver"]["reachable"]
+        jsonschema.validate(instance=registry, schema=node_registry_schema)
+
+
+class TestMirrorIcons:
+    """Test when the icons of online nodes are mirrored"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, example_node_name, example_registry, example_registry_content, requests_mock):
+        links = example_registry_content[example_node_name]["links"]
+        requests_mock.get(next(link["href"] for link in links if link["rel"] == "collection"), json=GOOD_SERVICES)
+        requests_mock.get(next(link["href"] for link in links if link["rel"] == "version"), json={"version": "1.2.3"})
+        self.icon_url = next(link["href"] for link in links if link["rel"] == "icon")
+        requests_mock.get(self.icon_url, content=b"\x00\x00\x01\x00icon")
+
+    def _icon(self, registry, name):
+        return next(link for link in registry[name]["links"] if link["rel"] == "icon")
+
+    def test_not_mirrored_by_default(self, example_node_name, updated_registry, requests_mock):
+        update.update_registry()
+        assert "mirror_href" not in self._icon(updated_registry.call_args.args[0], example_node_name)
+        assert self.icon_url not in [request.url for request in requests_mock.request_history]
+
+    def test_mirror_href_recorded(self, example_node_name, updated_registry, cache_dir, node_registry_schema):
+        update.update_registry(mirror_assets=True)
+        registry = updated_registry.call_args.args[0]
+        mirror_href = self._icon(registry, example_node_name)["mirror_href"]
+        assert mirror_href.startswith("assets/") and mirror_href.endswith(".ico")
+        assert (cache_dir / mirror_href).is_file()
+        jsonschema.validate(instance=registry, schema=node_registry_schema)
+
+
+class TestSelectiveUpdate:
+    """Test when only some of the nodes are selected to be updated"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, mocker, example_node_name, example_registry, example_registry_content):
+        other = deepcopy(example_registry_content[example_node_name])
+        other["name"] = "OtherNode"
+        other["status"] = "online"
+        other["last_updated"] = update._now()
+        example_registry.return_value["OtherNode"] = other
+        self.original = deepcopy(example_registry.return_value)
+        self.get = mocker.patch.object(update.requests.Session, "get")
+        self.get.side_effect = update.requests.exceptions.ConnectionError("message")
+
+    def _updated(self, updated_registry):
+        registry = updated_registry.call_args.args[0]
+        return [name for name in registry if registry[name] != self.original[name]]
+
+    def test_explicit_nodes(self, example_node_name, updated_registry):
+        update.update_registry(nodes=["OtherNode"])
+        assert self._updated(updated_registry) == ["OtherNode"]
+        assert updated_registry.call_args.args[0][example_node_name] == self.original[example_node_name]
+
+    def test_status_filter(self, example_node_name, updated_registry):
+        update.update_registry(statuses=["offline", "unresponsive"])
+        assert self.get.called
+        assert self.original[example_node_name]["status"] == "offline"
+        assert updated_registry.call_args.args[0]["OtherNode"] == self.original["OtherNode"]
+
+    def test_stale_after(self, example_node_name, updated_registry):
+        update.update_registry(stale_after=update.datetime.timedelta(hours=1))
+        assert self.get.called
+        assert updated_registry.call_args.args[0]["OtherNode"] == self.original["OtherNode"]
+
+    def test_criteria_combined(self, updated_registry):
+        update.update_registry(stale_after=update.datetime.timedelta(hours=1), statuses=["online"])
+        assert self.get.call_count == 0
+        assert updated_registry.call_args.args[0] == self.original
+
+    def test_history_only_has_selected_nodes(self, written_history):
+        update.update_registry(nodes=["OtherNode"])
+        assert [observation.node for observation in written_history.call_args.args[0]] == ["OtherNode"]
+
+    def test_explicit_nodes_bypass_circuit_breaker(self, example_node_name):
+        for _ in range(fetch.BREAKER_THRESHOLD):
+            update.update_registry(nodes=[example_node_name])
+        calls = self.get.call_count
+        update.update_registry(nodes=[example_node_name])
+        # the sibling request is cancelled when the first one fails, so a node is polled with one or two requests
+        assert self.get.call_count > calls
+
+    def test_named_nodes_respect_circuit_breaker(self, example_node_name):
+        for _ in range(fetch.BREAKER_THRESHOLD):
+            update.update_registry(nodes=[example_node_name])
+        calls = self.get.call_count
+        update.update_registry(nodes=[example_node_name], respect_breaker=True)
+        assert self.get.call_count == calls
+
+    def test_unknown_node(self):
+        with pytest.raises(ValueError):
+            update.update_registry(nodes=["NoSuchNode"])
+
+
+class TestServiceMemo:
+    """Test that services that were already migrated and validated are reused"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, mocker, example_node_name, example_registry, example_registry_content, requests_mock):
+        other = deepcopy(example_registry_content[example_node_name])
+        other["name"] = "OtherNode"
+        for link in other["links"]:
+            link["href"] = link["href"].replace("://", "://other.")
+        example_registry.return_value["OtherNode"] = other
+        for data in (example_registry_content[example_node_name], other):
+            links = data["links"]
+            # services without types so that they have to be migrated
+            services = deepcopy(GOOD_SERVICES)
+            for service in services["services"]:
+                service.pop("types")
+            requests_mock.get(next(link["href"] for link in links if link["rel"] == "collection"), json=services)
+            requests_mock.get(next(link["href"] for link in links if link["rel"] == "version"), json={"version": "1"})
+        self.apply_migrations = mocker.spy(update, "apply_migrations")
+        update.update_registry()
+
+    def test_identical_services_migrated_once(self):
+        first, second = self.apply_migrations.call_args_list
+        assert first.kwargs["services"] == [0, 1]
+        assert second.kwargs["services"] == []
+
+    def test_services_reused_in_next_run(self, example_registry, example_registry_content):
+        example_registry.return_value = {
+            name: data for name, data in example_registry.return_value.items() if name == "OtherNode"
+        }
+        update.update_registry()
+        assert self.apply_migrations.call_args.kwargs["services"] == []
+
+    def test_reused_services_are_migrated(self, example_node_name, updated_registry):
+        registry = updated_registry.call_args.args[0]
+        assert registry["OtherNode"]["services"] == registry[example_node_name]["services"]
+        assert registry["OtherNode"]["services"][0]["types"] == ["data", "wps", "wms", "wfs"]
+
+    def test_changed_service_validated(
+        self, example_registry, example_registry_content, requests_mock, mocker, updated_registry
+    ):
+        services = deepcopy(GOOD_SERVICES)
+        for service in services["services"]:
+            service.pop("types")
+        services["services"][1]["version"] = "bad_version"
+        links = example_registry.return_value["OtherNode"]["links"]
+        requests_mock.get(next(link["href"] for link in links if link["rel"] == "collection"), json=services)
+        validate_node = mocker.spy(update.RegistryValidator, "validate_node")
+        update.update_registry()
+        assert validate_node.call_args_list[-1].kwargs["services"] == [1]
+        assert updated_registry.call_args.args[0]["OtherNode"]["status"] == "invalid_configuration"
@@ -0,0 +1,244 @@
+import copy
+import json
+import os
+import subprocess
+
+import jsonschema
+import pytest
+
+import validation  # type: ignore
+
+
+@pytest.fixture(autouse=True)
+def no_network(requests_mock):
+    """Any request that is sent by the validator will fail since no urls are registered with requests_mock"""
+    return requests_mock
+
+
+@pytest.fixture
+def schema_content(request):
+    """Return the content contained in node_registry.schema.json"""
+    root_dir = os.path.dirname(os.path.dirname(request.fspath))
+    with open(os.path.join(root_dir, "node_registry.schema.json")) as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def example_registry_content(request):
+    """Return the content contained in ../doc/node_registry.example.json"""
+    root_dir = os.path.dirname(os.path.dirname(request.fspath))
+    with open(os.path.join(root_dir, "doc", "node_registry.example.json")) as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def validator(schema_content):
+    return validation.RegistryValidator(schema_content)
+
+
+def _break_version(node):
+    node["services"][0]["version"] = "bad_version"
+
+
+def _remove_links(node):
+    node["services"][0].pop("links")
+
+
+def _remove_service_doc(node):
+    node["services"][0]["links"] = [link for link in node["services"][0]["links"] if link["rel"] != "service-doc"]
+
+
+def _remove_node_version_link(node):
+    node["links"] = [link for link in node["links"] if link["rel"] != "version"]
+
+
+def _bad_status(node):
+    node["status"] = "something-bad"
+
+
+def test_valid_node(validator, example_registry_content):
+    for name, data in example_registry_content.items():
+        validator.validate_node(name, data)
+
+
+def test_valid_registry(validator, example_registry_content):
+    validator.validate_registry(example_registry_content)
+
+
+@pytest.mark.parametrize(
+    "break_node", [_break_version, _remove_links, _remove_service_doc, _remove_node_version_link, _bad_status]
+)
+def test_node_errors_match_registry_errors(validator, example_registry_content, schema_content, break_node):
+    registry = copy.deepcopy(example_registry_content)
+    name = list(registry)[0]
+    break_node(registry[name])
+    resolver = validation._resolver(schema_content, validation.load_schema_store())
+    with pytest.raises(jsonschema.exceptions.ValidationError) as expected:
+        jsonschema.validate(registry, schema_content, resolver=resolver)
+    with pytest.raises(jsonschema.exceptions.ValidationError) as exc:
+        validator.validate_node(name, registry[name])
+    assert exc.value.message == expected.value.message
+    assert list(exc.value.path) == list(expected.value.path)
+    assert list(exc.value.schema_path) == list(expected.value.schema_path)
+
+
+def test_valid_node_not_interpreted(validator, example_registry_content, mocker):
+    iter_errors = mocker.spy(validator._node_validator, "iter_errors")
+    for name, data in example_registry_content.items():
+        validator.validate_node(name, data)
+    assert not iter_errors.called
+
+
+def test_only_selected_services_validated(validator, example_registry_content):
+    name, data = next(iter(copy.deepcopy(example_registry_content).items()))
+    _break_version(data)
+    validator.validate_node(name, data, services=range(1, len(data["services"])))
+    with pytest.raises(jsonschema.exceptions.ValidationError):
+        validator.validate_node(name, data, services=[0])
+
+
+def test_selected_service_error_path(validator, example_registry_content):
+    name, data = next(iter(copy.deepcopy(example_registry_content).items()))
+    data["services"][1]["version"] = "bad_version"
+    with pytest.raises(jsonschema.exceptions.ValidationError) as exc:
+        validator.validate_node(name, data, services=[1])
+    assert list(exc.value.path) == [name, "services", 1, "version"]
+
+
+def test_compiled_cache(tmp_path, schema_content, example_registry_content):
+    validation.RegistryValidator(schema_content, compiled_cache_dir=str(tmp_path))
+    (cached,) = tmp_path.iterdir()
+    validator_ = validation.RegistryValidator(schema_content, compiled_cache_dir=str(tmp_path))
+    assert list(tmp_path.iterdir()) == [cached]
+    validator_.validate_registry(example_registry_content)
+
+
+def test_registry_rejects_bad_node_names(validator, example_registry_content):
+    registry = {"bad-name!": list(example_registry_content.values())[0]}
+    with pytest.raises(jsonschema.exceptions.ValidationError):
+        validator.validate_registry(registry)
+
+
+def test_no_network_access(validator, example_registry_content, no_network):
+    validator.validate_registry(example_registry_content)
+    assert not no_network.called
+
+
+def test_bundled_schema_matches_fixture(request):
+    with open(os.path.join(os.path.dirname(request.fspath), "fixtures", "links-schema-cache.json")) as f:
+        assert validation.load_schema_store()["https://json-schema.org/draft/2020-12/links"] == json.load(f)
+
+
+def test_cached_schema_takes_precedence(tmp_path, schema_content, example_registry_content):
+    with open(tmp_path / "links-2020-12.json", "w") as f:
+        json.dump({"type": "object", "required": ["rel", "href", "title"]}, f)
+    validator_ = validation.RegistryValidator(schema_content, schema_cache_dir=str(tmp_path))
+    with pytest.raises(jsonschema.exceptions.ValidationError) as exc:
+        validator_.validate_registry(example_registry_content)
+    assert exc.value.message == "'title' is a required property"
+
+
+def test_fingerprint(tmp_path, mocker, schema_content, validator):
+    assert validation.RegistryValidator(schema_content).fingerprint == validator.fingerprint
+    with open(tmp_path / "links-2020-12.json", "w") as f:
+        json.dump({"type": "object"}, f)
+    refreshed = validation.RegistryValidator(schema_content, schema_cache_dir=str(tmp_path))
+    assert refreshed.fingerprint != validator.fingerprint
+    mocker.patch.object(validation, "GENERATOR_VERSION", -1)
+    assert validation.RegistryValidator(schema_content).fingerprint != validator.fingerprint
+
+
+def test_refresh_schema_cache(tmp_path, no_network, request):
+    with open(os.path.join(os.path.dirname(request.fspath), "fixtures", "links-schema-cache.json")) as f:
+        content = f.read()
+    bundled = validation.load_schema_store()
+    for uri in validation.REMOTE_SCHEMAS:
+        no_network.get(uri, json=bundled[uri])
+    no_network.get("https://json-schema.org/draft/2020-12/links", text=content)
+    validation.refresh_schema_cache(str(tmp_path))
+    store = validation.load_schema_store(str(tmp_path))
+    assert store == {**bundled, "https://json-schema.org/draft/2020-12/links": json.loads(content)}
+    assert set(os.listdir(tmp_path)) == set(validation.REMOTE_SCHEMAS.values())
+
+
+@pytest.mark.parametrize("keyword", ["hrefSchema", "targetSchema", "headerSchema", "submissionSchema"])
+def test_link_schemas_resolved_from_store(validator, example_registry_content, no_network, keyword):
+    name, data = next(iter(copy.deepcopy(example_registry_content).items()))
+    data["links"][0][keyword] = {"type": "object"}
+    validator.validate_node(name, data)
+    data["links"][0][keyword] = {"type": 5}
+    with pytest.raises(jsonschema.exceptions.ValidationError):
+        validator.validate_node(name, data)
+    assert not no_network.called
+
+
+def test_json_pointer():
+    assert validation.json_pointer(["node", "services", 0, "a/b~c"]) == "/node/services/0/a~1b~0c"
+    assert validation.json_pointer([]) == ""
+
+
+class TestValidateChanges:
+    @pytest.fixture
+    def base(self, example_registry_content):
+        other = copy.deepcopy(example_registry_content["UofT"])
+        return {**example_registry_content, "Other": other}
+
+    @pytest.fixture
+    def proposed(self, base):
+        proposed = copy.deepcopy(base)
+        _break_version(proposed["Other"])
+        proposed["New"] = copy.deepcopy(base["UofT"])
+        return proposed
+
+    def test_changed_nodes(self, base, proposed):
+        assert validation.changed_nodes(base, proposed) == ["Other", "New"]
+
+    def test_only_changed_nodes_validated(self, validator, base, proposed):
+        results = validation.validate_changes(validator, base, proposed)
+        assert list(results) == ["Other", "New"]
+        assert [error["pointer"] for error in results["Other"]] == ["/Other/services/0/version"]
+        assert "bad_version" in results["Other"][0]["message"]
+        assert results["New"] == []
+
+    def test_bad_node_name(self, validator, base, proposed):
+        proposed["bad-name"] = proposed.pop("New")
+        errors = validation.validate_changes(validator, base, proposed)["bad-name"]
+        assert [error["pointer"] for error in errors] == [""]
+
+    def test_cached_results_reused(self, tmp_path, validator, base, proposed, mocker):
+        cache = validation.JsonStore(str(tmp_path))
+        first = validation.validate_changes(validator, base, proposed, cache, "fingerprint")
+        iter_registry_errors = mocker.spy(validation.RegistryValidator, "iter_registry_errors")
+        assert validation.validate_changes(validator, base, proposed, cache, "fingerprint") == first
+        assert iter_registry_errors.call_count == 0
+        validation.validate_changes(validator, base, proposed, cache, "other fingerprint")
+        assert iter_registry_errors.call_count == 2
+
+    def test_main(self, tmp_path, base, proposed, capsys, request):
+        def git(*args):
+            subprocess.run(["git", "-C", str(tmp_path), *args], check=True, capture_output=True)
+
+        registry = tmp_path / "node_registry.json"
+        registry.write_text(json.dumps(base))
+        git("init")
+        git("add", "node_registry.json")
+        git("-c", "user.name=test", "-c", "user.email=test@example.com", "commit", "-m", "base")
+        registry.write_text(json.dumps(proposed))
+        root_dir = os.path.dirname(os.path.dirname(request.fspath))
+        argv = [
+            "validate",
+            "--base",
+            "HEAD",
+            "--registry",
+            str(registry),
+            "--schema",
+            os.path.join(root_dir, "node_registry.schema.json"),
+            "--cache-dir",
+            str(tmp_path / "cache"),
+        ]
+        assert validation.main(argv) == 1
+        output = capsys.readouterr()
+        assert "validated 2 added or modified nodes, 1 nodes are unchanged" in output.out
+        assert "invalid Node named Other at /Other/services/0/version" in output.err
+        registry.write_text(json.dumps(base))
+        assert validation.main(argv) == 0